@@ -6,20 +6,45 @@ Single-admin auth: set ADMIN_PASSWORD env var. No accounts, no JWTs.
 import os
 import re
 import csv
+import codecs
+import json
 import base64
 import sqlite3
 import hashlib
 import hmac
 import time
 import io
+import gzip
+import shutil
 import struct
 import zlib
+import queue
+import atexit
+import signal
+import threading
+import bisect
+import ipaddress
+import zipfile
+import secrets
+import itertools
+import mimetypes
+import multiprocessing
+import socket
+import ssl
+import http.client
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
-from functools import wraps
-from flask import Flask, request, jsonify, redirect, Response, session
-from werkzeug.security import generate_password_hash, check_password_hash
-
-app = Flask(__name__, static_folder='static', template_folder='templates')
+from functools import wraps, lru_cache
+from html import unescape
+from urllib.parse import urljoin, urlsplit
+import click
+from flask import Flask, request, jsonify, redirect, Response, session, send_file, send_from_directory, g
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+
+app = Flask(__name__, static_folder=None, template_folder='templates')   # /static: see Frontend routes
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 if not app.config['SECRET_KEY']:
     raise RuntimeError("SECRET_KEY environment variable must be set")
@@ -34,27 +59,457 @@ DB_PATH  = os.environ.get('DB_PATH',  '/app/data/qrknit.db')
 BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5000').rstrip('/')
 APP_NAME = os.environ.get('APP_NAME', 'to.ALWISP')
 
+# SQLite tuning — applied once per connection; connections are kept per thread
+DB_CACHE_SIZE_KB   = int(os.environ.get('DB_CACHE_SIZE_KB', 8192))
+DB_MMAP_SIZE       = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+
 COOKIE_SECURE = os.environ.get('COOKIE_SECURE', 'false').lower() == 'true'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE']   = COOKIE_SECURE
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 
+# Click ingestion — redirects enqueue click events; a background writer
+# drains them into SQLite in batches.
+CLICK_QUEUE_SIZE     = int(os.environ.get('CLICK_QUEUE_SIZE', 10000))
+CLICK_BATCH_SIZE     = int(os.environ.get('CLICK_BATCH_SIZE', 500))
+CLICK_FLUSH_INTERVAL = float(os.environ.get('CLICK_FLUSH_INTERVAL', 1.0))
+CLICK_QUEUE_OVERFLOW = os.environ.get('CLICK_QUEUE_OVERFLOW', 'drop').lower()   # drop | block
+# Store device / browser / source on each click as it is written, so exports
+# and rollup rebuilds read them instead of re-parsing raw user agents
+CLICK_CLASSIFY_AT_WRITE = os.environ.get('CLICK_CLASSIFY_AT_WRITE', 'true').lower() == 'true'
+CLASSIFY_CACHE_SIZE     = int(os.environ.get('CLASSIFY_CACHE_SIZE', 4096))
+# User agents and referrers are stored once in lookup tables; each worker keeps
+# this many string → id mappings per table in memory
+INTERN_CACHE_SIZE       = int(os.environ.get('INTERN_CACHE_SIZE', 10000))
+
+# Click retention — raw clicks older than CLICK_RETENTION_DAYS (0 = keep forever)
+# are written to CLICK_ARCHIVE_DIR as gzip csv / jsonl (or just deleted with
+# `none`) and removed from SQLite; analytics keep reading the rollups.
+CLICK_RETENTION_DAYS = int(os.environ.get('CLICK_RETENTION_DAYS', 0))
+CLICK_ARCHIVE        = os.environ.get('CLICK_ARCHIVE', 'csv').lower()   # csv | jsonl | none
+CLICK_ARCHIVE_DIR    = os.environ.get('CLICK_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH), 'archive'))
+CLICK_PRUNE_INTERVAL = float(os.environ.get('CLICK_PRUNE_INTERVAL', 3600))
+CLICK_PRUNE_BATCH    = int(os.environ.get('CLICK_PRUNE_BATCH', 2000))
+CLICK_VACUUM_PAGES   = int(os.environ.get('CLICK_VACUUM_PAGES', 1000))
+
+# Short code allocation (see CodeAllocator)
+CODE_ALPHABET   = os.environ.get('CODE_ALPHABET', '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+CODE_LENGTH     = int(os.environ.get('CODE_LENGTH', 6))
+CODE_BLOCK_SIZE = int(os.environ.get('CODE_BLOCK_SIZE', 100))
+if len(set(CODE_ALPHABET)) != len(CODE_ALPHABET) or len(CODE_ALPHABET) < 2 \
+        or not re.fullmatch(r'[A-Za-z0-9_~.-]+', CODE_ALPHABET):
+    raise RuntimeError("CODE_ALPHABET must be at least 2 distinct URL-safe characters")
+
+# Code → link resolution cache used by redirects and QR lookups
+LINK_CACHE_SIZE          = int(os.environ.get('LINK_CACHE_SIZE', 10000))
+LINK_CACHE_TTL           = float(os.environ.get('LINK_CACHE_TTL', 300))
+LINK_CACHE_SYNC_INTERVAL = float(os.environ.get('LINK_CACHE_SYNC_INTERVAL', 1.0))
+LINK_COUNT_CACHE_TTL     = float(os.environ.get('LINK_COUNT_CACHE_TTL', 30))
+SEARCH_RANK_MAX          = int(os.environ.get('SEARCH_RANK_MAX', 2000))
+# /api/stats: fresh for STATS_CACHE_TTL seconds, then served stale while it refreshes, up to STATS_CACHE_STALE
+STATS_CACHE_TTL          = float(os.environ.get('STATS_CACHE_TTL', 30))
+STATS_CACHE_STALE        = float(os.environ.get('STATS_CACHE_STALE', 300))
+
+# Geo lookup — api (ip-api.com) | csv | mmdb | none. A GEO_DB_PATH ending in
+# .mmdb or .csv selects the matching offline provider when GEO_PROVIDER is unset.
+GEO_DB_PATH         = os.environ.get('GEO_DB_PATH', '')
+GEO_PROVIDER        = os.environ.get('GEO_PROVIDER', '').lower() or (
+    'mmdb' if GEO_DB_PATH.endswith('.mmdb') else 'csv' if GEO_DB_PATH else 'api')
+GEO_CACHE_SIZE      = int(os.environ.get('GEO_CACHE_SIZE', 50000))
+GEO_DEFERRED        = os.environ.get('GEO_DEFERRED', 'true').lower() == 'true'
+GEO_ENRICH_INTERVAL = float(os.environ.get('GEO_ENRICH_INTERVAL', 5.0))
+GEO_ENRICH_BATCH    = int(os.environ.get('GEO_ENRICH_BATCH', 40))
+GEO_API_PER_MINUTE  = int(os.environ.get('GEO_API_PER_MINUTE', 40))   # ip-api.com allows 45 req/min; shared by all workers
+
+# /api/fetch-title — titles are cached per URL; failures are cached for TITLE_NEGATIVE_TTL
+TITLE_FETCH_TIMEOUT   = float(os.environ.get('TITLE_FETCH_TIMEOUT', 5.0))
+TITLE_FETCH_WORKERS   = int(os.environ.get('TITLE_FETCH_WORKERS', 8))
+TITLE_FETCH_PER_HOST  = int(os.environ.get('TITLE_FETCH_PER_HOST', 2))
+TITLE_FETCH_MAX_BYTES = int(os.environ.get('TITLE_FETCH_MAX_BYTES', 65536))
+TITLE_CACHE_SIZE      = int(os.environ.get('TITLE_CACHE_SIZE', 2048))
+TITLE_CACHE_TTL       = float(os.environ.get('TITLE_CACHE_TTL', 3600))
+TITLE_NEGATIVE_TTL    = float(os.environ.get('TITLE_NEGATIVE_TTL', 300))
+
+# zlib level for antialiased/RGB QR PNGs; 1-bit images always use 9, which is cheap at 1 bpp
+QR_PNG_COMPRESS_LEVEL = int(os.environ.get('QR_PNG_COMPRESS_LEVEL', 6))
+
+# Rendered-QR cache — in-memory LRU bounded in bytes, plus an optional
+# content-addressed store on the data volume for short-link QR codes.
+QR_CACHE_MAX_BYTES = int(os.environ.get('QR_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+QR_CACHE_DISK      = os.environ.get('QR_CACHE_DISK', 'false').lower() == 'true'
+QR_CACHE_DIR       = os.environ.get('QR_CACHE_DIR', os.path.join(os.path.dirname(DB_PATH), 'qr-cache'))
+
+# Batch QR export — 0 workers renders in-process
+QR_BATCH_WORKERS  = int(os.environ.get('QR_BATCH_WORKERS', min(4, os.cpu_count() or 1)))
+QR_BATCH_MAX      = int(os.environ.get('QR_BATCH_MAX', 1000))
+# Single QR cache misses render on the same process pool, off the request thread's GIL
+QR_RENDER_OFFLOAD = os.environ.get('QR_RENDER_OFFLOAD', 'true').lower() == 'true'
+
+# Background jobs (see JobRunner)
+JOB_WORKERS       = int(os.environ.get('JOB_WORKERS', 1))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+JOB_MAX_ATTEMPTS  = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_STALE_AFTER   = float(os.environ.get('JOB_STALE_AFTER', 300))
+JOB_RESULT_TTL    = float(os.environ.get('JOB_RESULT_TTL', 86400))
+JOB_IMPORT_CHUNK  = int(os.environ.get('JOB_IMPORT_CHUNK', 5000))
+JOB_DIR           = os.environ.get('JOB_DIR', os.path.join(os.path.dirname(DB_PATH), 'jobs'))
+
+# /metrics — workers publish their counters to SQLite every METRICS_FLUSH_INTERVAL seconds
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5.0))
+METRICS_TOKEN          = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC         = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'
+
+# Frontend — the HTML shells and the /static files they reference (up to
+# ASSET_MAX_BYTES each) are held in memory, precompressed (gzip, plus brotli when
+# the `brotli` package is installed) and served with ETags; other /static files
+# are sent from disk. Fingerprinted static URLs (?v=…, as written into the shells)
+# are cached for STATIC_MAX_AGE seconds; ASSET_RELOAD re-reads files when they
+# change on disk.
+STATIC_MAX_AGE  = int(os.environ.get('STATIC_MAX_AGE', 365 * 86400))
+ASSET_RELOAD    = os.environ.get('ASSET_RELOAD', 'false').lower() == 'true'
+ASSET_MAX_BYTES = int(os.environ.get('ASSET_MAX_BYTES', 1024 * 1024))
+
+
+# ─────────────────────────────────────────────
+# Metrics
+# ─────────────────────────────────────────────
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """Counters, latency histograms and gauges, aggregated across gunicorn workers.
+
+    Hot paths only touch in-process dicts under a lock. A daemon thread in
+    each worker writes the cumulative snapshot to `metrics_snapshots` (one
+    row per worker); /metrics only reads, summing every row. The same thread
+    folds rows of workers that stopped flushing into a single 'retired' row,
+    so counters never go backwards when gunicorn recycles a worker. Gauges are sampled from
+    registered callbacks at flush time and are summed over live workers.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = max(0.5, flush_interval)
+        self._counters = {}
+        self._hists    = {}
+        self._gauges   = {}      # name → (callback, per_worker)
+        self._help     = {}
+        self._lock     = threading.Lock()
+        self._thread   = None
+        self._pid      = os.getpid()
+        self.worker    = None
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        i   = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            h[i]  += 1
+            h[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, help_text, per_worker=True):
+        """Register `fn() → {labels tuple: value}` (or a plain number) as gauge `name`.
+
+        Per-worker gauges are sampled at flush time and summed over workers;
+        the others read shared state (the database) and are sampled once, by
+        whichever worker serves the scrape.
+        """
+        def register(fn):
+            self._gauges[name] = (fn, per_worker)
+            self._help[name]   = help_text
+            return fn
+        return register
+
+    def _sample(self, per_worker):
+        out = []
+        for name, (fn, local) in list(self._gauges.items()):
+            if local != per_worker:
+                continue
+            try:
+                value = fn()
+            except Exception:
+                continue
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            out += [[name, [list(p) for p in labels], v] for labels, v in items]
+        return out
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._counters, self._hists = {}, {}   # inherited across fork; the parent reports its own
+                self._pid = os.getpid()
+            self.worker  = f'{socket.gethostname()}:{self._pid}:{int(time.time())}'
+            self._thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _snapshot(self):
+        gauges = self._sample(per_worker=True)
+        with self._lock:
+            return {
+                'c': [[n, list(l), v] for (n, l), v in self._counters.items()],
+                'h': [[n, list(l), list(h)] for (n, l), h in self._hists.items()],
+                'g': gauges,
+            }
+
+    def flush(self):
+        if self.worker is None:
+            return
+        data = json.dumps(self._snapshot())
+        with get_db() as conn:
+            conn.execute('INSERT OR REPLACE INTO metrics_snapshots (worker, data, updated_at) VALUES (?,?,?)',
+                         (self.worker, data, time.time()))
+
+    def _stale_before(self):
+        return time.time() - max(60.0, self.flush_interval * 6)
+
+    def retire_stale(self):
+        """Fold the rows of workers that stopped flushing into the 'retired' row."""
+        stale_before = self._stale_before()
+        with get_db() as conn:
+            if not conn.execute("SELECT 1 FROM metrics_snapshots WHERE worker!='retired' AND updated_at<? LIMIT 1",
+                                (stale_before,)).fetchone():
+                return
+            conn.execute('BEGIN IMMEDIATE')   # another worker may be folding the same rows
+            rows = conn.execute("SELECT worker, data FROM metrics_snapshots "
+                                "WHERE worker='retired' OR updated_at<?", (stale_before,)).fetchall()
+            retired = {'c': {}, 'h': {}, 'g': {}}
+            for r in rows:
+                self._merge(retired, json.loads(r['data']), gauges=False)
+            data = json.dumps({'c': [[n, list(l), v] for (n, l), v in retired['c'].items()],
+                               'h': [[n, list(l), h] for (n, l), h in retired['h'].items()]})
+            conn.executemany('DELETE FROM metrics_snapshots WHERE worker=?',
+                             [(r['worker'],) for r in rows if r['worker'] != 'retired'])
+            conn.execute("INSERT OR REPLACE INTO metrics_snapshots (worker, data, updated_at) "
+                         "VALUES ('retired', ?, ?)", (data, time.time()))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self.retire_stale()
+            except Exception as exc:
+                app.logger.warning('metrics flush failed: %s', exc)
+
+    @staticmethod
+    def _merge(into, snap, gauges=True):
+        for n, l, v in snap.get('c', []):
+            key = (n, tuple(map(tuple, l)))
+            into['c'][key] = into['c'].get(key, 0) + v
+        for n, l, h in snap.get('h', []):
+            key = (n, tuple(map(tuple, l)))
+            cur = into['h'].get(key)
+            into['h'][key] = h[:] if cur is None else [a + b for a, b in zip(cur, h)]
+        if gauges:
+            for n, l, v in snap.get('g', []):
+                key = (n, tuple(map(tuple, l)))
+                into['g'][key] = into['g'].get(key, 0) + v
+
+    def collect(self):
+        """Every worker's totals merged; this worker's come live rather than from its last flush.
+
+        Read-only: rows of workers that stopped flushing still count, but
+        only towards counters and histograms, until a flush thread retires them.
+        """
+        self.ensure_started()
+        stale_before = self._stale_before()
+        total = {'c': {}, 'h': {}, 'g': {}}
+        with get_db() as conn:
+            rows = conn.execute('SELECT worker, data, updated_at FROM metrics_snapshots WHERE worker!=?',
+                                (self.worker,)).fetchall()
+        live = {r['worker'] for r in rows if r['worker'] != 'retired' and r['updated_at'] >= stale_before}
+        for r in rows:
+            self._merge(total, json.loads(r['data']), gauges=r['worker'] in live)
+        self._merge(total, self._snapshot())
+        self._merge(total, {'g': self._sample(per_worker=False)})
+        total['workers'] = len(live) + 1
+        return total
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        total = self.collect()
+        out, typed = [], set()
+
+        def head(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    out.append(f'# HELP {name} {self._help[name]}')
+                out.append(f'# TYPE {name} {kind}')
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+        for (name, labels), v in sorted(total['c'].items()):
+            head(name, 'counter')
+            out.append(f'{name}{fmt(labels)} {v}')
+        for (name, labels), h in sorted(total['h'].items()):
+            head(name, 'histogram')
+            running = 0
+            for le, n in zip(LATENCY_BUCKETS + ('+Inf',), h[:-1]):
+                running += n
+                out.append(f'{name}_bucket{fmt(labels, [("le", le)])} {running}')
+            out.append(f'{name}_sum{fmt(labels)} {h[-1]:.6f}')
+            out.append(f'{name}_count{fmt(labels)} {running}')
+        for (name, labels), v in sorted(total['g'].items()):
+            head(name, 'gauge')
+            out.append(f'{name}{fmt(labels)} {v}')
+        head('qrknit_workers', 'gauge')
+        out.append(f"qrknit_workers {total['workers']}")
+        return '\n'.join(out) + '\n'
+
+
+metrics = Metrics(METRICS_FLUSH_INTERVAL)
+metrics.describe('http_request_duration_seconds', 'Time to build the response, by route, method and status class')
+metrics.describe('db_query_duration_seconds', 'Named SQL query latency on hot paths')
+metrics.describe('db_connect_duration_seconds', 'Time to open and tune a new SQLite connection')
+metrics.describe('redirects_total', 'Short-link redirects by outcome')
+metrics.describe('qr_render_duration_seconds', 'QR render time on cache misses, by style, size bucket and format')
+metrics.describe('qr_pool_broken_total', 'QR render pools discarded because a worker process died')
+metrics.describe('geo_lookup_duration_seconds', 'Geo resolver latency, by provider')
+metrics.describe('geo_lookup_failures_total', 'Geo resolver lookups that raised, by provider')
+metrics.describe('qrknit_workers', 'Workers that published metrics recently')
+
 
 # ─────────────────────────────────────────────
 # Database
 # ─────────────────────────────────────────────
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+_db_local = threading.local()
+_db_lock  = threading.Lock()
+_db_conns = {}                              # thread ident → connection (this process)
+_db_stats = {'opened': 0, 'closed': 0, 'checkouts': 0}
+
+class DbConnection(sqlite3.Connection):
+    """sqlite3 connection whose `with` blocks nest.
+
+    Only the outermost block commits (or rolls back on an exception). An
+    inner block entered while a transaction is open runs in a SAVEPOINT, so
+    an exception it raises undoes just its own writes; one entered outside a
+    transaction can still `BEGIN IMMEDIATE`, and what it starts is committed
+    by the outermost block (or rolled back if the inner block fails).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._savepoints = []   # one per open `with` block: savepoint name or None
+
+    def __enter__(self):
+        depth = len(self._savepoints)
+        if depth and self.in_transaction:
+            self.execute(f'SAVEPOINT nest{depth}')
+            self._savepoints.append(f'nest{depth}')
+        else:
+            self._savepoints.append(None)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        savepoint = self._savepoints.pop()
+        if not self._savepoints:
+            return super().__exit__(exc_type, exc, tb)
+        if savepoint is not None:
+            if exc_type is not None:
+                self.execute(f'ROLLBACK TO {savepoint}')
+            self.execute(f'RELEASE {savepoint}')
+        elif exc_type is not None and self.in_transaction:
+            self.rollback()   # begun inside this block, so nothing of the outer block's is lost
+        return False
+
+    def commit(self):
+        super().commit()
+        self._savepoints = [None] * len(self._savepoints)   # ended with the transaction
+
+    def rollback(self):
+        super().rollback()
+        self._savepoints = [None] * len(self._savepoints)
+
+def _connect():
+    start = time.perf_counter()
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=DB_STATEMENT_CACHE, factory=DbConnection)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    metrics.observe('db_connect_duration_seconds', time.perf_counter() - start)
+    return conn
+
+def get_db():
+    """Return this thread's SQLite connection, opening and tuning it on first use.
+
+    Use as `with get_db() as conn:` — the outermost block commits or rolls
+    back (see DbConnection), and the connection (with its prepared-statement
+    cache) stays open for the next request on this thread.
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = _connect()
+        _db_local.conn = conn
+        _db_local.pid  = os.getpid()
+        with _db_lock:
+            if any(pid != os.getpid() for pid, _ in _db_conns):
+                _db_conns.clear()           # inherited across fork; not ours to close
+            # Connections refuse close() from any thread but their own, so a
+            # dead thread's is only dropped here and released when collected.
+            alive = {t.ident for t in threading.enumerate()}
+            for key in [k for k in _db_conns if k[1] not in alive]:
+                del _db_conns[key]
+                _db_stats['closed'] += 1
+            _db_conns[(os.getpid(), threading.get_ident())] = conn
+            _db_stats['opened'] += 1
+    with _db_lock:
+        _db_stats['checkouts'] += 1
     return conn
 
+def db_pool_stats():
+    return {'connections': len(_db_conns), **_db_stats}
+
+@app.teardown_appcontext
+def _release_db(exc):
+    # Never let a request leave a transaction open on the shared connection
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and _db_local.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     with get_db() as conn:
+        # Lets click retention hand freed pages back to the OS a step at a time.
+        # Only takes effect on a new database (and before WAL is switched on);
+        # see `flask prune-clicks --compact` for existing ones.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")   # persistent — stored in the database file
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS users (
                 id            INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -82,6 +537,19 @@ def init_db():
                 user_agent TEXT,
                 FOREIGN KEY (link_id) REFERENCES links(id)
             );
+            -- Distinct user agents / referrers, referenced by clicks.ua_id / referrer_id
+            -- (see Interner). Labels are filled in when CLICK_CLASSIFY_AT_WRITE is on.
+            CREATE TABLE IF NOT EXISTS user_agents (
+                id      INTEGER PRIMARY KEY,
+                value   TEXT NOT NULL UNIQUE,
+                device  TEXT,
+                browser TEXT
+            );
+            CREATE TABLE IF NOT EXISTS referrers (
+                id     INTEGER PRIMARY KEY,
+                value  TEXT NOT NULL UNIQUE,
+                source TEXT
+            );
             CREATE TABLE IF NOT EXISTS tags (
                 id   INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT UNIQUE NOT NULL
@@ -102,8 +570,67 @@ def init_db():
                 created_at TEXT NOT NULL,
                 is_read    INTEGER DEFAULT 0
             );
+            CREATE TABLE IF NOT EXISTS app_meta (
+                key   TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            );
+            INSERT OR IGNORE INTO app_meta (key, value) VALUES ('link_cache_gen', 0);
+            INSERT OR IGNORE INTO app_meta (key, value) VALUES ('stats_gen', 0);
+            -- One cumulative metrics snapshot per worker (see Metrics)
+            CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                worker     TEXT PRIMARY KEY,
+                data       TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            -- Click rollups, maintained by the click writer (see record_rollups)
+            CREATE TABLE IF NOT EXISTS click_daily (
+                link_id INTEGER NOT NULL,
+                day     TEXT    NOT NULL,
+                count   INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (link_id, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS click_hourly (
+                link_id INTEGER NOT NULL,
+                day     TEXT    NOT NULL,
+                hour    INTEGER NOT NULL,
+                count   INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (link_id, day, hour)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS click_dims (
+                link_id INTEGER NOT NULL,
+                day     TEXT    NOT NULL,
+                dim     TEXT    NOT NULL,    -- source | device | browser | country
+                value   TEXT    NOT NULL,
+                count   INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (link_id, dim, day, value)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_click_daily_day ON click_daily(day);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id               INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind             TEXT    NOT NULL,
+                user_id          INTEGER,
+                status           TEXT    NOT NULL DEFAULT 'queued',  -- queued|running|done|failed|cancelled
+                params           TEXT    NOT NULL DEFAULT '{}',
+                progress         INTEGER NOT NULL DEFAULT 0,
+                total            INTEGER,
+                checkpoint       TEXT,
+                result           TEXT,
+                result_file      TEXT,
+                result_name      TEXT,
+                result_type      TEXT,
+                error            TEXT,
+                attempts         INTEGER NOT NULL DEFAULT 0,
+                max_attempts     INTEGER NOT NULL DEFAULT 3,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at       TEXT    NOT NULL,
+                started_at       TEXT,
+                finished_at      TEXT,
+                heartbeat_at     REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+            CREATE INDEX IF NOT EXISTS idx_jobs_user   ON jobs(user_id, id);
             CREATE INDEX IF NOT EXISTS idx_links_code  ON links(code);
-            CREATE INDEX IF NOT EXISTS idx_clicks_link ON clicks(link_id);
+            CREATE INDEX IF NOT EXISTS idx_clicks_link_at ON clicks(link_id, clicked_at);
             CREATE INDEX IF NOT EXISTS idx_clicks_at   ON clicks(clicked_at);
         """)
         # Idempotent migrations — safe to run on existing databases
@@ -112,11 +639,86 @@ def init_db():
             "ALTER TABLE links ADD COLUMN user_id INTEGER REFERENCES users(id)",
             "ALTER TABLE clicks ADD COLUMN ip_address TEXT",
             "ALTER TABLE clicks ADD COLUMN country TEXT",
+            "ALTER TABLE clicks ADD COLUMN source TEXT",
+            "ALTER TABLE clicks ADD COLUMN device TEXT",
+            "ALTER TABLE clicks ADD COLUMN browser TEXT",
+            "ALTER TABLE clicks ADD COLUMN ua_id INTEGER REFERENCES user_agents(id)",
+            "ALTER TABLE clicks ADD COLUMN referrer_id INTEGER REFERENCES referrers(id)",
         ]:
             try:
                 conn.execute(migration)
             except Exception:
                 pass
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_clicks_geo_pending ON clicks(ip_address) "
+                     "WHERE country='Pending'")
+        # Clicks with their user agent / referrer resolved. The text and label
+        # columns on `clicks` itself are only set on rows encode_clicks() has
+        # not converted yet.
+        conn.execute("""
+            CREATE VIEW IF NOT EXISTS click_events AS
+            SELECT c.id, c.link_id, c.clicked_at, c.ip_address, c.country,
+                   COALESCE(r.value, c.referrer)   AS referrer,
+                   COALESCE(u.value, c.user_agent) AS user_agent,
+                   COALESCE(r.source, c.source)    AS source,
+                   COALESCE(u.device, c.device)    AS device,
+                   COALESCE(u.browser, c.browser)  AS browser
+            FROM clicks c
+            LEFT JOIN user_agents u ON u.id=c.ua_id
+            LEFT JOIN referrers   r ON r.id=c.referrer_id""")
+        # idx_clicks_link_at covers every lookup the old single-column index served
+        conn.execute("DROP INDEX IF EXISTS idx_clicks_link")
+        # Match the /api/links ORDER BY so listings walk an index instead of sorting
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_links_list ON links"
+                     "(is_active, is_pinned DESC, created_at DESC, id DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_links_user_list ON links"
+                     "(user_id, is_active, is_pinned DESC, created_at DESC, id DESC)")
+        init_search_index(conn)
+
+
+# Link search: an external-content FTS5 index over links(code, title, long_url),
+# kept in sync by triggers. unicode61 treats every non-alphanumeric character
+# as a separator, so URLs are indexed as their scheme, host labels and path
+# segments ("https://docs.example.com/api/v2" → https docs example com api v2).
+LINK_FTS = False
+
+def init_search_index(conn):
+    global LINK_FTS
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='links_fts'").fetchone()
+    if not exists:
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE links_fts USING fts5(
+                    code, title, long_url,
+                    content='links', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )""")
+        except sqlite3.OperationalError:
+            return   # SQLite built without FTS5: list_links falls back to LIKE
+        conn.execute("INSERT INTO links_fts (links_fts) VALUES ('rebuild')")
+        # Rank matches in code above title above URL
+        conn.execute("INSERT INTO links_fts (links_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS links_fts_ai AFTER INSERT ON links BEGIN
+            INSERT INTO links_fts (rowid, code, title, long_url)
+            VALUES (new.id, new.code, new.title, new.long_url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS links_fts_ad AFTER DELETE ON links BEGIN
+            INSERT INTO links_fts (links_fts, rowid, code, title, long_url)
+            VALUES ('delete', old.id, old.code, old.title, old.long_url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS links_fts_au AFTER UPDATE OF code, title, long_url ON links BEGIN
+            INSERT INTO links_fts (links_fts, rowid, code, title, long_url)
+            VALUES ('delete', old.id, old.code, old.title, old.long_url);
+            INSERT INTO links_fts (rowid, code, title, long_url)
+            VALUES (new.id, new.code, new.title, new.long_url);
+        END;
+    """)
+    LINK_FTS = True
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{w}"*' for w in words)
 
 def seed_admin():
     """Upsert the admin account from env vars on every startup."""
@@ -164,55 +766,271 @@ def admin_required(f):
 # QR Generator
 # ─────────────────────────────────────────────
 
-def generate_qr_png(data: str, size: int = 300, fg=(0,0,0), bg=(255,255,255),
+QR_STYLES      = ('square', 'rounded', 'dots', 'vertical', 'horizontal')
+QR_FORMATS     = ('png', 'svg')
+QR_SUPERSAMPLE = 4   # sprite antialiasing factor, as in qrcode's styled drawers
+
+@lru_cache(maxsize=256)
+def _qr_sprites(style, scale):
+    """Antialiased 'L' masks for one module of `style` at `scale` px.
+
+    Indexed by neighbour bits — rounded: N=1 E=2 S=4 W=8; bars: 1 = neighbour
+    before (N/W), 2 = neighbour after (S/E). Drawn once at QR_SUPERSAMPLE×
+    and shrunk, then reused for every module of every QR at that scale.
+    """
+    from PIL import Image, ImageDraw
+    big = scale * QR_SUPERSAMPLE
+
+    def sprite(draw):
+        im = Image.new('L', (big, big), 0)
+        draw(ImageDraw.Draw(im))
+        return im.resize((scale, scale), Image.LANCZOS)
+
+    def rounded_box(d, box, r, corners):
+        # ImageDraw.rounded_rectangle rejects some corner combinations; draw
+        # the box, then cut each rounded corner and fill it with a circle.
+        x0, y0, x1, y1 = box
+        d.rectangle(box, fill=255)
+        for rounded, left, top in zip(corners, (1, 0, 0, 1), (1, 1, 0, 0)):
+            if not rounded:
+                continue
+            qx = x0 if left else x1 - r + 1
+            qy = y0 if top else y1 - r + 1
+            ex = x0 if left else x1 - 2 * r + 1
+            ey = y0 if top else y1 - 2 * r + 1
+            d.rectangle((qx, qy, qx + r - 1, qy + r - 1), fill=0)
+            d.ellipse((ex, ey, ex + 2 * r - 1, ey + 2 * r - 1), fill=255)
+
+    if style == 'dots':
+        return [sprite(lambda d: d.ellipse((0, 0, big - 1, big - 1), fill=255))]
+    if style == 'rounded':
+        sprites = []
+        for bits in range(16):
+            n, e, s, w = bits & 1, bits & 2, bits & 4, bits & 8
+            corners = (not (n or w), not (n or e), not (s or e), not (s or w))
+            sprites.append(sprite(lambda d, c=corners: rounded_box(
+                d, (0, 0, big - 1, big - 1), big // 2, c)))
+        return sprites
+    thick = int(big * 0.8)
+    inset = (big - thick) // 2
+    sprites = []
+    for bits in range(4):
+        before, after = not bits & 1, not bits & 2
+        if style == 'vertical':
+            box, corners = (inset, 0, inset + thick - 1, big - 1), (before, before, after, after)
+        else:
+            box, corners = (0, inset, big - 1, inset + thick - 1), (before, after, after, before)
+        sprites.append(sprite(lambda d, b=box, c=corners: rounded_box(d, b, thick // 2, c)))
+    return sprites
+
+
+def _qr_mask(matrix, border, scale, style):
+    """Rasterize a module matrix (border included) to an 'L' mask, 255 = dark."""
+    from PIL import Image
+    n    = len(matrix)
+    px   = n * scale
+    base = Image.frombytes('L', (n, n), bytes(255 if v else 0 for row in matrix for v in row))
+    if style not in ('rounded', 'dots', 'vertical', 'horizontal'):
+        return base.resize((px, px), Image.NEAREST)
+
+    mask = Image.new('L', (px, px), 0)
+    # Finder patterns stay square, matching StyledPilImage's default eye drawer
+    lo, hi = border, n - border - 7
+    eyes   = ((lo, lo), (lo, hi), (hi, lo))
+    for r0, c0 in eyes:
+        eye = base.crop((c0, r0, c0 + 7, r0 + 7)).resize((7 * scale, 7 * scale), Image.NEAREST)
+        mask.paste(eye, (c0 * scale, r0 * scale))
+
+    sprites = _qr_sprites(style, scale)
+    for r in range(n):
+        row = matrix[r]
+        for c in range(n):
+            if not row[c] or any(0 <= r - r0 < 7 and 0 <= c - c0 < 7 for r0, c0 in eyes):
+                continue
+            north = r > 0 and matrix[r - 1][c]
+            south = r < n - 1 and matrix[r + 1][c]
+            west  = c > 0 and row[c - 1]
+            east  = c < n - 1 and row[c + 1]
+            if style == 'dots':
+                idx = 0
+            elif style == 'rounded':
+                idx = (1 if north else 0) | (2 if east else 0) | (4 if south else 0) | (8 if west else 0)
+            elif style == 'vertical':
+                idx = (1 if north else 0) | (2 if south else 0)
+            else:
+                idx = (1 if west else 0) | (2 if east else 0)
+            mask.paste(sprites[idx], (c * scale, r * scale))
+    return mask
+
+
+def _qr_matrix(data, logo=False):
+    import qrcode as qrc
+    ec = qrc.constants.ERROR_CORRECT_H if logo else qrc.constants.ERROR_CORRECT_M
+    qr = qrc.QRCode(error_correction=ec, border=2)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix(), qr.border
+
+
+def _encode_palette_png(mask, fg, bg):
+    """Encode an 'L' coverage mask as a palette PNG: 1-bit when it is pure two-colour."""
+    from PIL import Image
+    levels = {v for _, v in mask.getcolors(256)}
+    if levels <= {0, 255}:
+        img = Image.frombytes('P', mask.size, mask.point(lambda v: 1 if v else 0).tobytes())
+        img.putpalette(bytes(bg) + bytes(fg))
+        bits, level = 1, 9
+    else:
+        # Antialiased edges: 256 entries interpolated from bg to fg
+        img = Image.frombytes('P', mask.size, mask.tobytes())
+        img.putpalette(b''.join(
+            bytes(round(b + (f - b) * v / 255) for f, b in zip(fg, bg)) for v in range(256)
+        ))
+        bits, level = 8, QR_PNG_COMPRESS_LEVEL
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', bits=bits, compress_level=level)
+    return buf.getvalue()
+
+
+def _svg_num(v):
+    return f'{v:.3f}'.rstrip('0').rstrip('.')
+
+
+def generate_qr_svg(data: str, size: int = 300, fg=(0,0,0), bg=(255,255,255),
                     style: str = 'square', logo_bytes: bytes = None) -> bytes:
-    """Generate QR PNG. Supports dot styles and logo overlay when qrcode[pil] is installed."""
-    try:
-        import qrcode as qrc
-        from PIL import Image
+    """Generate a QR code as SVG straight from the module matrix.
+
+    Coordinates are in modules (viewBox = matrix size) and dark modules are
+    merged into a single path: row runs for square modules and finder
+    patterns, column/row runs for bars, one subpath per dot or rounded module.
+    """
+    matrix, border = _qr_matrix(data, logo=bool(logo_bytes))
+    n    = len(matrix)
+    lo   = border
+    hi   = n - border - 7
+    eyes = ((lo, lo), (lo, hi), (hi, lo))
+    fmt  = _svg_num
+    styled = style in ('rounded', 'dots', 'vertical', 'horizontal')
+
+    def in_eye(r, c):
+        return any(0 <= r - r0 < 7 and 0 <= c - c0 < 7 for r0, c0 in eyes)
+
+    def square(r, c):
+        return matrix[r][c] and (not styled or in_eye(r, c))
+
+    def dark(r, c):
+        # Styled (non-finder) module — finder patterns are drawn as squares
+        return 0 <= r < n and 0 <= c < n and matrix[r][c] and not in_eye(r, c)
+
+    parts = []
+    # Square modules (and the square finder patterns of every style) as row runs
+    for r in range(n):
+        c = 0
+        while c < n:
+            if square(r, c):
+                start = c
+                while c < n and square(r, c):
+                    c += 1
+                parts.append(f'M{start} {r}h{c - start}v1h-{c - start}z')
+            else:
+                c += 1
+
+    if style == 'dots':
+        parts += [f'M{c} {fmt(r + .5)}a.5 .5 0 1 0 1 0a.5 .5 0 1 0-1 0z'
+                  for r in range(n) for c in range(n) if dark(r, c)]
+    elif style == 'rounded':
+        for r in range(n):
+            for c in range(n):
+                if not dark(r, c):
+                    continue
+                north, south = dark(r - 1, c), dark(r + 1, c)
+                west, east   = dark(r, c - 1), dark(r, c + 1)
+                tl, tr = not (north or west), not (north or east)
+                br, bl = not (south or east), not (south or west)
+                d  = f'M{fmt(c + .5 * tl)} {r}H{fmt(c + 1 - .5 * tr)}'
+                d += 'a.5 .5 0 0 1 .5 .5' if tr else ''
+                d += f'V{fmt(r + 1 - .5 * br)}'
+                d += 'a.5 .5 0 0 1-.5 .5' if br else ''
+                d += f'H{fmt(c + .5 * bl)}'
+                d += 'a.5 .5 0 0 1-.5-.5' if bl else ''
+                d += f'V{fmt(r + .5 * tl)}'
+                d += 'a.5 .5 0 0 1 .5-.5' if tl else ''
+                parts.append(d + 'z')
+    elif style in ('vertical', 'horizontal'):
+        vertical = style == 'vertical'
+        for a in range(n):
+            b = 0
+            while b < n:
+                r, c = (b, a) if vertical else (a, b)
+                if not dark(r, c):
+                    b += 1
+                    continue
+                start = b
+                while b < n and dark(*((b, a) if vertical else (a, b))):
+                    b += 1
+                run = fmt(b - start - .8)
+                if vertical:
+                    parts.append(f'M{fmt(a + .1)} {fmt(start + .4)}a.4 .4 0 0 1 .8 0'
+                                 f'v{run}a.4 .4 0 0 1-.8 0z')
+                else:
+                    parts.append(f'M{fmt(start + .4)} {fmt(a + .1)}h{run}'
+                                 f'a.4 .4 0 0 1 0 .8h-{run}a.4 .4 0 0 1 0-.8z')
+
+    fg_hex = '#%02x%02x%02x' % tuple(fg)
+    bg_hex = '#%02x%02x%02x' % tuple(bg)
+    crisp  = '' if styled else ' shape-rendering="crispEdges"'
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {n} {n}" width="{size}" height="{size}"{crisp}>',
+        f'<rect width="{n}" height="{n}" fill="{bg_hex}"/>',
+        f'<path fill="{fg_hex}" d="{"".join(parts)}"/>',
+    ]
+    if logo_bytes:
+        # Same geometry as the PNG overlay, converted from pixels to modules
+        unit = n / size
+        logo = size // 4 * unit
+        pad  = max(2, size // 100) * unit
+        zone = logo + pad * 2
+        at   = (n - zone) / 2
+        out.append(f'<rect x="{fmt(at)}" y="{fmt(at)}" width="{fmt(zone)}" height="{fmt(zone)}" fill="{bg_hex}"/>')
+        out.append(f'<image x="{fmt(at + pad)}" y="{fmt(at + pad)}" width="{fmt(logo)}" height="{fmt(logo)}" '
+                   f'href="data:image/png;base64,{base64.b64encode(_logo_png(logo_bytes)).decode()}"/>')
+    out.append('</svg>')
+    return '\n'.join(out).encode('utf-8')
+
+
+def _logo_png(logo_bytes):
+    """Normalise an uploaded logo to PNG for embedding."""
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.open(io.BytesIO(logo_bytes)).convert('RGBA').save(buf, 'PNG')
+    return buf.getvalue()
 
-        ec = qrc.constants.ERROR_CORRECT_H if logo_bytes else qrc.constants.ERROR_CORRECT_M
-        qr = qrc.QRCode(error_correction=ec, border=2)
-        qr.add_data(data)
-        qr.make(fit=True)
 
-        pil_img = None
-        if style and style != 'square':
-            try:
-                from qrcode.image.styledpil import StyledPilImage
-                from qrcode.image.styles.moduledrawers.pil import (
-                    RoundedModuleDrawer, CircleModuleDrawer,
-                    VerticalBarsDrawer, HorizontalBarsDrawer,
-                )
-                _drawers = {
-                    'rounded':    RoundedModuleDrawer,
-                    'dots':       CircleModuleDrawer,
-                    'vertical':   VerticalBarsDrawer,
-                    'horizontal': HorizontalBarsDrawer,
-                }
-                drawer_cls = _drawers.get(style)
-                if drawer_cls:
-                    qr_obj = qr.make_image(
-                        image_factory=StyledPilImage,
-                        module_drawer=drawer_cls(),
-                        fill_color=fg,
-                        back_color=bg,
-                    )
-                    tmp = io.BytesIO()
-                    qr_obj.save(tmp, 'PNG')
-                    tmp.seek(0)
-                    pil_img = Image.open(tmp).convert('RGB')
-            except (ImportError, Exception):
-                pass
+def generate_qr_png(data: str, size: int = 300, fg=(0,0,0), bg=(255,255,255),
+                    style: str = 'square', logo_bytes: bytes = None, palette: bool = True) -> bytes:
+    """Generate QR PNG. Supports dot styles and logo overlay when qrcode[pil] is installed.
+
+    The module matrix is rasterized straight onto one canvas at an integer
+    module scale; any remainder of `size` is added to the quiet zone.
+    Without a logo the result is a palette PNG (1-bit for square modules);
+    pass palette=False for 24-bit RGB.
+    """
+    try:
+        from PIL import Image
 
-        if pil_img is None:
-            qr_obj = qr.make_image(fill_color=fg, back_color=bg)
-            tmp = io.BytesIO()
-            qr_obj.save(tmp, 'PNG')
-            tmp.seek(0)
-            pil_img = Image.open(tmp).convert('RGB')
+        matrix, border = _qr_matrix(data, logo=bool(logo_bytes))
+        scale  = max(1, size // len(matrix))
+        mask   = _qr_mask(matrix, border, scale, style)
+        if mask.size[0] > size:
+            mask = mask.resize((size, size), Image.BOX)
+        off = (size - mask.size[0]) // 2
+        if palette and not logo_bytes:
+            canvas = Image.new('L', (size, size), 0)
+            canvas.paste(mask, (off, off))
+            return _encode_palette_png(canvas, tuple(fg), tuple(bg))
 
-        pil_img = pil_img.resize((size, size), Image.LANCZOS)
+        pil_img = Image.new('RGB', (size, size), tuple(bg))
+        pil_img.paste(tuple(fg), (off, off, off + mask.size[0], off + mask.size[1]), mask)
 
         if logo_bytes:
             from PIL import ImageDraw
@@ -238,7 +1056,7 @@ def generate_qr_png(data: str, size: int = 300, fg=(0,0,0), bg=(255,255,255),
             pil_img = pil_img.convert('RGB')
 
         buf = io.BytesIO()
-        pil_img.save(buf, 'PNG')
+        pil_img.save(buf, 'PNG', compress_level=QR_PNG_COMPRESS_LEVEL)
         return buf.getvalue()
     except ImportError:
         pass
@@ -277,12 +1095,314 @@ def generate_qr_png(data: str, size: int = 300, fg=(0,0,0), bg=(255,255,255),
             + png_chunk(b'IEND', b''))
 
 
+class QRCache:
+    """Two-tier cache of rendered QR images keyed by content and style.
+
+    Tier 1 is an in-memory LRU bounded by QR_CACHE_MAX_BYTES. Tier 2 (when
+    QR_CACHE_DISK is on) stores files under QR_CACHE_DIR/<data-hash>/<key>,
+    so every rendering of one URL lives in one directory and invalidate()
+    can drop them together. The key doubles as the response ETag.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None):
+        self.max_bytes  = max_bytes
+        self.disk_dir   = disk_dir
+        self.bytes      = 0
+        self.hits       = 0
+        self.disk_hits  = 0
+        self.misses     = 0
+        self.evictions  = 0
+        self.not_modified = 0
+        self.render_time  = 0.0
+        self.coalesced    = 0
+        self._inflight  = {}                 # key → Future of the render in progress
+        self._entries   = OrderedDict()      # key → (data_hash, payload)
+        self._by_data   = {}                 # data_hash → {key, …}
+        self._lock      = threading.Lock()
+
+    @staticmethod
+    def data_hash(data):
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+    @classmethod
+    def key(cls, data, *params, logo_bytes=None):
+        h = hashlib.sha256(cls.data_hash(data).encode())
+        h.update(repr(params).encode())
+        if logo_bytes:
+            h.update(hashlib.sha256(logo_bytes).digest())
+        return h.hexdigest()[:32]
+
+    def _disk_path(self, data_hash, key):
+        return os.path.join(self.disk_dir, data_hash[:2], data_hash, key)
+
+    def _remember(self, key, data_hash, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.bytes -= len(old[1])
+            self._entries[key] = (data_hash, payload)
+            self._by_data.setdefault(data_hash, set()).add(key)
+            self.bytes += len(payload)
+            while self.bytes > self.max_bytes:
+                old_key, (old_hash, old_payload) = self._entries.popitem(last=False)
+                self.bytes -= len(old_payload)
+                self._by_data.get(old_hash, set()).discard(old_key)
+                self.evictions += 1
+
+    def lookup(self, key, data, persist=False):
+        """Return cached bytes for `key` from memory (or disk when `persist`), else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        if persist and self.disk_dir:
+            data_hash = self.data_hash(data)
+            try:
+                with open(self._disk_path(data_hash, key), 'rb') as f:
+                    payload = f.read()
+            except OSError:
+                pass
+            else:
+                self.disk_hits += 1
+                self._remember(key, data_hash, payload)
+                return payload
+        self.misses += 1
+        return None
+
+    def store(self, key, data, payload, persist=False):
+        data_hash = self.data_hash(data)
+        self._remember(key, data_hash, payload)
+        if persist and self.disk_dir:
+            path = self._disk_path(data_hash, key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp, path)
+            except OSError as exc:
+                app.logger.warning('qr cache: could not write %s: %s', path, exc)
+
+    def get_or_render(self, key, data, render, persist=False):
+        """Return cached bytes for `key`, calling render() and storing the result on a miss.
+
+        Concurrent misses for one key (threaded workers) wait for the first
+        render instead of repeating it.
+        """
+        payload = self.lookup(key, data, persist)
+        if payload is not None:
+            return payload
+        with self._lock:
+            pending = self._inflight.get(key)
+            waiting = pending is not None
+            if waiting:
+                self.coalesced += 1
+            else:
+                pending = self._inflight[key] = Future()
+        if waiting:
+            return pending.result()
+        try:
+            start   = time.perf_counter()
+            payload = render()
+            self.render_time += time.perf_counter() - start
+            self.store(key, data, payload, persist)
+            pending.set_result(payload)
+        except BaseException as exc:
+            pending.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return payload
+
+    def invalidate(self, data):
+        """Drop every cached rendering of `data` from memory and disk."""
+        data_hash = self.data_hash(data)
+        with self._lock:
+            for key in self._by_data.pop(data_hash, ()):
+                entry = self._entries.pop(key, None)
+                if entry:
+                    self.bytes -= len(entry[1])
+        if self.disk_dir:
+            import shutil
+            shutil.rmtree(os.path.join(self.disk_dir, data_hash[:2], data_hash), ignore_errors=True)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries':      len(self._entries),
+            'bytes':        self.bytes,
+            'max_bytes':    self.max_bytes,
+            'hits':         self.hits,
+            'disk_hits':    self.disk_hits,
+            'misses':       self.misses,
+            'hit_rate':     round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            'evictions':    self.evictions,
+            'not_modified': self.not_modified,
+            'avg_render_ms': round(self.render_time / self.misses * 1000, 3) if self.misses else 0.0,
+            'coalesced':    self.coalesced,
+        }
+
+
+qr_cache = QRCache(QR_CACHE_MAX_BYTES, QR_CACHE_DIR if QR_CACHE_DISK else None)
+
+
+def qr_size_bucket(size):
+    """Coarse size label for metrics, so arbitrary ?size= values don't multiply series."""
+    for limit in (200, 400, 800):
+        if size <= limit:
+            return f'<={limit}'
+    return '>800'
+
+
+def qr_response(data, size, fg, bg, style, logo_bytes=None, fmt='png', persist=False, cache_control=None):
+    """Serve a QR PNG or SVG through qr_cache, answering If-None-Match with 304."""
+    key     = qr_cache.key(data, size, fg, bg, style, fmt, logo_bytes=logo_bytes)
+    headers = {'ETag': f'"{key}"'}
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    if request.if_none_match.contains(key):
+        qr_cache.not_modified += 1
+        return Response(status=304, headers=headers)
+    render = generate_qr_svg if fmt == 'svg' else generate_qr_png
+
+    def timed_render():
+        with metrics.timer('qr_render_duration_seconds', style=style, format=fmt,
+                           size=qr_size_bucket(size), logo='yes' if logo_bytes else 'no'):
+            if not QR_RENDER_OFFLOAD:
+                return render(data, size=size, fg=fg, bg=bg, style=style, logo_bytes=logo_bytes)
+            return qr_pool_render(render, data, size=size, fg=fg, bg=bg, style=style, logo_bytes=logo_bytes)
+
+    payload = qr_cache.get_or_render(key, data, timed_render, persist=persist)
+    return Response(payload, mimetype='image/svg+xml' if fmt == 'svg' else 'image/png', headers=headers)
+
+
 # ─────────────────────────────────────────────
-# Shared helpers
+# Short codes
 # ─────────────────────────────────────────────
 
-def generate_code(url: str, length: int = 6) -> str:
-    return hashlib.sha256(f"{url}{time.time()}".encode()).hexdigest()[:length]
+class CodeAllocator:
+    """Hands out short codes that are unique by construction.
+
+    Every code is the image of a sequence number under a keyed Feistel
+    permutation of [0, len(alphabet)**length), written in that alphabet with
+    a fixed width. Sequence numbers come from the `code_seq` counter in
+    app_meta; each process reserves CODE_BLOCK_SIZE of them at a time, so
+    allocation is one UPDATE per block and never a per-code SELECT. Custom
+    codes and codes from older schemes can still occupy a slot; callers
+    handle that as an IntegrityError and take the next code.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, alphabet, length, block_size):
+        self.alphabet   = alphabet
+        self.length     = length
+        self.space      = len(alphabet) ** length
+        self.block_size = max(1, block_size)
+        bits            = max(2, (self.space - 1).bit_length())
+        self.half       = (bits + 1) // 2
+        self.mask       = (1 << self.half) - 1
+        self.allocated  = 0
+        self.blocks     = 0
+        self.collisions = 0
+        self._key       = None
+        self._next      = 0
+        self._end       = 0
+        self._pid       = None
+        self._lock      = threading.Lock()
+
+    def _load_key(self, conn):
+        conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('code_key', ?)",
+                     (secrets.randbits(62),))
+        key = conn.execute("SELECT value FROM app_meta WHERE key='code_key'").fetchone()[0]
+        return key.to_bytes(8, 'big')
+
+    def _reserve(self, n):
+        # A private connection: the reservation must commit even if the
+        # caller's transaction later rolls back. Callers therefore must not
+        # hold the write lock when a new block may be needed.
+        conn = _connect()
+        try:
+            with conn:
+                if self._key is None:
+                    self._key = self._load_key(conn)
+                conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('code_seq', 0)")
+                end = conn.execute("UPDATE app_meta SET value=value+? WHERE key='code_seq' RETURNING value",
+                                   (n,)).fetchall()[0][0]
+        finally:
+            conn.close()
+        self.blocks += 1
+        return end - n, end
+
+    def _round(self, i, r):
+        digest = hashlib.blake2b(r.to_bytes(8, 'big'), digest_size=8, key=self._key, person=bytes([i]) * 16)
+        return int.from_bytes(digest.digest(), 'big') & self.mask
+
+    def permute(self, n):
+        """Bijection on [0, space); cycle-walks the Feistel network on [0, 2**(2*half))."""
+        x = n
+        while True:
+            left, right = x >> self.half, x & self.mask
+            for i in range(self.ROUNDS):
+                left, right = right, left ^ self._round(i, right)
+            x = (left << self.half) | right
+            if x < self.space:
+                return x
+
+    def encode(self, x):
+        base, chars = len(self.alphabet), []
+        for _ in range(self.length):
+            x, d = divmod(x, base)
+            chars.append(self.alphabet[d])
+        return ''.join(reversed(chars))
+
+    def take(self, n=1):
+        """Return `n` fresh codes."""
+        codes = []
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid, self._next, self._end = os.getpid(), 0, 0   # don't share a block across fork
+            while len(codes) < n:
+                if self._next >= self._end:
+                    self._next, self._end = self._reserve(max(self.block_size, n - len(codes)))
+                take = min(n - len(codes), self._end - self._next)
+                if self._next + take > self.space:
+                    raise RuntimeError('Short code space exhausted; raise CODE_LENGTH')
+                codes += [self.encode(self.permute(i)) for i in range(self._next, self._next + take)]
+                self._next += take
+            self.allocated += n
+        return codes
+
+    def next(self):
+        return self.take(1)[0]
+
+    def stats(self):
+        return {
+            'alphabet_size': len(self.alphabet),
+            'length':        self.length,
+            'space':         self.space,
+            'allocated':     self.allocated,
+            'blocks':        self.blocks,
+            'collisions':    self.collisions,
+        }
+
+
+code_allocator = CodeAllocator(CODE_ALPHABET, CODE_LENGTH, CODE_BLOCK_SIZE)
+
+
+def is_code_collision(exc):
+    """True if an IntegrityError is a duplicate links.code, not some other constraint."""
+    return 'UNIQUE' in str(exc) and 'links.code' in str(exc)
+
+
+# ─────────────────────────────────────────────
+# Shared helpers
+# ─────────────────────────────────────────────
 
 def validate_url(url: str) -> bool:
     return url.startswith(('http://', 'https://'))
@@ -291,38 +1411,6 @@ def hex_to_rgb(h):
     h = h.lstrip('#')
     return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
 
-def parse_device(ua):
-    if not ua: return 'Unknown'
-    u = ua.lower()
-    if any(x in u for x in ('mobile','android','iphone')): return 'Mobile'
-    if any(x in u for x in ('tablet','ipad')):             return 'Tablet'
-    return 'Desktop'
-
-def parse_browser(ua):
-    if not ua: return 'Unknown'
-    u = ua.lower()
-    if 'edg/' in u:     return 'Edge'
-    if 'opr/' in u:     return 'Opera'
-    if 'chrome/' in u:  return 'Chrome'
-    if 'firefox/' in u: return 'Firefox'
-    if 'safari/' in u:  return 'Safari'
-    if 'curl' in u:     return 'curl'
-    if 'python' in u:   return 'Python'
-    return 'Other'
-
-def parse_referrer(ref):
-    if not ref: return 'Direct'
-    r = ref.lower()
-    if 'google' in r:                                      return 'Google'
-    if 'bing' in r:                                        return 'Bing'
-    if 'facebook' in r or 'fb.com' in r:                  return 'Facebook'
-    if 'twitter' in r or 't.co' in r or 'x.com' in r:    return 'Twitter/X'
-    if 'linkedin' in r:                                    return 'LinkedIn'
-    if 'reddit' in r:                                      return 'Reddit'
-    if 'youtube' in r:                                     return 'YouTube'
-    if 'instagram' in r:                                   return 'Instagram'
-    return 'Other'
-
 def get_client_ip():
     """Return the real client IP, honouring X-Forwarded-For from trusted proxies."""
     xff = request.headers.get('X-Forwarded-For', '')
@@ -330,50 +1418,6 @@ def get_client_ip():
         return xff.split(',')[0].strip()
     return request.remote_addr or ''
 
-def get_country_for_request():
-    """Return a 2-letter ISO country code for the current request.
-
-    Priority:
-    1. CF-IPCountry header (Cloudflare — zero-latency, most reliable)
-    2. ip-api.com free JSON API (1-second timeout, fails gracefully)
-    Returns 'XX' if the IP is private/loopback, 'Unknown' on any failure.
-    """
-    import urllib.request as _ureq, json as _json
-
-    cf = request.headers.get('CF-IPCountry', '').strip().upper()
-    if cf and len(cf) == 2 and cf.isalpha() and cf != 'XX':
-        return cf
-
-    ip = get_client_ip()
-    if not ip or ip in ('127.0.0.1', '::1'):
-        return 'XX'
-    # Skip RFC-1918 / loopback ranges — no point querying for private IPs
-    try:
-        import ipaddress
-        parsed = ipaddress.ip_address(ip)
-        if parsed.is_private or parsed.is_loopback or parsed.is_link_local:
-            return 'XX'
-    except ValueError:
-        pass
-    try:
-        req = _ureq.Request(
-            f'http://ip-api.com/json/{ip}?fields=countryCode',
-            headers={'User-Agent': 'QRknit/1.0'}
-        )
-        with _ureq.urlopen(req, timeout=1) as resp:
-            data = _json.loads(resp.read())
-        code = data.get('countryCode', '')
-        return code if code else 'Unknown'
-    except Exception:
-        return 'Unknown'
-
-def get_link_tags(conn, link_id):
-    rows = conn.execute(
-        'SELECT t.id, t.name FROM tags t JOIN link_tags lt ON t.id=lt.tag_id WHERE lt.link_id=?',
-        (link_id,)
-    ).fetchall()
-    return [{'id': r['id'], 'name': r['name']} for r in rows]
-
 def set_link_tags(conn, link_id, tag_names):
     conn.execute('DELETE FROM link_tags WHERE link_id=?', (link_id,))
     for name in tag_names:
@@ -384,8 +1428,26 @@ def set_link_tags(conn, link_id, tag_names):
         conn.execute('INSERT OR IGNORE INTO link_tags (link_id,tag_id) VALUES (?,?)', (link_id, tid))
 
 def format_link(row, conn):
-    owner = conn.execute('SELECT username FROM users WHERE id=?', (row['user_id'],)).fetchone()
-    return {
+    return format_links([row], conn)[0]
+
+def format_links(rows, conn):
+    """Serialise link rows, loading owners and tags for all of them in two queries."""
+    if not rows:
+        return []
+    user_ids = list({r['user_id'] for r in rows if r['user_id'] is not None})
+    owners   = {}
+    if user_ids:
+        owners = {u['id']: u['username'] for u in conn.execute(
+            f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(user_ids))})", user_ids
+        )}
+    link_ids = [r['id'] for r in rows]
+    tags     = {link_id: [] for link_id in link_ids}
+    for t in conn.execute(
+        'SELECT lt.link_id, t.id, t.name FROM link_tags lt JOIN tags t ON t.id=lt.tag_id '
+        f"WHERE lt.link_id IN ({','.join('?' * len(link_ids))})", link_ids
+    ):
+        tags[t['link_id']].append({'id': t['id'], 'name': t['name']})
+    return [{
         'id':         row['id'],
         'code':       row['code'],
         'long_url':   row['long_url'],
@@ -397,9 +1459,1248 @@ def format_link(row, conn):
         'is_pinned':  row['is_pinned'],
         'short_url':  f"{BASE_URL}/{row['code']}",
         'qr_url':     f"{BASE_URL}/api/qr/{row['code']}",
-        'tags':       get_link_tags(conn, row['id']),
-        'created_by': owner['username'] if owner else None,
-    }
+        'tags':       tags[row['id']],
+        'created_by': owners.get(row['user_id']),
+    } for row in rows]
+
+
+# ─────────────────────────────────────────────
+# Click classification
+# ─────────────────────────────────────────────
+# Device, browser and traffic source come from ordered rule tables: the first
+# label with a substring in the lowercased string wins. Clicks repeat the same
+# few hundred user agents and referrers, so results are memoised per raw string.
+
+DEVICE_RULES = (
+    ('Mobile',    ('mobile', 'android', 'iphone')),
+    ('Tablet',    ('tablet', 'ipad')),
+)
+BROWSER_RULES = (
+    ('Edge',      ('edg/',)),
+    ('Opera',     ('opr/',)),
+    ('Chrome',    ('chrome/',)),
+    ('Firefox',   ('firefox/',)),
+    ('Safari',    ('safari/',)),
+    ('curl',      ('curl',)),
+    ('Python',    ('python',)),
+)
+SOURCE_RULES = (
+    ('Google',    ('google',)),
+    ('Bing',      ('bing',)),
+    ('Facebook',  ('facebook', 'fb.com')),
+    ('Twitter/X', ('twitter', 't.co', 'x.com')),
+    ('LinkedIn',  ('linkedin',)),
+    ('Reddit',    ('reddit',)),
+    ('YouTube',   ('youtube',)),
+    ('Instagram', ('instagram',)),
+)
+
+
+class Classifier:
+    """Label strings with an ordered (label, substrings) rule table.
+
+    The table is flattened once into (substring, label) pairs in priority
+    order — a plain `in` scan over a lowercased string beats a regex
+    alternation in CPython. Empty input gives `empty`, no match `default`.
+    Strings up to MAX_KEY characters are memoised in a bounded LRU.
+    """
+
+    MAX_KEY = 512   # longer strings are junk or attacks; don't let them pin cache memory
+
+    def __init__(self, rules, default, empty, cache_size=CLASSIFY_CACHE_SIZE):
+        self.rules   = tuple((needle, label) for label, needles in rules for needle in needles)
+        self.default = default
+        self.empty   = empty
+        self._cached = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, value):
+        v = value.lower()
+        for needle, label in self.rules:
+            if needle in v:
+                return label
+        return self.default
+
+    def __call__(self, value):
+        if not value:
+            return self.empty
+        if len(value) > self.MAX_KEY:
+            return self._classify(value)
+        return self._cached(value)
+
+    def stats(self):
+        info = self._cached.cache_info()
+        return {'size': info.currsize, 'max_size': info.maxsize, 'hits': info.hits, 'misses': info.misses}
+
+
+parse_device   = Classifier(DEVICE_RULES,  default='Desktop', empty='Unknown')
+parse_browser  = Classifier(BROWSER_RULES, default='Other',   empty='Unknown')
+parse_referrer = Classifier(SOURCE_RULES,  default='Other',   empty='Direct')
+_CLASSIFIERS   = (('classify_device', parse_device), ('classify_browser', parse_browser),
+                  ('classify_source', parse_referrer))
+
+
+def classify_click(referrer, user_agent):
+    """(source, device, browser) for one click."""
+    return parse_referrer(referrer), parse_device(user_agent), parse_browser(user_agent)
+
+
+# ─────────────────────────────────────────────
+# Interned user agents and referrers
+# ─────────────────────────────────────────────
+
+class Interner:
+    """Maps strings to ids in a lookup table (value UNIQUE), adding new ones as needed.
+
+    Ids never change once assigned, so each process can cache them without
+    coordination; the cache is an LRU of `cache_size` values. New rows get
+    their classifier labels (`labels`: (column, Classifier) pairs) when
+    CLICK_CLASSIFY_AT_WRITE is on. Empty strings and None map to no id.
+    """
+
+    def __init__(self, table, labels, cache_size):
+        self.table      = table
+        self.labels     = labels
+        self.cache_size = cache_size
+        self.hits       = 0
+        self.misses     = 0
+        self._cache     = OrderedDict()
+        self._lock      = threading.Lock()
+
+    def ids(self, conn, values):
+        """{value: id} for the non-empty `values`, inserting the ones not stored yet."""
+        found, missing = {}, []
+        with self._lock:
+            for value in set(values):
+                if not value:
+                    continue
+                if value in self._cache:
+                    self._cache.move_to_end(value)
+                    found[value] = self._cache[value]
+                else:
+                    missing.append(value)
+            self.hits   += len(found)
+            self.misses += len(missing)
+        if not missing:
+            return found
+        cols = ['value', *(col for col, _ in self.labels)]
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {self.table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            [(v, *(classify(v) if CLICK_CLASSIFY_AT_WRITE else None for _, classify in self.labels))
+             for v in missing])
+        new = {}
+        for i in range(0, len(missing), 500):
+            part = missing[i:i + 500]
+            new.update(conn.execute(f"SELECT value, id FROM {self.table} WHERE value IN ({','.join('?' * len(part))})",
+                                    part).fetchall())
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache.update(new)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        found.update(new)
+        return found
+
+    def clear(self):
+        """Forget every cached id, e.g. after a transaction that may have added some rolled back."""
+        with self._lock:
+            self._cache.clear()
+
+    def classify(self, conn, reclassify=False):
+        """Fill in labels on rows stored without them (every row if `reclassify`)."""
+        where = '' if reclassify else f'WHERE {self.labels[0][0]} IS NULL'
+        rows  = conn.execute(f'SELECT id, value FROM {self.table} {where}').fetchall()
+        conn.executemany(f"UPDATE {self.table} SET {', '.join(f'{col}=?' for col, _ in self.labels)} WHERE id=?",
+                         [(*(classify(r['value']) for _, classify in self.labels), r['id']) for r in rows])
+        return len(rows)
+
+    def stats(self):
+        looked_up = self.hits + self.misses
+        return {'size': len(self._cache), 'max_size': self.cache_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / looked_up, 4) if looked_up else 0.0}
+
+
+ua_interner       = Interner('user_agents', (('device', parse_device), ('browser', parse_browser)), INTERN_CACHE_SIZE)
+referrer_interner = Interner('referrers',   (('source', parse_referrer),),                        INTERN_CACHE_SIZE)
+
+
+def encode_clicks(chunk=5000, after=0, progress=None):
+    """Move user agent / referrer text on older clicks into the lookup tables.
+
+    Walks clicks in id order from `after`, `chunk` rows per transaction,
+    setting ua_id/referrer_id and clearing the text and label columns, so it
+    can be stopped and resumed at any point; `progress(last_id, max_id)` is
+    called after each chunk. Returns the number of clicks converted.
+    """
+    with get_db() as conn:
+        max_id = conn.execute('SELECT MAX(id) FROM clicks').fetchone()[0] or 0
+    done, last = 0, after
+    while True:
+        with get_db() as conn:
+            rows = conn.execute(
+                'SELECT id, referrer, user_agent FROM clicks '
+                'WHERE id>? AND (user_agent IS NOT NULL OR referrer IS NOT NULL) ORDER BY id LIMIT ?',
+                (last, chunk)).fetchall()
+            if not rows:
+                break
+            uas  = ua_interner.ids(conn, [r['user_agent'] for r in rows])
+            refs = referrer_interner.ids(conn, [r['referrer'] for r in rows])
+            conn.executemany(
+                'UPDATE clicks SET ua_id=?, referrer_id=?, user_agent=NULL, referrer=NULL, '
+                'source=NULL, device=NULL, browser=NULL WHERE id=?',
+                [(uas.get(r['user_agent']), refs.get(r['referrer']), r['id']) for r in rows])
+        done += len(rows)
+        last  = rows[-1]['id']
+        if progress:
+            progress(last, max_id)
+    with get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('clicks_encoded', 1)")
+    return done
+
+
+@app.cli.command('encode-clicks')
+@click.option('--compact', is_flag=True,
+              help='Rebuild the database afterwards so the freed space is returned (locks the database).')
+def encode_clicks_command(compact):
+    """Convert clicks stored with user agent / referrer text to lookup-table ids."""
+    n = encode_clicks(progress=lambda last, max_id: print(f'{last}/{max_id}'))
+    print(f'Converted {n} clicks')
+    if compact:
+        compact_db()
+
+
+@app.cli.command('classify-clicks')
+@click.option('--all', 'reclassify', is_flag=True, help='Reclassify everything, e.g. after changing the rule tables.')
+def classify_clicks_command(reclassify):
+    """Store device, browser and source labels on user agents and referrers stored without them."""
+    with get_db() as conn:
+        n = sum(t.classify(conn, reclassify) for t in (ua_interner, referrer_interner))
+    print(f'Classified {n} user agents and referrers')
+
+
+# ─────────────────────────────────────────────
+# Click rollups
+# ─────────────────────────────────────────────
+# Analytics and stats read these instead of scanning `clicks`:
+#   click_daily   (link_id, day)               per-day counts
+#   click_hourly  (link_id, day, hour)         folded into a day-of-week × hour heatmap at read time
+#   click_dims    (link_id, dim, day, value)   source / device / browser / country breakdowns
+
+def aggregate_clicks(clicks):
+    """Count (link_id, clicked_at, source, device, browser, country) rows the way the rollup tables do.
+
+    Returns ({(link_id, day): n}, {(link_id, day, hour): n}, {(link_id, dim, day, value): n}).
+    """
+    daily, hourly, dims = {}, {}, {}
+    for link_id, clicked_at, source, device, browser, country in clicks:
+        day  = clicked_at[:10]
+        hour = int(clicked_at[11:13])
+        daily[(link_id, day)] = daily.get((link_id, day), 0) + 1
+        hourly[(link_id, day, hour)] = hourly.get((link_id, day, hour), 0) + 1
+        for dim, value in (('source',  source),
+                           ('device',  device),
+                           ('browser', browser),
+                           ('country', country or 'Unknown')):
+            key = (link_id, dim, day, value)
+            dims[key] = dims.get(key, 0) + 1
+    return daily, hourly, dims
+
+
+def record_rollups(conn, clicks):
+    """Add (link_id, clicked_at, source, device, browser, country) rows to the rollup tables."""
+    daily, hourly, dims = aggregate_clicks(clicks)
+    conn.executemany(
+        'INSERT INTO click_daily (link_id, day, count) VALUES (?,?,?) '
+        'ON CONFLICT (link_id, day) DO UPDATE SET count=count+excluded.count',
+        [(*k, n) for k, n in daily.items()])
+    conn.executemany(
+        'INSERT INTO click_hourly (link_id, day, hour, count) VALUES (?,?,?,?) '
+        'ON CONFLICT (link_id, day, hour) DO UPDATE SET count=count+excluded.count',
+        [(*k, n) for k, n in hourly.items()])
+    conn.executemany(
+        'INSERT INTO click_dims (link_id, dim, day, value, count) VALUES (?,?,?,?,?) '
+        'ON CONFLICT (link_id, dim, day, value) DO UPDATE SET count=count+excluded.count',
+        [(*k, n) for k, n in dims.items()])
+
+
+def move_country_rollup(conn, link_id, day, old, new, n):
+    """Re-attribute `n` clicks in the country breakdown (used by geo enrichment)."""
+    conn.execute("UPDATE click_dims SET count=count-? WHERE link_id=? AND dim='country' AND day=? AND value=?",
+                 (n, link_id, day, old))
+    conn.execute("DELETE FROM click_dims WHERE link_id=? AND dim='country' AND day=? AND value=? AND count<=0",
+                 (link_id, day, old))
+    conn.execute(
+        "INSERT INTO click_dims (link_id, dim, day, value, count) VALUES (?,'country',?,?,?) "
+        "ON CONFLICT (link_id, dim, day, value) DO UPDATE SET count=count+excluded.count",
+        (link_id, day, new, n))
+
+
+def backfill_rollups(chunk=500, after=0, progress=None):
+    """Rebuild rollups from `clicks`, `chunk` links per transaction.
+
+    Each chunk is one pass over its clicks through record_rollups(), with
+    labels looked up per user agent / referrer id. Only links with id >
+    `after` are rebuilt, so an interrupted run can resume;
+    `progress(done, total, last_link_id)` is called after each chunk.
+    """
+    def ua_labels(where='', params=()):
+        return {r['id']: (r['device'] or parse_device(r['value']), r['browser'] or parse_browser(r['value']))
+                for r in get_db().execute(f'SELECT id, value, device, browser FROM user_agents {where}', params)}
+
+    def ref_labels(where='', params=()):
+        return {r['id']: r['source'] or parse_referrer(r['value'])
+                for r in get_db().execute(f'SELECT id, value, source FROM referrers {where}', params)}
+
+    with get_db() as conn:
+        ids = [r[0] for r in conn.execute(
+            'SELECT DISTINCT link_id FROM clicks WHERE link_id>? ORDER BY link_id', (after,))]
+        # Days whose raw clicks retention has removed keep the rollups they have
+        floor = pruned_before(conn)
+        uas, refs = ua_labels(), ref_labels()
+    uas[None], refs[None] = (parse_device(None), parse_browser(None)), parse_referrer(None)
+
+    def labelled(rows):
+        for link_id, clicked_at, ua_id, ref_id, country, user_agent, referrer, source, device, browser in rows:
+            # The text and label columns are only set on clicks encode_clicks() hasn't converted
+            if user_agent is not None:
+                device, browser = device or parse_device(user_agent), browser or parse_browser(user_agent)
+            else:
+                if ua_id not in uas:   # first seen after the lookup above
+                    uas.update(ua_labels('WHERE id=?', (ua_id,)))
+                device, browser = uas[ua_id]
+            if referrer is not None:
+                source = source or parse_referrer(referrer)
+            else:
+                if ref_id not in refs:
+                    refs.update(ref_labels('WHERE id=?', (ref_id,)))
+                source = refs[ref_id]
+            yield link_id, clicked_at, source, device, browser, country
+
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        ph   = ','.join('?' * len(part))
+        with get_db() as conn:
+            for table in ('click_daily', 'click_hourly', 'click_dims'):
+                conn.execute(f'DELETE FROM {table} WHERE link_id IN ({ph}) AND day>=?', [*part, floor])
+            rows = conn.execute(
+                'SELECT link_id, clicked_at, ua_id, referrer_id, country, user_agent, referrer, source, device, browser '
+                f'FROM clicks WHERE link_id IN ({ph}) AND clicked_at>=?', [*part, floor])
+            record_rollups(conn, labelled(rows))
+        if progress:
+            progress(i + len(part), len(ids), part[-1])
+    with get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('rollups_ready', 1)")
+        conn.execute("UPDATE app_meta SET value=value+1 WHERE key='stats_gen'")   # see StatsCache
+    return len(ids)
+
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the click rollup tables from raw clicks."""
+    n = backfill_rollups()
+    print(f'Rebuilt rollups for {n} links')
+
+
+def pruned_before(conn):
+    """'YYYY-MM-DD' before which click retention has removed raw clicks, or '' if none."""
+    row = conn.execute("SELECT value FROM app_meta WHERE key='clicks_pruned_before'").fetchone()
+    return f'{row[0] // 10000:04d}-{row[0] // 100 % 100:02d}-{row[0] % 100:02d}' if row else ''
+
+
+_rollups_ready = False
+
+def rollups_ready(conn):
+    """True once the rollup tables cover every click; until then analytics read raw clicks."""
+    global _rollups_ready
+    if not _rollups_ready:
+        _rollups_ready = conn.execute("SELECT 1 FROM app_meta WHERE key='rollups_ready'").fetchone() is not None
+    return _rollups_ready
+
+
+def raw_rollups(conn, where, params):
+    """aggregate_clicks() over the click_events matching `where`, for use before rollups_ready()."""
+    rows = conn.execute(
+        f'SELECT link_id, clicked_at, source, device, browser, country, referrer, user_agent '
+        f'FROM click_events WHERE {where}', params)
+    return aggregate_clicks(
+        (r['link_id'], r['clicked_at'], r['source'] or parse_referrer(r['referrer']),
+         r['device'] or parse_device(r['user_agent']), r['browser'] or parse_browser(r['user_agent']),
+         r['country']) for r in rows)
+
+
+# ─────────────────────────────────────────────
+# Geo lookup
+# ─────────────────────────────────────────────
+
+GEO_PENDING = 'Pending'   # stored on clicks awaiting deferred enrichment
+
+class GeoRateLimited(Exception):
+    """The remote geo service answered 429; no lookups for `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'rate limited for {retry_after}s')
+        self.retry_after = retry_after
+
+
+class ApiGeoResolver:
+    """ip-api.com free JSON API (1-second timeout). Remote, so lookups are deferred.
+
+    Raises on anything but a definite answer, so the caller can retry later:
+    GeoRateLimited on 429, RuntimeError on a "fail" response other than a
+    private/reserved range (which resolves to 'XX').
+    """
+    remote = True
+
+    def lookup(self, ip):
+        import urllib.request as _ureq, urllib.error as _uerr, json as _json
+        req = _ureq.Request(
+            f'http://ip-api.com/json/{ip}?fields=status,message,countryCode',
+            headers={'User-Agent': 'QRknit/1.0'}
+        )
+        try:
+            with _ureq.urlopen(req, timeout=1) as resp:
+                data = _json.loads(resp.read())
+        except _uerr.HTTPError as exc:
+            if exc.code == 429:
+                raise GeoRateLimited(int(exc.headers.get('X-Ttl') or 60)) from exc
+            raise
+        if data.get('status') == 'fail':
+            if data.get('message') in ('private range', 'reserved range'):
+                return 'XX'
+            raise RuntimeError(f"ip-api: {data.get('message') or 'lookup failed'}")
+        return data.get('countryCode') or None
+
+
+class CsvGeoResolver:
+    """Offline IP-range file: `start,end,country` per line, IPs dotted or as integers.
+
+    Ranges are loaded into sorted arrays per IP version and searched with bisect.
+    Lines that do not parse (headers, comments) are skipped.
+    """
+    remote = False
+
+    def __init__(self, path):
+        ranges = {4: [], 6: []}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                try:
+                    start, end = self._addr(row[0]), self._addr(row[1])
+                except ValueError:
+                    continue
+                country = row[2].strip().upper()
+                if len(country) == 2:
+                    ranges[start.version].append((int(start), int(end), country))
+        self._tables = {}
+        for version, rows in ranges.items():
+            rows.sort()
+            self._tables[version] = ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+    @staticmethod
+    def _addr(value):
+        value = value.strip().strip('"')
+        if value.isdigit():
+            n = int(value)
+            return ipaddress.ip_address(n) if n <= 0xFFFFFFFF else ipaddress.IPv6Address(n)
+        return ipaddress.ip_address(value)
+
+    def lookup(self, ip):
+        addr = ipaddress.ip_address(ip)
+        starts, ends, countries = self._tables[addr.version]
+        n = int(addr)
+        i = bisect.bisect_right(starts, n) - 1
+        if i >= 0 and n <= ends[i]:
+            return countries[i]
+        return None
+
+
+class MmdbGeoResolver:
+    """MaxMind/DB-IP .mmdb country database (requires the optional `maxminddb` package)."""
+    remote = False
+
+    def __init__(self, path):
+        import maxminddb
+        self._reader = maxminddb.open_database(path)
+
+    def lookup(self, ip):
+        rec = self._reader.get(ip) or {}
+        country = rec.get('country') or rec.get('registered_country') or {}
+        return country.get('iso_code') or None
+
+
+class GeoLocator:
+    """Resolves client IPs to country codes through a per-prefix LRU cache.
+
+    The cache is keyed by /24 (IPv4) or /48 (IPv6) network. With a remote
+    resolver and GEO_DEFERRED on, cache misses are stored as GEO_PENDING and
+    filled in later by enrich_pending() on a background thread, so neither
+    redirects nor the click writer wait on a third-party service.
+
+    Remote lookups draw on a GEO_API_PER_MINUTE budget shared by every worker
+    through app_meta, and stop for everyone when the service answers 429.
+    Only answers are cached: a lookup that fails or finds the budget spent
+    leaves its clicks pending for a later pass.
+    """
+
+    RETRY_FAILED = 300   # seconds before enrichment retries an IP whose lookup failed
+
+    def __init__(self, resolver, cache_size, deferred):
+        self.resolver   = resolver
+        self.cache_size = cache_size
+        self.deferred   = bool(deferred and resolver is not None and resolver.remote)
+        self.hits       = 0
+        self.misses     = 0
+        self.lookups    = 0
+        self.failures   = 0
+        self.lookup_time = 0.0
+        self._cache     = OrderedDict()
+        self._lock      = threading.Lock()
+        self._thread    = None
+        self._pid       = None
+        self._paused_until = 0.0   # no remote lookups before this (budget spent or rate limited)
+        self._failed_ips   = {}    # ip → time enrichment may retry it
+
+    @staticmethod
+    def _prefix(addr):
+        bits = 24 if addr.version == 4 else 48
+        return str(ipaddress.ip_network(f'{addr}/{bits}', strict=False).network_address)
+
+    @staticmethod
+    def _classify(ip, cf_country):
+        """Return (country, addr): a final country when no lookup is needed, else (None, addr)."""
+        cf = (cf_country or '').strip().upper()
+        if cf and len(cf) == 2 and cf.isalpha() and cf != 'XX':
+            return cf, None
+        if not ip:
+            return 'XX', None
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return 'Unknown', None
+        # No point looking up RFC-1918 / loopback / link-local addresses
+        if addr.is_private or addr.is_loopback or addr.is_link_local:
+            return 'XX', None
+        return None, addr
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+        self.misses += 1
+        return None
+
+    def _claim_lookup(self):
+        """Take one remote lookup from the per-minute budget shared through app_meta."""
+        now = time.time()
+        if now < self._paused_until:
+            return False
+        window = int(now // 60)
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES "
+                         "('geo_api_window', 0), ('geo_api_used', 0), ('geo_api_retry_at', 0)")
+            meta = dict(conn.execute("SELECT key, value FROM app_meta WHERE key IN "
+                                     "('geo_api_window', 'geo_api_used', 'geo_api_retry_at')").fetchall())
+            if meta['geo_api_retry_at'] > now:
+                paused = meta['geo_api_retry_at']
+            else:
+                used = meta['geo_api_used'] if meta['geo_api_window'] == window else 0
+                if used < GEO_API_PER_MINUTE:
+                    conn.executemany('UPDATE app_meta SET value=? WHERE key=?',
+                                     ((window, 'geo_api_window'), (used + 1, 'geo_api_used')))
+                    return True
+                paused = (window + 1) * 60
+        self._paused_until = paused
+        return False
+
+    def _back_off(self, seconds):
+        """Stop remote lookups in every worker for `seconds`."""
+        until = int(time.time() + seconds) + 1
+        self._paused_until = until
+        with get_db() as conn:
+            conn.execute("INSERT INTO app_meta (key, value) VALUES ('geo_api_retry_at', ?) "
+                         "ON CONFLICT (key) DO UPDATE SET value=max(value, excluded.value)", (until,))
+        app.logger.warning('geo lookups rate limited; pausing for %ds', seconds)
+
+    def _resolve(self, addr, key):
+        """Look up one address; None when a remote lookup failed or could not be made."""
+        if self.resolver is None:
+            return 'Unknown'
+        if self.resolver.remote and not self._claim_lookup():
+            return None
+        start = time.perf_counter()
+        try:
+            country = self.resolver.lookup(str(addr)) or 'Unknown'
+        except Exception as exc:
+            self.failures += 1
+            metrics.inc('geo_lookup_failures_total', provider=type(self.resolver).__name__)
+            if isinstance(exc, GeoRateLimited):
+                self._back_off(exc.retry_after)
+            country = None if self.resolver.remote else 'Unknown'
+        elapsed = time.perf_counter() - start
+        self.lookups     += 1
+        self.lookup_time += elapsed
+        metrics.observe('geo_lookup_duration_seconds', elapsed, provider=type(self.resolver).__name__)
+        if country is not None and self.cache_size > 0:
+            with self._lock:
+                self._cache[key] = country
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return country
+
+    def country(self, ip, cf_country=''):
+        """Return a 2-letter ISO country code, 'XX' for private IPs or 'Unknown'.
+
+        CF-IPCountry (Cloudflare) wins when present; otherwise the resolver is
+        consulted, which may block on a remote resolver. None means a remote
+        lookup failed or was out of budget, and is worth retrying later.
+        """
+        country, addr = self._classify(ip, cf_country)
+        if country:
+            return country
+        key = self._prefix(addr)
+        return self._cached(key) or self._resolve(addr, key)
+
+    def country_for_click(self, ip, cf_country=''):
+        """Like country(), but returns GEO_PENDING instead of calling a remote resolver."""
+        if not self.deferred:
+            country = self.country(ip, cf_country)
+            if country is not None:
+                return country
+        self._ensure_enricher()
+        country, addr = self._classify(ip, cf_country)
+        if country:
+            return country
+        cached = self._cached(self._prefix(addr))
+        return cached or GEO_PENDING
+
+    def enrich_pending(self, limit):
+        """Resolve up to `limit` distinct pending IPs and update their clicks.
+
+        The pass stops when the lookup budget runs out. IPs whose lookup failed
+        stay pending and are skipped for RETRY_FAILED seconds, so a few bad
+        ones can't hold up the rest.
+        """
+        now = time.time()
+        with self._lock:
+            self._failed_ips = {ip: t for ip, t in self._failed_ips.items() if t > now}
+            skip = set(self._failed_ips)
+        with get_db() as conn:
+            ips = [r['ip_address'] for r in conn.execute(
+                'SELECT DISTINCT ip_address FROM clicks WHERE country=? LIMIT ?',
+                (GEO_PENDING, limit + len(skip))
+            ).fetchall() if r['ip_address'] not in skip][:limit]
+        resolved = []
+        for ip in ips:
+            country = self.country(ip)
+            if country is not None:
+                resolved.append((ip, country))
+            elif time.time() < self._paused_until:
+                break
+            else:
+                with self._lock:
+                    self._failed_ips[ip] = time.time() + self.RETRY_FAILED
+        if not resolved:
+            return 0
+        # Every worker enriches, so the rollup moves are counted from the rows
+        # this UPDATE actually changed, under the write lock.
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for ip, country in resolved:
+                moved = {}
+                for r in conn.execute(
+                    'UPDATE clicks SET country=? WHERE country=? AND ip_address IS ? '
+                    'RETURNING link_id, substr(clicked_at,1,10) AS day', (country, GEO_PENDING, ip)
+                ).fetchall():
+                    moved[r['link_id'], r['day']] = moved.get((r['link_id'], r['day']), 0) + 1
+                for (link_id, day), n in moved.items():
+                    move_country_rollup(conn, link_id, day, GEO_PENDING, country, n)
+        return len(resolved)
+
+    def _ensure_enricher(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid    = os.getpid()
+            self._thread = threading.Thread(target=self._enrich_loop, name='geo-enricher', daemon=True)
+            self._thread.start()
+
+    def _enrich_loop(self):
+        while True:
+            time.sleep(GEO_ENRICH_INTERVAL)
+            try:
+                self.enrich_pending(GEO_ENRICH_BATCH)
+            except Exception as exc:
+                app.logger.error('geo enricher: %s', exc)
+
+    def stats(self):
+        cached = self.hits + self.misses
+        return {
+            'provider':          type(self.resolver).__name__ if self.resolver else None,
+            'deferred':          self.deferred,
+            'cache_size':        len(self._cache),
+            'cache_hits':        self.hits,
+            'cache_misses':      self.misses,
+            'cache_hit_rate':    round(self.hits / cached, 4) if cached else 0.0,
+            'lookups':           self.lookups,
+            'lookup_failures':   self.failures,
+            'avg_lookup_ms':     round(self.lookup_time / self.lookups * 1000, 3) if self.lookups else 0.0,
+        }
+
+
+def make_geo_resolver():
+    """Build the resolver selected by GEO_PROVIDER; falls back to none if it cannot load."""
+    try:
+        if GEO_PROVIDER == 'api':
+            return ApiGeoResolver()
+        if GEO_PROVIDER == 'csv':
+            return CsvGeoResolver(GEO_DB_PATH)
+        if GEO_PROVIDER == 'mmdb':
+            return MmdbGeoResolver(GEO_DB_PATH)
+    except Exception as exc:
+        app.logger.error('geo: could not load %s provider from %r: %s', GEO_PROVIDER, GEO_DB_PATH, exc)
+    return None
+
+
+geo = GeoLocator(make_geo_resolver(), GEO_CACHE_SIZE, GEO_DEFERRED)
+
+
+# ─────────────────────────────────────────────
+# Link resolution cache
+# ─────────────────────────────────────────────
+
+class LinkCache:
+    """LRU/TTL cache of code → {id, long_url, expires_at, is_active}.
+
+    Writers call invalidate() inside their transaction: it drops the codes
+    locally and bumps the `link_cache_gen` counter in app_meta. Every worker
+    re-reads that counter at most once per LINK_CACHE_SYNC_INTERVAL seconds
+    and clears its cache when it has moved, so edits made in one gunicorn
+    worker reach the others within that interval. Unknown codes are not
+    cached.
+    """
+
+    def __init__(self, maxsize, ttl, sync_interval):
+        self.maxsize       = maxsize
+        self.ttl           = ttl
+        self.sync_interval = sync_interval
+        self.hits          = 0
+        self.misses        = 0
+        self._entries      = OrderedDict()
+        self._lock         = threading.Lock()
+        self._gen          = None
+        self._synced_at    = 0.0
+
+    def _sync(self, now):
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        with get_db() as conn:
+            row = conn.execute("SELECT value FROM app_meta WHERE key='link_cache_gen'").fetchone()
+        gen = row['value'] if row else 0
+        if gen != self._gen:
+            with self._lock:
+                self._entries.clear()
+                self._gen = gen
+
+    def get(self, code):
+        """Return the cached link for `code`, loading it from SQLite on a miss."""
+        if self.maxsize <= 0:
+            return self._load(code)
+        now = time.monotonic()
+        self._sync(now)
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(code)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        link = self._load(code)
+        if link is not None:
+            with self._lock:
+                self._entries[code] = (now + self.ttl, link)
+                self._entries.move_to_end(code)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return link
+
+    @staticmethod
+    def _load(code):
+        with get_db() as conn, metrics.timer('db_query_duration_seconds', query='redirect_lookup'):
+            row = conn.execute(
+                'SELECT id, long_url, expires_at, is_active FROM links WHERE code=?', (code,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def invalidate(self, conn, codes):
+        """Drop `codes` here and signal the other workers through app_meta."""
+        with self._lock:
+            for code in codes:
+                self._entries.pop(code, None)
+        conn.execute("UPDATE app_meta SET value=value+1 WHERE key='link_cache_gen'")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size':     len(self._entries),
+            'max_size': self.maxsize,
+            'hits':     self.hits,
+            'misses':   self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+link_cache = LinkCache(LINK_CACHE_SIZE, LINK_CACHE_TTL, LINK_CACHE_SYNC_INTERVAL)
+
+
+# ─────────────────────────────────────────────
+# Click ingestion
+# ─────────────────────────────────────────────
+
+class ClickWriter:
+    """Bounded in-process queue of click events drained by a background thread.
+
+    Redirects call enqueue() and return immediately. The writer thread groups
+    events into batches of up to CLICK_BATCH_SIZE (or whatever arrived within
+    CLICK_FLUSH_INTERVAL seconds), resolves countries, inserts them with one
+    executemany and folds the per-link counter bumps into one UPDATE per link.
+    When the queue is full, events are dropped (counted in `dropped`) or the
+    caller blocks, depending on CLICK_QUEUE_OVERFLOW.
+    """
+
+    _STOP = object()   # sentinel queued by close()
+
+    RETRY_DELAY     = 0.1   # seconds before the first retry of a failed batch, doubling
+    RETRY_DELAY_MAX = 5.0
+    RETRIES_ON_STOP = 3
+
+    def __init__(self, maxsize, batch_size, flush_interval, overflow):
+        self.queue          = queue.Queue(maxsize=maxsize)
+        self.batch_size     = max(1, batch_size)
+        self.flush_interval = max(0.01, flush_interval)
+        self.overflow       = overflow if overflow in ('drop', 'block') else 'drop'
+        self.dropped        = 0
+        self.written        = 0
+        self.failed         = 0
+        self._write_lock    = threading.Lock()
+        self._start_lock    = threading.Lock()
+        self._thread        = None
+        self._pid           = None
+
+    def _ensure_started(self):
+        # Started lazily and per process so it survives gunicorn's fork.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._pid    = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='click-writer', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, event):
+        """Queue one click event: (link_id, clicked_at, referrer, user_agent, ip, cf_country)."""
+        self._ensure_started()
+        if self.overflow == 'block':
+            self.queue.put(event)
+            return True
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch   = self._next_batch()
+            stop    = batch[-1] is self._STOP
+            events  = batch[:-1] if stop else batch
+            try:
+                if events:
+                    self._write_retrying(events, stop)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _write_retrying(self, events, stopping=False):
+        # A failed batch is retried with backoff rather than dropped; while
+        # it retries the queue fills and CLICK_QUEUE_OVERFLOW applies as
+        # usual. On shutdown there is only time for RETRIES_ON_STOP attempts.
+        delay, attempt = self.RETRY_DELAY, 0
+        while True:
+            try:
+                self._write(events)
+                return
+            except Exception as exc:
+                attempt += 1
+                ua_interner.clear()       # ids handed out by the rolled-back transaction
+                referrer_interner.clear()
+                if stopping and attempt >= self.RETRIES_ON_STOP:
+                    self.failed += len(events)
+                    app.logger.error('click writer: gave up storing %d clicks: %s', len(events), exc)
+                    return
+                app.logger.warning('click writer: failed to store %d clicks, retrying in %.1fs: %s',
+                                   len(events), delay, exc)
+                time.sleep(delay)
+                delay = min(delay * 2, self.RETRY_DELAY_MAX)
+
+    def _write(self, batch):
+        rows   = []
+        counts = {}
+        labels = []
+        for link_id, clicked_at, referrer, user_agent, ip, cf_country in batch:
+            rows.append((link_id, clicked_at, referrer, user_agent, ip,
+                         geo.country_for_click(ip, cf_country)))
+            labels.append(classify_click(referrer, user_agent))
+            counts[link_id] = counts.get(link_id, 0) + 1
+        with self._write_lock:
+            with get_db() as conn:
+                uas  = ua_interner.ids(conn, [r[3] for r in rows])
+                refs = referrer_interner.ids(conn, [r[2] for r in rows])
+                conn.executemany(
+                    'INSERT INTO clicks (link_id,clicked_at,referrer_id,ua_id,ip_address,country) '
+                    'VALUES (?,?,?,?,?,?)',
+                    [(r[0], r[1], refs.get(r[2]), uas.get(r[3]), r[4], r[5]) for r in rows]
+                )
+                conn.executemany('UPDATE links SET clicks=clicks+? WHERE id=?',
+                                 [(n, link_id) for link_id, n in counts.items()])
+                record_rollups(conn, [(r[0], r[1], *l, r[5]) for r, l in zip(rows, labels)])
+                stats_cache.record_clicks(conn, [(r[0], r[1]) for r in rows])
+            self.written += len(rows)
+
+    def _running(self):
+        return (self._thread is not None and self._pid == os.getpid()
+                and self._thread.is_alive())
+
+    def flush(self):
+        """Block until every click queued so far has been written."""
+        if self._running():
+            self.queue.join()
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.batch_size):
+            self._write_retrying(batch[i:i + self.batch_size], stopping=True)
+
+    def close(self, timeout=5.0):
+        """Stop the writer thread after it has drained the queue."""
+        if self._running():
+            try:
+                self.queue.put(self._STOP, timeout=timeout)
+                self._thread.join(timeout)
+            except queue.Full:
+                pass
+        self._thread = None
+        self.flush()
+
+
+click_writer = ClickWriter(CLICK_QUEUE_SIZE, CLICK_BATCH_SIZE,
+                           CLICK_FLUSH_INTERVAL, CLICK_QUEUE_OVERFLOW)
+
+@atexit.register
+def _flush_clicks_on_exit():
+    try:
+        click_writer.close()
+    except Exception as exc:
+        app.logger.error('click writer: flush on shutdown failed: %s', exc)
+
+
+# ─────────────────────────────────────────────
+# Click retention
+# ─────────────────────────────────────────────
+
+ARCHIVE_COLUMNS = ['id', 'link_id', 'code', 'clicked_at', 'referrer', 'user_agent',
+                   'ip_address', 'country', 'source', 'device', 'browser']
+
+
+class ClickRetention:
+    """Archives and deletes raw clicks older than the retention window, a day at a time.
+
+    Rollups already hold the daily/hourly aggregates, so analytics are not
+    affected. For each expired day, oldest first, the day's clicks are
+    written to CLICK_ARCHIVE_DIR/YYYY/MM/clicks-YYYY-MM-DD.{csv,jsonl}.gz
+    (atomically, so an interrupted pass reuses the finished file), the
+    `clicks_pruned_before` mark in app_meta is moved past the day so rollup
+    rebuilds leave it alone, and the rows are deleted CLICK_PRUNE_BATCH at a
+    time, each batch its own short write transaction. Only clicks up to the
+    highest id in the archive are deleted; any the day gains later are
+    appended to the file on the next round. Freed pages are then
+    returned with incremental VACUUM when the database allows it.
+
+    Every worker runs a scheduler thread; a pass is claimed through the
+    `retention_next_run` lease in app_meta, so only one runs at a time.
+    """
+
+    PAUSE = 0.02   # seconds between delete/vacuum batches, so click writes get the lock
+
+    def __init__(self, days, archive, archive_dir, interval, batch_size, vacuum_pages):
+        self.days         = days
+        self.archive      = archive if archive in ('csv', 'jsonl', 'none') else 'csv'
+        self.archive_dir  = archive_dir
+        self.interval     = max(60.0, interval)
+        self.batch_size   = max(1, batch_size)
+        self.vacuum_pages = vacuum_pages
+        self.pruned       = 0
+        self.archived     = 0
+        self.vacuumed     = 0
+        self.passes       = 0
+        self.last_run     = None
+        self.last_error   = None
+        self._lock        = threading.Lock()
+        self._thread      = None
+        self._pid         = None
+
+    def ensure_started(self):
+        if self.days <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid    = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='click-retention', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(min(self.interval, 300))
+            try:
+                if self._claim():
+                    self.run()
+            except Exception as exc:
+                self.last_error = str(exc)
+                app.logger.error('click retention: %s', exc)
+
+    def _claim(self):
+        """Take the lease for the next pass; False if another worker holds it."""
+        now = int(time.time())
+        with get_db() as conn:
+            conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('retention_next_run', 0)")
+            return conn.execute(
+                "UPDATE app_meta SET value=? WHERE key='retention_next_run' AND value<=? RETURNING value",
+                (now + int(self.interval), now)).fetchone() is not None
+
+    def run(self, days=None, progress=None):
+        """Archive and delete every whole day of clicks older than `days` (default: the configured window).
+
+        Returns the number of clicks removed. `progress(day, removed)` is
+        called after each day.
+        """
+        days   = self.days if days is None else days
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+        start  = time.time()
+        total  = 0
+        while True:
+            with get_db() as conn:
+                oldest = conn.execute('SELECT MIN(clicked_at) FROM clicks').fetchone()[0]
+            if not oldest or oldest[:10] >= cutoff:
+                break
+            day  = datetime.strptime(oldest[:10], '%Y-%m-%d').date()
+            nxt  = day + timedelta(days=1)
+            path, through = self._archive_day(day, nxt) if self.archive != 'none' else (None, None)
+            with get_db() as conn:
+                conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('clicks_pruned_before', ?)",
+                             (int(nxt.strftime('%Y%m%d')),))
+                # Keep the lease while a long first pass works through the backlog
+                conn.execute("UPDATE app_meta SET value=? WHERE key='retention_next_run'",
+                             (int(time.time() + self.interval),))
+            removed = self._delete_day(day, nxt, through)
+            total  += removed
+            app.logger.info('click retention: removed %d clicks from %s%s', removed, day,
+                            f' (archived to {path})' if path else '')
+            if progress:
+                progress(day, removed)
+        if total:
+            self.vacuum()
+        self.passes  += 1
+        self.last_run = {'at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+                         'cutoff': cutoff, 'removed': total, 'seconds': round(time.time() - start, 3)}
+        self.last_error = None
+        return total
+
+    def _archive_path(self, day):
+        return os.path.join(self.archive_dir, f'{day:%Y}', f'{day:%m}', f'clicks-{day:%Y-%m-%d}.{self.archive}.gz')
+
+    def _archive_day(self, day, nxt):
+        """Archive the day's clicks; returns (path, highest click id the file holds).
+
+        A file left by a pass that stopped before deleting every row is kept,
+        and clicks the day gained since are added to it as another gzip member
+        (without a CSV header), so the file covers whatever _delete_day() removes.
+        """
+        path   = self._archive_path(day)
+        exists = os.path.exists(path)
+        last   = self._archived_through(path) if exists else 0
+        with get_db() as conn:
+            if exists and not conn.execute(
+                    'SELECT 1 FROM clicks WHERE clicked_at>=? AND clicked_at<? AND id>? LIMIT 1',
+                    (day.isoformat(), nxt.isoformat(), last)).fetchone():
+                return path, last
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sql = (f"SELECT {', '.join('l.code' if c == 'code' else 'c.' + c for c in ARCHIVE_COLUMNS)} "
+               'FROM click_events c LEFT JOIN links l ON l.id=c.link_id '
+               'WHERE c.clicked_at>=? AND c.clicked_at<? AND c.id>? ORDER BY c.clicked_at, c.id')
+        params = (day.isoformat(), nxt.isoformat(), last)
+
+        def track(row):
+            nonlocal last
+            last = max(last, row[0])   # ARCHIVE_COLUMNS[0] is the click id
+            return tuple(row)
+
+        if self.archive == 'csv':
+            chunks = iter_csv(None if exists else ARCHIVE_COLUMNS, sql, params, track)
+        else:
+            chunks = self._iter_jsonl(sql, params, track)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        if exists:
+            shutil.copyfile(path, tmp)
+        with open(tmp, 'ab') as f:
+            for chunk in _gzip_chunks(chunks):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if not exists:
+            self.archived += 1
+        return path, last
+
+    def _archived_through(self, path):
+        """Highest click id in an existing archive file."""
+        last = 0
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+            if self.archive == 'csv':
+                next(f, None)   # header
+                for row in csv.reader(f):
+                    last = max(last, int(row[0]))
+            else:
+                for line in f:
+                    last = max(last, json.loads(line)['id'])
+        return last
+
+    @staticmethod
+    def _iter_jsonl(sql, params, to_row):
+        conn = _connect()
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(CSV_FETCH_ROWS)
+                if not rows:
+                    break
+                yield ''.join(json.dumps(dict(zip(ARCHIVE_COLUMNS, to_row(r)))) + '\n' for r in rows).encode('utf-8')
+        finally:
+            conn.close()
+
+    def _delete_day(self, day, nxt, through=None):
+        """Delete the day's clicks with id <= `through` (every click of the day if None)."""
+        removed = 0
+        bound   = '' if through is None else ' AND id<=?'
+        params  = (day.isoformat(), nxt.isoformat()) + (() if through is None else (through,))
+        while True:
+            with get_db() as conn:
+                n = conn.execute(
+                    'DELETE FROM clicks WHERE id IN '
+                    f'(SELECT id FROM clicks WHERE clicked_at>=? AND clicked_at<?{bound} LIMIT ?)',
+                    params + (self.batch_size,)).rowcount
+            removed      += n
+            self.pruned  += n
+            if n < self.batch_size:
+                return removed
+            time.sleep(self.PAUSE)
+
+    def vacuum(self):
+        """Return free pages to the OS, CLICK_VACUUM_PAGES per step. Needs auto_vacuum=INCREMENTAL."""
+        freed = 0
+        if self.vacuum_pages <= 0:
+            return freed
+        with get_db() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return freed
+        while True:
+            with get_db() as conn:
+                free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not free:
+                    break
+                # execute() only steps the pragma once (one page); executescript runs it to completion
+                conn.executescript(f'PRAGMA incremental_vacuum({self.vacuum_pages})')
+            freed += min(free, self.vacuum_pages)
+            time.sleep(self.PAUSE)
+        self.vacuumed += freed
+        return freed
+
+    def stats(self):
+        with get_db() as conn:
+            floor = pruned_before(conn)
+        return {
+            'retention_days':  self.days,
+            'archive':         self.archive,
+            'pruned_before':   floor or None,
+            'pruned':          self.pruned,
+            'archived_days':   self.archived,
+            'vacuumed_pages':  self.vacuumed,
+            'passes':          self.passes,
+            'last_run':        self.last_run,
+            'last_error':      self.last_error,
+        }
+
+
+click_retention = ClickRetention(CLICK_RETENTION_DAYS, CLICK_ARCHIVE, CLICK_ARCHIVE_DIR,
+                                 CLICK_PRUNE_INTERVAL, CLICK_PRUNE_BATCH, CLICK_VACUUM_PAGES)
+
+
+@app.before_request
+def _start_click_retention():
+    click_retention.ensure_started()
+
+
+def compact_db():
+    """Rebuild the database file with incremental auto-vacuum (one-off; locks the database)."""
+    with get_db() as conn:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    print('Database rebuilt with incremental auto-vacuum')
+
+
+@app.cli.command('prune-clicks')
+@click.option('--days', type=int, default=None, help='Retention window for this run (default CLICK_RETENTION_DAYS).')
+@click.option('--compact', is_flag=True,
+              help='Switch the database to incremental auto-vacuum and rebuild it (one-off, locks the database).')
+def prune_clicks_command(days, compact):
+    """Archive and delete raw clicks older than the retention window."""
+    if compact:
+        compact_db()
+    days = CLICK_RETENTION_DAYS if days is None else days
+    if days <= 0:
+        if not compact:
+            print('Retention is off: set CLICK_RETENTION_DAYS or pass --days')
+        return
+    n = click_retention.run(days, progress=lambda day, n: print(f'{day}: removed {n} clicks'))
+    print(f'Removed {n} clicks older than {days} days')
 
 
 # ─────────────────────────────────────────────
@@ -413,6 +2714,103 @@ def health():
     return jsonify({'status': 'ok'})
 
 
+# ─────────────────────────────────────────────
+# Metrics (Prometheus text format)
+# ─────────────────────────────────────────────
+
+@app.before_request
+def _start_request_timer():
+    metrics.ensure_started()
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        method=request.method, route=route, status=f'{response.status_code // 100}xx')
+    return response
+
+
+@metrics.gauge('click_queue_depth', 'Clicks waiting for the click writer')
+def _click_queue_depth():
+    return click_writer.queue.qsize() if click_writer._pid == os.getpid() else 0
+
+@metrics.gauge('clicks_dropped', 'Clicks dropped because the queue was full, since worker start')
+def _clicks_dropped():
+    return click_writer.dropped
+
+@metrics.gauge('clicks_written', 'Clicks stored by the click writer, since worker start')
+def _clicks_written():
+    return click_writer.written
+
+@metrics.gauge('clicks_failed', 'Clicks the click writer gave up on at shutdown, since worker start')
+def _clicks_failed():
+    return click_writer.failed
+
+@metrics.gauge('clicks_pruned', 'Clicks removed by retention, since worker start')
+def _clicks_pruned():
+    return click_retention.pruned
+
+@metrics.gauge('db_file_bytes', 'Size of the SQLite database file and its WAL', per_worker=False)
+def _db_file_bytes():
+    return sum(os.path.getsize(p) for p in (DB_PATH, f'{DB_PATH}-wal') if os.path.exists(p))
+
+@metrics.gauge('db_connections', 'Open SQLite connections')
+def _db_connections():
+    return db_pool_stats()['connections']
+
+@metrics.gauge('cache_entries', 'Entries held by in-process caches')
+def _cache_entries():
+    return {(('cache', 'link'),): link_cache.stats()['size'],
+            (('cache', 'qr'),):   qr_cache.stats()['entries'],
+            (('cache', 'geo'),):  geo.stats()['cache_size'],
+            (('cache', 'stats'),): stats_cache.stats()['scopes'],
+            (('cache', 'title'),): len(title_fetcher._cache),
+            (('cache', 'user_agents'),): ua_interner.stats()['size'],
+            (('cache', 'referrers'),):   referrer_interner.stats()['size'],
+            (('cache', 'assets'),):      len(static_assets) + len(html_shells),
+            **{(('cache', name),): c.stats()['size'] for name, c in _CLASSIFIERS}}
+
+@metrics.gauge('cache_lookups', 'In-process cache lookups since worker start, by result')
+def _cache_lookups():
+    qr = qr_cache.stats()
+    lookups = {(('cache', 'link'), ('result', 'hit')):  link_cache.hits,
+               (('cache', 'link'), ('result', 'miss')): link_cache.misses,
+               (('cache', 'qr'),   ('result', 'hit')):  qr['hits'] + qr['disk_hits'],
+               (('cache', 'qr'),   ('result', 'miss')): qr['misses'],
+               (('cache', 'geo'),  ('result', 'hit')):  geo.hits,
+               (('cache', 'geo'),  ('result', 'miss')): geo.misses,
+               (('cache', 'stats'), ('result', 'hit')):   stats_cache.hits,
+               (('cache', 'stats'), ('result', 'stale')): stats_cache.stale_hits,
+               (('cache', 'stats'), ('result', 'miss')):  stats_cache.misses,
+               (('cache', 'title'), ('result', 'hit')):   title_fetcher.hits + title_fetcher.coalesced,
+               (('cache', 'title'), ('result', 'miss')):  title_fetcher.misses,
+               (('cache', 'user_agents'), ('result', 'hit')):  ua_interner.hits,
+               (('cache', 'user_agents'), ('result', 'miss')): ua_interner.misses,
+               (('cache', 'referrers'), ('result', 'hit')):    referrer_interner.hits,
+               (('cache', 'referrers'), ('result', 'miss')):   referrer_interner.misses}
+    for name, classifier in _CLASSIFIERS:
+        c = classifier.stats()
+        lookups[(('cache', name), ('result', 'hit'))]  = c['hits']
+        lookups[(('cache', name), ('result', 'miss'))] = c['misses']
+    return lookups
+
+@metrics.gauge('jobs', 'Background jobs by status', per_worker=False)
+def _jobs_by_status():
+    return {(('status', k),): v for k, v in job_runner.stats()['by_status'].items()}
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """All workers' metrics, for an admin session or `Authorization: Bearer $METRICS_TOKEN`."""
+    if not (METRICS_PUBLIC or session.get('is_admin') or (METRICS_TOKEN and hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'))):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/config')
 def get_config():
     """Public endpoint — exposes non-sensitive deployment config to the frontend."""
@@ -482,22 +2880,27 @@ def shorten():
     if custom_code and not re.match(r'^[a-zA-Z0-9]{1,20}$', custom_code):
         return jsonify({'error': 'Custom code must be 1–20 alphanumeric characters'}), 400
 
-    code = custom_code or generate_code(long_url)
-
     with get_db() as conn:
-        existing = conn.execute('SELECT code FROM links WHERE code=?', (code,)).fetchone()
-        if existing:
-            if custom_code:
-                return jsonify({'error': 'Custom code already taken'}), 409
-            code = generate_code(long_url + str(time.time()))
-
-        conn.execute(
-            'INSERT INTO links (code,long_url,title,created_at,expires_at,user_id) VALUES (?,?,?,?,?,?)',
-            (code, long_url, title or None,
-             datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
-             expires_at or None, session.get('user_id'))
-        )
-        link_id = conn.execute('SELECT id FROM links WHERE code=?', (code,)).fetchone()['id']
+        for attempt in itertools.count():
+            code = custom_code or code_allocator.next()
+            try:
+                link_id = conn.execute(
+                    'INSERT INTO links (code,long_url,title,created_at,expires_at,user_id) VALUES (?,?,?,?,?,?)',
+                    (code, long_url, title or None,
+                     datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+                     expires_at or None, session.get('user_id'))
+                ).lastrowid
+                break
+            except sqlite3.IntegrityError as exc:
+                if not is_code_collision(exc):
+                    raise                        # e.g. the session's user has been deleted
+                if custom_code:
+                    return jsonify({'error': 'Custom code already taken'}), 409
+                conn.rollback()                  # release the write lock before allocating again
+                code_allocator.collisions += 1   # slot held by a custom or legacy code
+                if attempt >= 8:
+                    raise RuntimeError('Too many short code collisions; check CODE_LENGTH')
+        stats_cache.invalidate(conn)
         if tags:
             set_link_tags(conn, link_id, tags)
 
@@ -514,15 +2917,18 @@ def shorten():
 @app.route('/api/links', methods=['GET'])
 @login_required
 def list_links():
-    page        = int(request.args.get('page', 1))
     per_page    = min(int(request.args.get('per_page', 20)), 100)
-    offset      = (page - 1) * per_page
+    after       = request.args.get('after')
+    count_mode  = request.args.get('count', 'exact')
     search      = (request.args.get('q') or '').strip()
     tag_filter  = (request.args.get('tag') or '').strip().lower()
     user_filter = (request.args.get('user') or '').strip()
     is_admin    = session.get('is_admin', False)
     user_id     = session.get('user_id')
 
+    if count_mode not in ('exact', 'approx', 'none'):
+        return jsonify({'error': 'count must be exact, approx or none'}), 400
+
     where_clauses = ['l.is_active=1']
     params = []
 
@@ -537,7 +2943,32 @@ def list_links():
         )
         params.append(user_filter)
 
-    if search:
+    cursor = None
+    if after:
+        cursor = decode_list_cursor(after)
+        if cursor is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    # Search goes through the FTS index when there is one. Small match sets
+    # are ordered by relevance; broad ones keep the normal listing order so
+    # SQLite can stop after one page instead of ranking every match.
+    from_sql = 'links l'
+    ranked   = False
+    match    = fts_query(search) if search and LINK_FTS else ''
+    if match:
+        if cursor is not None:
+            ranked = isinstance(cursor, int)
+        else:
+            with get_db() as conn, metrics.timer('db_query_duration_seconds', query='list_fts_matches'):
+                matches = conn.execute('SELECT COUNT(*) FROM links_fts WHERE links_fts MATCH ?',
+                                       (match,)).fetchone()[0]
+            ranked = matches <= SEARCH_RANK_MAX
+        # CROSS JOIN keeps the index as the outer loop; otherwise the planner
+        # may walk every active link and run the MATCH once per row
+        from_sql = 'links_fts CROSS JOIN links l ON l.id=links_fts.rowid'
+        where_clauses.append('links_fts MATCH ?')
+        params.append(match)
+    elif search:
         where_clauses.append('(l.code LIKE ? OR l.long_url LIKE ? OR l.title LIKE ?)')
         s = f'%{search}%'
         params += [s, s, s]
@@ -549,21 +2980,105 @@ def list_links():
         params.append(tag_filter)
 
     where_sql = ' AND '.join(where_clauses)
+
+    # Keyset pagination: `after` continues strictly past the last row of the
+    # previous page; page/offset is kept for older clients. Ranked search
+    # results have no stable key, so their cursor carries an offset instead.
+    page_from, page_sql, page_params = from_sql, where_sql, list(params)
+    if match and not ranked:
+        page_from = 'links l'
+        page_sql  = where_sql.replace(
+            'links_fts MATCH ?', 'l.id IN (SELECT rowid FROM links_fts WHERE links_fts MATCH ?)')
+    order_sql = 'l.is_pinned DESC, l.created_at DESC, l.id DESC'
+    if ranked:
+        order_sql = 'links_fts.rank, l.id DESC'
+    page, offset = None, 0
+    if cursor is not None:
+        if isinstance(cursor, int) != ranked:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if ranked:
+            offset = cursor
+        else:
+            page_sql += ' AND (l.is_pinned, l.created_at, l.id) < (?, ?, ?)'
+            page_params += cursor
+    else:
+        page   = int(request.args.get('page', 1))
+        offset = (page - 1) * per_page
+
     with get_db() as conn:
-        total = conn.execute(f'SELECT COUNT(*) FROM links l WHERE {where_sql}', params).fetchone()[0]
-        rows  = conn.execute(
-            f'SELECT * FROM links l WHERE {where_sql} ORDER BY l.is_pinned DESC, l.created_at DESC LIMIT ? OFFSET ?',
-            params + [per_page, offset]
-        ).fetchall()
-        links = [format_link(r, conn) for r in rows]
+        with metrics.timer('db_query_duration_seconds', query='list_page'):
+            rows = conn.execute(
+                f'SELECT l.* FROM {page_from} WHERE {page_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?',
+                page_params + [per_page + 1, offset]
+            ).fetchall()
+        has_more, rows = len(rows) > per_page, rows[:per_page]
+        if count_mode == 'none':
+            total = None
+        elif count_mode == 'approx':
+            total = link_counts.get(conn, f'{from_sql} WHERE {where_sql}', params)
+        else:
+            with metrics.timer('db_query_duration_seconds', query='list_count'):
+                total = conn.execute(f'SELECT COUNT(*) FROM {from_sql} WHERE {where_sql}', params).fetchone()[0]
+        with metrics.timer('db_query_duration_seconds', query='list_format'):
+            links = format_links(rows, conn)
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_list_cursor(offset=offset + per_page) if ranked else encode_list_cursor(rows[-1])
+    return jsonify({
+        'links': links, 'total': total, 'page': page, 'per_page': per_page,
+        'next':  next_cursor,
+    })
 
-    return jsonify({'links': links, 'total': total, 'page': page, 'per_page': per_page})
 
+def encode_list_cursor(row=None, offset=None):
+    """Opaque token for the position just after `row` (or at `offset` for ranked search)."""
+    raw = f'@{offset}' if row is None else f"{row['is_pinned'] or 0}|{row['created_at']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-def _can_access_link(link):
-    """Return True if the current session user may read/write this link."""
-    if session.get('is_admin'):
-        return True
+
+def decode_list_cursor(token):
+    """Inverse of encode_list_cursor(): a keyset triple, an int offset, or None if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        if raw.startswith('@'):
+            return max(int(raw[1:]), 0)
+        pinned, created_at, link_id = raw.split('|')
+        return [int(pinned), created_at, int(link_id)]
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class LinkCountCache:
+    """Per-worker TTL cache of listing totals for ?count=approx."""
+
+    def __init__(self, ttl):
+        self.ttl      = ttl
+        self._entries = {}
+        self._lock    = threading.Lock()
+
+    def get(self, conn, from_where_sql, params):
+        key = (from_where_sql, tuple(params))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        total = conn.execute(f'SELECT COUNT(*) FROM {from_where_sql}', params).fetchone()[0]
+        with self._lock:
+            if len(self._entries) >= 1024:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            self._entries[key] = (now + self.ttl, total)
+        return total
+
+
+link_counts = LinkCountCache(LINK_COUNT_CACHE_TTL)
+
+
+def _can_access_link(link):
+    """Return True if the current session user may read/write this link."""
+    if session.get('is_admin'):
+        return True
     return link['user_id'] == session.get('user_id')
 
 @app.route('/api/links/<code>', methods=['GET'])
@@ -598,6 +3113,8 @@ def edit_link(code):
             set_clause = ', '.join(f'{k}=?' for k in updates)
             conn.execute(f'UPDATE links SET {set_clause} WHERE code=?',
                          list(updates.values()) + [code])
+            link_cache.invalidate(conn, [code])
+            stats_cache.invalidate(conn)
         if 'tags' in data:
             set_link_tags(conn, link['id'], data['tags'])
 
@@ -613,6 +3130,9 @@ def delete_link(code):
         if not link or not _can_access_link(link):
             return jsonify({'error': 'Not found'}), 404
         conn.execute('UPDATE links SET is_active=0 WHERE code=?', (code,))
+        link_cache.invalidate(conn, [code])
+        stats_cache.invalidate(conn)
+    qr_cache.invalidate(f"{BASE_URL}/{code}")
     return jsonify({'success': True})
 
 
@@ -630,64 +3150,49 @@ def link_analytics(code):
             return jsonify({'error': 'Not found'}), 404
 
         link_id = link['id']
-        since   = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)).isoformat()
-
-        daily_rows = conn.execute("""
-            SELECT substr(clicked_at,1,10) as day, COUNT(*) as count
-            FROM clicks WHERE link_id=? AND clicked_at>=?
-            GROUP BY day ORDER BY day
-        """, (link_id, since)).fetchall()
-        daily_map = {r['day']: r['count'] for r in daily_rows}
+        today   = datetime.now(timezone.utc).replace(tzinfo=None)
+        since   = (today - timedelta(days=days-1)).strftime('%Y-%m-%d')
+
+        if not rollups_ready(conn):
+            return jsonify(_raw_link_analytics(conn, link, code, days, today, since))
+
+        with metrics.timer('db_query_duration_seconds', query='analytics_daily'):
+            daily_map = {r['day']: r['count'] for r in conn.execute(
+                'SELECT day, count FROM click_daily WHERE link_id=? AND day>=?', (link_id, since)
+            )}
         daily = [
-            {'date': (datetime.now(timezone.utc).replace(tzinfo=None)-timedelta(days=days-1-i)).strftime('%Y-%m-%d'), 'clicks': 0}
+            {'date': (today-timedelta(days=days-1-i)).strftime('%Y-%m-%d'), 'clicks': 0}
             for i in range(days)
         ]
         for d in daily: d['clicks'] = daily_map.get(d['date'], 0)
 
-        ref_rows = conn.execute(
-            'SELECT referrer, COUNT(*) as count FROM clicks WHERE link_id=? AND clicked_at>=? GROUP BY referrer',
-            (link_id, since)
-        ).fetchall()
-        referrers = {}
-        for r in ref_rows:
-            b = parse_referrer(r['referrer']); referrers[b] = referrers.get(b,0) + r['count']
-        referrers = [{'source':k,'count':v} for k,v in sorted(referrers.items(), key=lambda x:-x[1])]
-
-        ua_rows = conn.execute(
-            'SELECT user_agent, COUNT(*) as count FROM clicks WHERE link_id=? AND clicked_at>=? GROUP BY user_agent',
-            (link_id, since)
-        ).fetchall()
-        devices = {}; browsers = {}
-        for r in ua_rows:
-            ua = r['user_agent'] or ''
-            devices[parse_device(ua)]   = devices.get(parse_device(ua),0)   + r['count']
-            browsers[parse_browser(ua)] = browsers.get(parse_browser(ua),0) + r['count']
-        devices  = [{'device':k,'count':v}  for k,v in sorted(devices.items(),  key=lambda x:-x[1])]
-        browsers = [{'browser':k,'count':v} for k,v in sorted(browsers.items(), key=lambda x:-x[1])]
+        dims = {'source': {}, 'device': {}, 'browser': {}, 'country': {}}
+        with metrics.timer('db_query_duration_seconds', query='analytics_dims'):
+            for r in conn.execute(
+                'SELECT dim, value, SUM(count) AS count FROM click_dims '
+                'WHERE link_id=? AND day>=? GROUP BY dim, value', (link_id, since)
+            ):
+                dims[r['dim']][r['value']] = r['count']
+        ranked = lambda m: sorted(m.items(), key=lambda x: -x[1])
+        referrers = [{'source':k,'count':v}  for k,v in ranked(dims['source'])]
+        devices   = [{'device':k,'count':v}  for k,v in ranked(dims['device'])]
+        browsers  = [{'browser':k,'count':v} for k,v in ranked(dims['browser'])]
+        countries = [{'country':k,'count':v} for k,v in ranked(dims['country'])[:20]]
 
         # Hourly heatmap: 7 days-of-week × 24 hours
         # SQLite strftime('%w') returns 0=Sunday … 6=Saturday; we map to 0=Monday … 6=Sunday
-        hourly_rows = conn.execute("""
-            SELECT CAST(strftime('%w', clicked_at) AS INTEGER) as dow,
-                   CAST(strftime('%H', clicked_at) AS INTEGER) as hr,
-                   COUNT(*) as count
-            FROM clicks WHERE link_id=? AND clicked_at>=?
-            GROUP BY dow, hr
-        """, (link_id, since)).fetchall()
+        with metrics.timer('db_query_duration_seconds', query='analytics_hourly'):
+            hourly_rows = conn.execute("""
+                SELECT CAST(strftime('%w', day) AS INTEGER) as dow, hour as hr, SUM(count) as count
+                FROM click_hourly WHERE link_id=? AND day>=?
+                GROUP BY dow, hr
+            """, (link_id, since)).fetchall()
         # heatmap[day_of_week 0=Mon][hour 0-23]
         heatmap = [[0] * 24 for _ in range(7)]
         for r in hourly_rows:
             mon_dow = (r['dow'] - 1) % 7  # 0=Sun→6, 1=Mon→0, …
             heatmap[mon_dow][r['hr']] = r['count']
 
-        # Geographic breakdown
-        country_rows = conn.execute("""
-            SELECT COALESCE(NULLIF(country,''),'Unknown') as country, COUNT(*) as count
-            FROM clicks WHERE link_id=? AND clicked_at>=?
-            GROUP BY country ORDER BY count DESC LIMIT 20
-        """, (link_id, since)).fetchall()
-        countries = [{'country': r['country'], 'count': r['count']} for r in country_rows]
-
     return jsonify({
         'code': code, 'days': days,
         'total_clicks':  link['clicks'],
@@ -697,76 +3202,379 @@ def link_analytics(code):
     })
 
 
+def _raw_link_analytics(conn, link, code, days, today, since):
+    """link_analytics() from raw clicks, while the rollup backfill job hasn't finished."""
+    daily_counts, hourly_counts, dim_counts = raw_rollups(conn, 'link_id=? AND clicked_at>=?',
+                                                          (link['id'], since))
+    daily = [
+        {'date': (today-timedelta(days=days-1-i)).strftime('%Y-%m-%d'), 'clicks': 0}
+        for i in range(days)
+    ]
+    for d in daily: d['clicks'] = daily_counts.get((link['id'], d['date']), 0)
+    dims = {'source': {}, 'device': {}, 'browser': {}, 'country': {}}
+    for (_, dim, _, value), n in dim_counts.items():
+        dims[dim][value] = dims[dim].get(value, 0) + n
+    ranked = lambda m: sorted(m.items(), key=lambda x: -x[1])
+    heatmap = [[0] * 24 for _ in range(7)]
+    for (_, day, hour), n in hourly_counts.items():
+        heatmap[datetime.strptime(day, '%Y-%m-%d').weekday()][hour] += n
+    return {
+        'code': code, 'days': days,
+        'total_clicks':  link['clicks'],
+        'period_clicks': sum(d['clicks'] for d in daily),
+        'daily': daily,
+        'referrers': [{'source':k,'count':v}  for k,v in ranked(dims['source'])],
+        'devices':   [{'device':k,'count':v}  for k,v in ranked(dims['device'])],
+        'browsers':  [{'browser':k,'count':v} for k,v in ranked(dims['browser'])],
+        'heatmap': heatmap,
+        'countries': [{'country':k,'count':v} for k,v in ranked(dims['country'])[:20]],
+    }
+
+
 # ─────────────────────────────────────────────
 # Click-event CSV export
 # ─────────────────────────────────────────────
 
+CSV_FETCH_ROWS = 1000
+
+def iter_csv(header, sql, params, to_row, progress=None):
+    """Yield UTF-8 CSV chunks for a query, holding at most CSV_FETCH_ROWS rows at a time.
+
+    Runs on its own connection because the response body is produced after
+    the request (and its teardown) has finished. `progress(rows)` is called
+    with the running row count after each chunk.
+    """
+    buf    = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(header)
+    conn = _connect()
+    done = 0
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(CSV_FETCH_ROWS)
+            if not rows:
+                break
+            writer.writerows(to_row(r) for r in rows)
+            done += len(rows)
+            if progress:
+                progress(done)
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0); buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode('utf-8')
+    finally:
+        conn.close()
+
+
+def _gzip_chunks(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits=31 → gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def csv_response(chunks, filename):
+    """Stream CSV chunks as a download, gzip-encoded when the client accepts it."""
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        chunks = _gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype='text/csv', headers=headers)
+
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+def clicks_csv(link, start=None, end=None, progress=None):
+    """CSV chunks of one link's click events, newest first, optionally limited to [start, end] days."""
+    where, params = ['link_id=?'], [link['id']]
+    if start:
+        where.append('clicked_at>=?'); params.append(start.isoformat())
+    if end:
+        where.append('clicked_at<?');  params.append((end + timedelta(days=1)).isoformat())
+
+    def to_row(row):
+        return [row['clicked_at'], row['referrer'] or '',
+                row['device']  or parse_device(row['user_agent']),
+                row['browser'] or parse_browser(row['user_agent']), row['country'] or '']
+
+    return iter_csv(['timestamp', 'referrer', 'device', 'browser', 'country'],
+                    'SELECT clicked_at, referrer, user_agent, device, browser, country FROM click_events '
+                    f"WHERE {' AND '.join(where)} ORDER BY clicked_at DESC", params, to_row, progress)
+
+
 @app.route('/api/links/<code>/clicks/export')
 @login_required
 def export_clicks(code):
+    try:
+        start = _parse_day(request.args.get('from'))
+        end   = _parse_day(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
     with get_db() as conn:
         link = conn.execute('SELECT * FROM links WHERE code=?', (code,)).fetchone()
         if not link or not _can_access_link(link):
             return jsonify({'error': 'Not found'}), 404
-        rows = conn.execute(
-            'SELECT clicked_at, referrer, user_agent, country FROM clicks '
-            'WHERE link_id=? ORDER BY clicked_at DESC',
-            (link['id'],)
-        ).fetchall()
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(['timestamp', 'referrer', 'device', 'browser', 'country'])
-    for row in rows:
-        ua = row['user_agent'] or ''
-        writer.writerow([
-            row['clicked_at'],
-            row['referrer'] or '',
-            parse_device(ua),
-            parse_browser(ua),
-            row['country'] or '',
-        ])
-    return Response(
-        buf.getvalue().encode('utf-8'),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename="clicks-{code}.csv"'}
-    )
+    return csv_response(clicks_csv(link, start, end), f'clicks-{code}.csv')
 
 
 # ─────────────────────────────────────────────
 # Fetch Title
 # ─────────────────────────────────────────────
 
+_OG_TITLE_RES = (
+    re.compile(r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']*)["\']', re.I),
+    re.compile(r'<meta[^>]+content=["\']([^"\']*)["\'][^>]+property=["\']og:title["\']', re.I),
+)
+_TITLE_RE    = re.compile(r'<title[^>]*>([^<]+)</title>', re.I)
+_HEAD_END_RE = re.compile(r'</head\s*>|<body[\s>]', re.I)
+
+
+def scan_title(chunks):
+    """Return og:title, else <title>, from an iterable of HTML text chunks.
+
+    Stops reading at og:title, or at the end of <head> once a <title> has
+    been seen, since og:title only appears in the head.
+    """
+    text, title = '', None
+    for chunk in chunks:
+        text += chunk
+        for pattern in _OG_TITLE_RES:
+            m = pattern.search(text)
+            if m:
+                return unescape(m.group(1)).strip()[:200]
+        if title is None:
+            m = _TITLE_RE.search(text)
+            if m:
+                title = unescape(m.group(1)).strip()[:200]
+        if title is not None and _HEAD_END_RE.search(text):
+            break
+    return title or ''
+
+
+class HostBusy(Exception):
+    """Every per-host fetch slot stayed taken until the deadline."""
+
+
+class TitleFetcher:
+    """Page titles for /api/fetch-title, fetched on a bounded thread pool.
+
+    Results (including failures, as '') are cached per URL; concurrent
+    callers for one URL share a single fetch. At most `per_host` fetches
+    talk to one host at a time, and idle keep-alive connections are kept per
+    host for the next fetch. Bodies are read in chunks and scanned as they
+    arrive, up to `max_bytes`.
+    """
+
+    MAX_REDIRECTS = 5
+    CHUNK         = 8192
+    HEADERS       = {
+        'User-Agent': 'Mozilla/5.0 (compatible; QRknit-title-fetcher/1.0)',
+        'Accept': 'text/html',
+    }
+
+    def __init__(self, workers, per_host, timeout, max_bytes, cache_size, ttl, negative_ttl):
+        self.workers      = max(1, workers)
+        self.per_host     = max(1, per_host)
+        self.timeout      = timeout
+        self.max_bytes    = max_bytes
+        self.cache_size   = cache_size
+        self.ttl          = ttl
+        self.negative_ttl = negative_ttl
+        self.hits         = 0
+        self.misses       = 0
+        self.coalesced    = 0
+        self.fetches      = 0
+        self.failures     = 0
+        self.reused       = 0
+        self._cache       = OrderedDict()   # url → (expires, title)
+        self._inflight    = {}              # url → Future
+        self._hosts       = {}              # (scheme, netloc) → BoundedSemaphore
+        self._idle        = {}              # (scheme, netloc) → [idle connections]
+        self._lock        = threading.Lock()
+        self._pool        = None
+        self._pid         = None
+
+    def _executor(self):
+        # Created lazily and per process, like the other background threads
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._inflight, self._idle = {}, {}
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='title-fetch')
+                    self._pid  = os.getpid()
+        return self._pool
+
+    def title(self, url):
+        """Return the cached or freshly fetched title for `url` ('' if there is none).
+
+        Waits at most `timeout` seconds for a result; a fetch that is still
+        running after that keeps going and fills the cache for the next call.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(url)
+                self.hits += 1
+                return entry[1]
+            pending = self._inflight.get(url)
+            if pending is not None:
+                self.coalesced += 1
+        if pending is None:
+            pool = self._executor()
+            with self._lock:
+                pending = self._inflight.get(url)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._inflight[url] = pool.submit(self._fetch_and_store, url)
+        try:
+            return pending.result(timeout=self.timeout)
+        except FutureTimeout:
+            return ''
+
+    def _fetch_and_store(self, url):
+        ttl = None
+        try:
+            title = self._fetch(url)
+            ttl   = self.ttl if title else self.negative_ttl
+        except HostBusy:
+            title = ''   # our own limit, not the site's fault: don't cache
+        except Exception as exc:
+            app.logger.debug('fetch-title: %s: %s', url, exc)
+            title = ''
+            ttl   = self.negative_ttl
+            self.failures += 1
+        with self._lock:
+            self._inflight.pop(url, None)
+            if self.cache_size > 0 and ttl:
+                self._cache[url] = (time.monotonic() + ttl, title)
+                self._cache.move_to_end(url)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return title
+
+    def _host_slot(self, key):
+        with self._lock:
+            sem = self._hosts.get(key)
+            if sem is None:
+                sem = self._hosts[key] = threading.BoundedSemaphore(self.per_host)
+        return sem
+
+    def _connection(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+        scheme, netloc = key
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(netloc, timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _fetch(self, url):
+        deadline = time.monotonic() + self.timeout
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.netloc:
+                return ''
+            key  = (parts.scheme, parts.netloc)
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            slot = self._host_slot(key)
+            if not slot.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise HostBusy(parts.netloc)
+            try:
+                status, location, title = self._get(key, path, deadline)
+            finally:
+                slot.release()
+            if location is None:
+                return title if 200 <= status < 300 else ''
+            url = urljoin(url, location)
+        return ''
+
+    def _get(self, key, path, deadline):
+        """One GET on a pooled connection; returns (status, redirect location or None, title)."""
+        conn, reused = self._connection(key)
+        resp = None
+        try:
+            self.fetches += 1
+            try:
+                conn.request('GET', path, headers=self.HEADERS)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                if not reused:
+                    raise
+                conn.close()   # the server dropped an idle keep-alive connection; retry once
+                conn.request('GET', path, headers=self.HEADERS)
+                resp = conn.getresponse()
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+                resp.read(self.CHUNK)
+                return resp.status, resp.getheader('Location'), ''
+            if 'html' not in (resp.getheader('Content-Type') or '').lower():
+                return resp.status, None, ''
+            charset = resp.headers.get_content_charset() or 'utf-8'
+            try:
+                decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            except LookupError:
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+            def chunks():
+                left = self.max_bytes
+                while left > 0 and time.monotonic() < deadline:
+                    data = resp.read1(min(self.CHUNK, left))
+                    if not data:
+                        return
+                    left -= len(data)
+                    yield decoder.decode(data)
+
+            return resp.status, None, scan_title(chunks())
+        finally:
+            # Reuse only connections whose response was read to the end
+            if resp is not None and not resp.isclosed() and resp.length == 0:
+                resp.read()   # read1() leaves a fully read response open; this closes it
+            if resp is not None and conn.sock is not None and resp.isclosed() and not resp.will_close:
+                self._release(key, conn)
+            else:
+                conn.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'cache_size': len(self._cache),
+            'hits':       self.hits,
+            'misses':     self.misses,
+            'coalesced':  self.coalesced,
+            'hit_rate':   round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            'fetches':    self.fetches,
+            'failures':   self.failures,
+            'reused':     self.reused,
+        }
+
+
+title_fetcher = TitleFetcher(TITLE_FETCH_WORKERS, TITLE_FETCH_PER_HOST, TITLE_FETCH_TIMEOUT,
+                             TITLE_FETCH_MAX_BYTES, TITLE_CACHE_SIZE, TITLE_CACHE_TTL, TITLE_NEGATIVE_TTL)
+
+
 @app.route('/api/fetch-title')
 @login_required
 def fetch_title():
     """Fetch the page title for a URL server-side (avoids CORS)."""
-    import urllib.request as urllib_req
     url = (request.args.get('url') or '').strip()
     if not url or not validate_url(url):
         return jsonify({'title': ''})
-    try:
-        req = urllib_req.Request(url, headers={
-            'User-Agent': 'Mozilla/5.0 (compatible; QRknit-title-fetcher/1.0)',
-            'Accept': 'text/html',
-        })
-        with urllib_req.urlopen(req, timeout=5) as resp:
-            ct = resp.headers.get('Content-Type', '')
-            if 'html' not in ct.lower():
-                return jsonify({'title': ''})
-            html = resp.read(65536).decode('utf-8', errors='replace')
-        # og:title (two attribute orderings)
-        m = re.search(r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']*)["\']', html, re.I)
-        if not m:
-            m = re.search(r'<meta[^>]+content=["\']([^"\']*)["\'][^>]+property=["\']og:title["\']', html, re.I)
-        if m:
-            return jsonify({'title': m.group(1).strip()[:200]})
-        # Fall back to <title>
-        m = re.search(r'<title[^>]*>([^<]+)</title>', html, re.I)
-        if m:
-            return jsonify({'title': m.group(1).strip()[:200]})
-        return jsonify({'title': ''})
-    except Exception:
-        return jsonify({'title': ''})
+    return jsonify({'title': title_fetcher.title(url)})
 
 
 # ─────────────────────────────────────────────
@@ -785,68 +3593,206 @@ def list_tags():
     return jsonify({'tags': [dict(r) for r in rows]})
 
 
-@app.route('/api/stats')
-@login_required
-def stats():
-    is_admin = session.get('is_admin', False)
-    user_id  = session.get('user_id')
+def compute_stats(user_id=None):
+    """Dashboard totals, top links and the 30-day click series; all links when `user_id` is None."""
+    owner = '' if user_id is None else ' AND user_id=?'
+    args  = () if user_id is None else (user_id,)
     with get_db() as conn:
-        if is_admin:
-            total_links  = conn.execute('SELECT COUNT(*) FROM links WHERE is_active=1').fetchone()[0]
-            total_clicks = conn.execute('SELECT COALESCE(SUM(clicks),0) FROM links WHERE is_active=1').fetchone()[0]
-        else:
-            total_links  = conn.execute('SELECT COUNT(*) FROM links WHERE is_active=1 AND user_id=?', (user_id,)).fetchone()[0]
-            total_clicks = conn.execute('SELECT COALESCE(SUM(clicks),0) FROM links WHERE is_active=1 AND user_id=?', (user_id,)).fetchone()[0]
+        with metrics.timer('db_query_duration_seconds', query='stats_totals'):
+            total_links, total_clicks = conn.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(clicks),0) FROM links WHERE is_active=1{owner}', args
+            ).fetchone()
 
-        since_7d  = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=7)).isoformat()
-        since_30d = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=30)).isoformat()
+        today     = datetime.now(timezone.utc).replace(tzinfo=None)
+        since_7d  = (today - timedelta(days=6)).strftime('%Y-%m-%d')
+        since_30d = (today - timedelta(days=29)).strftime('%Y-%m-%d')
 
-        if is_admin:
-            clicks_7d = conn.execute(
-                'SELECT COUNT(*) FROM clicks c JOIN links l ON c.link_id=l.id '
-                'WHERE c.clicked_at>=? AND l.is_active=1', (since_7d,)
-            ).fetchone()[0]
+        with metrics.timer('db_query_duration_seconds', query='stats_top_daily'):
             top_links = conn.execute(
-                'SELECT code, long_url, title, clicks FROM links WHERE is_active=1 '
-                'ORDER BY clicks DESC LIMIT 5'
+                f'SELECT id, code, long_url, title, clicks FROM links WHERE is_active=1{owner} '
+                'ORDER BY clicks DESC LIMIT 5', args
             ).fetchall()
-            daily_rows = conn.execute("""
-                SELECT substr(c.clicked_at,1,10) as day, COUNT(*) as count
-                FROM clicks c JOIN links l ON c.link_id=l.id
-                WHERE c.clicked_at>=? AND l.is_active=1
-                GROUP BY day ORDER BY day
-            """, (since_30d,)).fetchall()
-        else:
-            clicks_7d = conn.execute(
-                'SELECT COUNT(*) FROM clicks c JOIN links l ON c.link_id=l.id '
-                'WHERE c.clicked_at>=? AND l.is_active=1 AND l.user_id=?', (since_7d, user_id)
-            ).fetchone()[0]
-            top_links = conn.execute(
-                'SELECT code, long_url, title, clicks FROM links WHERE is_active=1 AND user_id=? '
-                'ORDER BY clicks DESC LIMIT 5', (user_id,)
-            ).fetchall()
-            daily_rows = conn.execute("""
-                SELECT substr(c.clicked_at,1,10) as day, COUNT(*) as count
-                FROM clicks c JOIN links l ON c.link_id=l.id
-                WHERE c.clicked_at>=? AND l.is_active=1 AND l.user_id=?
-                GROUP BY day ORDER BY day
-            """, (since_30d, user_id)).fetchall()
-
-        daily_map = {r['day']: r['count'] for r in daily_rows}
-        daily = [
-            {'date': (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=29-i)).strftime('%Y-%m-%d'), 'clicks': 0}
-            for i in range(30)
-        ]
-        for d in daily:
-            d['clicks'] = daily_map.get(d['date'], 0)
+            if rollups_ready(conn):
+                daily_rows = conn.execute(f"""
+                    SELECT d.day, SUM(d.count) as count
+                    FROM click_daily d JOIN links l ON d.link_id=l.id
+                    WHERE d.day>=? AND l.is_active=1{owner.replace('user_id', 'l.user_id')}
+                    GROUP BY d.day
+                """, (since_30d,) + args).fetchall()
+            else:   # the rollup backfill job hasn't finished
+                daily_rows = conn.execute(f"""
+                    SELECT substr(c.clicked_at,1,10) AS day, COUNT(*) as count
+                    FROM clicks c JOIN links l ON c.link_id=l.id
+                    WHERE c.clicked_at>=? AND l.is_active=1{owner.replace('user_id', 'l.user_id')}
+                    GROUP BY day
+                """, (since_30d,) + args).fetchall()
+    clicks_7d = sum(r['count'] for r in daily_rows if r['day'] >= since_7d)
+
+    daily_map = {r['day']: r['count'] for r in daily_rows}
+    daily = [
+        {'date': (today - timedelta(days=29-i)).strftime('%Y-%m-%d'), 'clicks': 0}
+        for i in range(30)
+    ]
+    for d in daily:
+        d['clicks'] = daily_map.get(d['date'], 0)
 
-    return jsonify({
+    return {
         'total_links':  total_links,
         'total_clicks': total_clicks,
         'clicks_7d':    clicks_7d,
         'top_links':    [dict(r) for r in top_links],
         'daily':        daily,
-    })
+    }
+
+
+class StatsCache:
+    """Per-worker /api/stats results, one per scope: 'admin' or a user id.
+
+    A result is served as-is for `ttl` seconds, then served stale for up to
+    `stale` seconds while one background thread recomputes it; past that, or
+    on a cold scope, one request computes it and concurrent ones wait for
+    that result. Clicks stored by this worker's click writer are added to
+    the cached totals as they arrive (record_clicks); clicks from other
+    workers show up at the next refresh. Link changes bump `stats_gen` in
+    app_meta, which discards every worker's results.
+    """
+
+    def __init__(self, ttl, stale):
+        self.ttl         = ttl
+        self.stale       = max(ttl, stale)
+        self.hits        = 0
+        self.stale_hits  = 0
+        self.misses      = 0
+        self.refreshes   = 0
+        self.bumps       = 0
+        self._entries    = {}      # scope → {'data', 'expires', 'gen', 'day'}
+        self._lock       = threading.Lock()
+        self._computing  = {}      # scope → Lock held while one request computes it
+        self._refreshing = set()
+
+    @staticmethod
+    def _gen(conn):
+        row = conn.execute("SELECT value FROM app_meta WHERE key='stats_gen'").fetchone()
+        return row['value'] if row else 0
+
+    def get(self, scope):
+        """Return the stats payload for `scope` as a dict owned by the caller."""
+        if self.ttl <= 0:
+            return compute_stats(None if scope == 'admin' else scope)
+        with get_db() as conn:
+            gen = self._gen(conn)
+        entry = self._usable(scope, gen)
+        if entry is not None:
+            return entry
+        with self._lock:
+            computing = self._computing.setdefault(scope, threading.Lock())
+        with computing:
+            entry = self._usable(scope, gen, count=False)   # someone else may have just computed it
+            if entry is not None:
+                return entry
+            self.misses += 1
+            return self._refresh(scope, gen)
+
+    def _usable(self, scope, gen, count=True):
+        now   = time.monotonic()
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is None or entry['gen'] != gen or entry['day'] != today or now > entry['expires'] + self.stale:
+                return None
+            if now > entry['expires'] and scope not in self._refreshing:
+                self._refreshing.add(scope)
+                threading.Thread(target=self._refresh_in_background, args=(scope, gen),
+                                 name='stats-refresh', daemon=True).start()
+            if count:
+                if now > entry['expires']:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+            return json.loads(json.dumps(entry['data']))
+
+    def _refresh(self, scope, gen):
+        data = compute_stats(None if scope == 'admin' else scope)
+        with self._lock:
+            self._entries[scope] = {
+                'data': data, 'gen': gen, 'expires': time.monotonic() + self.ttl,
+                'day':  datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+            }
+            self.refreshes += 1
+        return json.loads(json.dumps(data))
+
+    def _refresh_in_background(self, scope, gen):
+        try:
+            self._refresh(scope, gen)
+        except Exception as exc:
+            app.logger.warning('stats cache: refreshing %r failed: %s', scope, exc)
+        finally:
+            with self._lock:
+                self._refreshing.discard(scope)
+
+    def record_clicks(self, conn, clicks):
+        """Add freshly written `(link_id, clicked_at)` clicks to the cached results."""
+        with self._lock:
+            if not self._entries:
+                return
+        per_link = {}
+        for link_id, clicked_at in clicks:
+            key = (link_id, clicked_at[:10])
+            per_link[key] = per_link.get(key, 0) + 1
+        # Runs after the clicks UPDATE, so these are the new totals
+        links = {r['id']: dict(r) for r in _existing(
+            conn, 'SELECT id, user_id, code, long_url, title, clicks FROM links WHERE is_active=1 AND id IN (%s)',
+            {link_id for link_id, _ in per_link})}
+        with self._lock:
+            for scope, entry in self._entries.items():
+                data  = entry['data']
+                days  = {d['date']: d for d in data['daily']}
+                top   = {t['id']: t for t in data['top_links']}
+                since = data['daily'][-7]['date']
+                for (link_id, day), n in per_link.items():
+                    link = links.get(link_id)
+                    if link is None or (scope != 'admin' and link['user_id'] != scope):
+                        continue
+                    data['total_clicks'] += n
+                    if day in days:
+                        days[day]['clicks'] += n
+                        if day >= since:
+                            data['clicks_7d'] += n
+                    top[link_id] = {k: link[k] for k in ('id', 'code', 'long_url', 'title', 'clicks')}
+                # Links outside the old top five that got no clicks can't have overtaken it
+                data['top_links'] = sorted(top.values(), key=lambda t: -t['clicks'])[:5]
+            self.bumps += len(clicks)
+
+    def invalidate(self, conn):
+        """Discard cached results here and, through app_meta, in every other worker."""
+        with self._lock:
+            self._entries.clear()
+        conn.execute("UPDATE app_meta SET value=value+1 WHERE key='stats_gen'")
+
+    def stats(self):
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            'scopes':     len(self._entries),
+            'hits':       self.hits,
+            'stale_hits': self.stale_hits,
+            'misses':     self.misses,
+            'hit_rate':   round((self.hits + self.stale_hits) / total, 4) if total else 0.0,
+            'refreshes':  self.refreshes,
+            'bumps':      self.bumps,
+        }
+
+
+stats_cache = StatsCache(STATS_CACHE_TTL, STATS_CACHE_STALE)
+
+
+@app.route('/api/stats')
+@login_required
+def stats():
+    scope = 'admin' if session.get('is_admin', False) else session.get('user_id')
+    data  = stats_cache.get(scope)
+    for link in data['top_links']:
+        del link['id']
+    return jsonify(data)
 
 
 # ─────────────────────────────────────────────
@@ -859,13 +3805,14 @@ def qr_code(code):
     bg_hex = request.args.get('bg', 'ffffff')
     size   = min(int(request.args.get('size', 300)), 1000)
     style  = request.args.get('style', 'square')
-    with get_db() as conn:
-        link = conn.execute('SELECT 1 FROM links WHERE code=? AND is_active=1', (code,)).fetchone()
-    if not link:
+    fmt    = request.args.get('format', 'png').lower()
+    if fmt not in QR_FORMATS:
+        return jsonify({'error': 'format must be png or svg'}), 400
+    link = link_cache.get(code)
+    if not link or not link['is_active']:
         return jsonify({'error': 'Not found'}), 404
-    png = generate_qr_png(f"{BASE_URL}/{code}", size=size,
-                          fg=hex_to_rgb(fg_hex), bg=hex_to_rgb(bg_hex), style=style)
-    return Response(png, mimetype='image/png', headers={'Cache-Control': 'public, max-age=3600'})
+    return qr_response(f"{BASE_URL}/{code}", size, hex_to_rgb(fg_hex), hex_to_rgb(bg_hex), style,
+                       fmt=fmt, persist=True, cache_control='public, max-age=3600')
 
 
 @app.route('/api/qr/custom', methods=['GET'])
@@ -877,8 +3824,10 @@ def qr_custom():
     bg_hex = request.args.get('bg', 'ffffff')
     size   = min(int(request.args.get('size', 300)), 1000)
     style  = request.args.get('style', 'square')
-    png = generate_qr_png(url, size=size, fg=hex_to_rgb(fg_hex), bg=hex_to_rgb(bg_hex), style=style)
-    return Response(png, mimetype='image/png')
+    fmt    = request.args.get('format', 'png').lower()
+    if fmt not in QR_FORMATS:
+        return jsonify({'error': 'format must be png or svg'}), 400
+    return qr_response(url, size, hex_to_rgb(fg_hex), hex_to_rgb(bg_hex), style, fmt=fmt)
 
 
 @app.route('/api/qr/custom', methods=['POST'])
@@ -891,6 +3840,9 @@ def qr_custom_post():
     bg_hex = (data.get('bg') or 'ffffff').lstrip('#')
     size   = min(int(data.get('size', 300)), 1000)
     style  = data.get('style', 'square')
+    fmt    = (data.get('format') or 'png').lower()
+    if fmt not in QR_FORMATS:
+        return jsonify({'error': 'format must be png or svg'}), 400
     logo_bytes = None
     logo_b64   = data.get('logo', '')
     if logo_b64:
@@ -898,9 +3850,326 @@ def qr_custom_post():
             logo_bytes = base64.b64decode(logo_b64)
         except Exception:
             return jsonify({'error': 'Invalid logo data'}), 400
-    png = generate_qr_png(url, size=size, fg=hex_to_rgb(fg_hex), bg=hex_to_rgb(bg_hex),
-                          style=style, logo_bytes=logo_bytes)
-    return Response(png, mimetype='image/png')
+    return qr_response(url, size, hex_to_rgb(fg_hex), hex_to_rgb(bg_hex), style,
+                       logo_bytes=logo_bytes, fmt=fmt)
+
+
+# ─────────────────────────────────────────────
+# Batch QR export
+# ─────────────────────────────────────────────
+
+SHEET_PAGE   = (1240, 1754)   # A4 at 150 dpi
+SHEET_MARGIN = 60
+SHEET_LABEL  = 28             # px reserved under each tile for the short URL
+
+_qr_pool      = None
+_qr_pool_pid  = None
+_qr_pool_lock = threading.Lock()
+_qr_pool_fork = 'fork' in multiprocessing.get_all_start_methods()
+
+def _qr_pool_child_init():
+    # Forked children inherit gunicorn's signal handlers, which only flag a
+    # graceful shutdown; restore the defaults so a pool's terminate() works.
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+        signal.signal(sig, signal.SIG_DFL)
+
+def start_qr_pool():
+    """Create this process's QR render pool and start its worker processes now.
+
+    With the fork start method this must run while the process has no other
+    threads — a child forked mid-request can inherit a lock some other thread
+    held — so gunicorn.conf.py calls it from post_fork, before the worker
+    starts its request, click writer and job threads.
+    """
+    global _qr_pool, _qr_pool_pid
+    if QR_BATCH_WORKERS <= 0:
+        return None
+    with _qr_pool_lock:
+        if _qr_pool is None or _qr_pool_pid != os.getpid():
+            ctx = multiprocessing.get_context('fork' if _qr_pool_fork else None)
+            _qr_pool     = ProcessPoolExecutor(max_workers=QR_BATCH_WORKERS, mp_context=ctx,
+                                               initializer=_qr_pool_child_init)
+            _qr_pool_pid = os.getpid()
+            _qr_pool.submit(int).result()   # forked pools start every worker on the first submit
+        return _qr_pool
+
+def get_qr_pool():
+    """Process pool for QR rendering (batches, and single renders with QR_RENDER_OFFLOAD), or None.
+
+    A missing pool (first use outside gunicorn, or replacing one whose worker
+    died) is only forked while this process is single-threaded; otherwise
+    callers render in the web worker until gunicorn replaces it.
+    """
+    pool = _qr_pool if _qr_pool_pid == os.getpid() else None
+    if pool is None and QR_BATCH_WORKERS > 0 and (not _qr_pool_fork or threading.active_count() == 1):
+        pool = start_qr_pool()
+    return pool
+
+def discard_qr_pool(pool, exc=None):
+    """Drop a pool that raised BrokenProcessPool (a worker was killed, e.g. by the OOM killer)."""
+    global _qr_pool
+    with _qr_pool_lock:
+        if _qr_pool is not pool:
+            return
+        _qr_pool = None
+    metrics.inc('qr_pool_broken_total')
+    app.logger.warning('QR render pool broke (%s); %s', exc or 'worker died',
+                       'replacing it' if not _qr_pool_fork or threading.active_count() == 1
+                       else 'rendering in this worker until it is replaced')
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def qr_pool_submit(fn, *args, **kwargs):
+    """Start fn(*args, **kwargs) on the QR pool: (pool, future), or (None, None) when it has to run here."""
+    for _ in range(2):
+        pool = get_qr_pool()
+        if pool is None:
+            break
+        try:
+            return pool, pool.submit(fn, *args, **kwargs)
+        except BrokenProcessPool as exc:
+            discard_qr_pool(pool, exc)
+    return None, None
+
+def qr_pool_render(fn, *args, **kwargs):
+    """fn(*args, **kwargs) on the QR pool, retried once on a fresh pool if it broke, else in this process."""
+    for _ in range(2):
+        pool, future = qr_pool_submit(fn, *args, **kwargs)
+        if future is None:
+            break
+        try:
+            return future.result()
+        except BrokenProcessPool as exc:
+            discard_qr_pool(pool, exc)
+    return fn(*args, **kwargs)
+
+@atexit.register
+def _shutdown_qr_pool():
+    if _qr_pool is not None and _qr_pool_pid == os.getpid():
+        _qr_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_qr_batch(items, size, fg, bg, style):
+    """Yield (code, png) for each (code, data) in order, rendering misses on the pool.
+
+    Cached renderings are reused and fresh ones stored back into qr_cache.
+    At most 2 × QR_BATCH_WORKERS renders are in flight, so memory stays
+    bounded however many codes are requested. If the pool breaks mid-batch,
+    the renders it lost are redone here and the rest go to its replacement.
+    """
+    limit   = max(1, QR_BATCH_WORKERS * 2)
+    pending = deque()
+
+    def finish(code, data, key, result, pool):
+        if isinstance(result, bytes):
+            return code, result
+        try:
+            png = result.result()
+        except BrokenProcessPool as exc:
+            discard_qr_pool(pool, exc)
+            png = generate_qr_png(data, size, fg, bg, style)
+        qr_cache.store(key, data, png, persist=True)
+        return code, png
+
+    for code, data in items:
+        key  = qr_cache.key(data, size, fg, bg, style, 'png')
+        png  = qr_cache.lookup(key, data, persist=True)
+        pool = None
+        if png is None:
+            pool, png = qr_pool_submit(generate_qr_png, data, size, fg, bg, style)
+            if png is None:
+                png = generate_qr_png(data, size=size, fg=fg, bg=bg, style=style)
+                qr_cache.store(key, data, png, persist=True)
+        pending.append((code, data, key, png, pool))
+        while len(pending) > limit or (pending and isinstance(pending[0][3], bytes)):
+            yield finish(*pending.popleft())
+    while pending:
+        yield finish(*pending.popleft())
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Unseekable sink that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def iter_zip(entries):
+    """Stream a ZIP of (name, bytes) entries; PNGs are stored, not recompressed."""
+    sink = _ChunkWriter()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for name, payload in entries:
+            zf.writestr(name, payload)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_sheets(tiles, columns):
+    """Lay (label, png) tiles out on A4 contact sheets, yielding one PIL page at a time."""
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.load_default(size=16)
+    except TypeError:   # Pillow < 10.1 only has the fixed bitmap font
+        font = ImageFont.load_default()
+    page_w, page_h = SHEET_PAGE
+    cell  = (page_w - 2 * SHEET_MARGIN) // columns
+    rows  = max(1, (page_h - 2 * SHEET_MARGIN) // (cell + SHEET_LABEL))
+    page  = None
+    index = 0
+    for label, png in tiles:
+        slot = index % (columns * rows)
+        if slot == 0:
+            if page is not None:
+                yield page
+            page = Image.new('RGB', SHEET_PAGE, (255, 255, 255))
+            draw = ImageDraw.Draw(page)
+        x = SHEET_MARGIN + (slot % columns) * cell
+        y = SHEET_MARGIN + (slot // columns) * (cell + SHEET_LABEL)
+        tile = Image.open(io.BytesIO(png))
+        page.paste(tile, (x + (cell - tile.width) // 2, y))
+        draw.text((x + cell // 2, y + cell + 4), label, fill=(0, 0, 0), font=font, anchor='mt')
+        index += 1
+    if page is not None:
+        yield page
+
+
+def iter_pdf(pages):
+    """Stream a PDF with one full-page image per PIL page, holding one page at a time."""
+    offsets = {}
+    written = 0
+    kids    = []
+
+    def emit(num, body):
+        nonlocal written
+        offsets[num] = written
+        chunk = f'{num} 0 obj\n'.encode() + body + b'\nendobj\n'
+        written += len(chunk)
+        return chunk
+
+    head = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    written = len(head)
+    yield head + emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    pt_w, pt_h = 595, 842   # A4 in points
+    num = 3
+    for page in pages:
+        img_num, content_num, page_num = num, num + 1, num + 2
+        num += 3
+        raw = zlib.compress(page.convert('RGB').tobytes(), 6)
+        img = (f'<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} '
+               f'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode '
+               f'/Length {len(raw)} >>\nstream\n').encode() + raw + b'\nendstream'
+        draw = f'q {pt_w} 0 0 {pt_h} 0 0 cm /Im0 Do Q'.encode()
+        content = f'<< /Length {len(draw)} >>\nstream\n'.encode() + draw + b'\nendstream'
+        page_obj = (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pt_w} {pt_h}] '
+                    f'/Resources << /XObject << /Im0 {img_num} 0 R >> >> '
+                    f'/Contents {content_num} 0 R >>').encode()
+        kids.append(page_num)
+        yield emit(img_num, img) + emit(content_num, content) + emit(page_num, page_obj)
+
+    kids_ref = ' '.join(f'{k} 0 R' for k in kids)
+    tail = emit(2, f'<< /Type /Pages /Kids [{kids_ref}] /Count {len(kids)} >>'.encode())
+    xref_at = written
+    xref = [f'xref\n0 {num}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[i]:010d} 00000 n \n' for i in range(1, num)]
+    yield tail + ''.join(xref).encode() + (
+        f'trailer\n<< /Size {num} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n').encode()
+
+
+def iter_sheet_pngs(pages):
+    for i, page in enumerate(pages, start=1):
+        buf = io.BytesIO()
+        page.save(buf, 'PNG')
+        yield f'sheet-{i:03d}.png', buf.getvalue()
+
+
+def qr_batch_output(data, user_id, is_admin, progress=None):
+    """Validate a batch request and build its output lazily.
+
+    Returns (None, (body iterator, mimetype, filename)) or ((error, status), None).
+    Nothing is rendered until the body is iterated; `progress(done, total)`
+    is called as each QR code comes back.
+    """
+    codes   = data.get('codes') or []
+    tag     = (data.get('tag') or '').strip().lower()
+    fmt     = (data.get('format') or 'zip').lower()
+    style   = data.get('style', 'square')
+    fg      = hex_to_rgb((data.get('fg') or '000000').lstrip('#'))
+    bg      = hex_to_rgb((data.get('bg') or 'ffffff').lstrip('#'))
+    size    = min(int(data.get('size', 300)), 1000)
+    columns = max(1, min(int(data.get('columns', 4)), 10))
+    if fmt not in ('zip', 'pdf', 'sheet'):
+        return ('format must be zip, pdf or sheet', 400), None
+    if not codes and not tag:
+        return ('Provide codes or a tag', 400), None
+
+    where, params = ['l.is_active=1'], []
+    if not is_admin:
+        where.append('l.user_id=?'); params.append(user_id)
+    if codes:
+        codes = list(dict.fromkeys(codes))[:QR_BATCH_MAX]
+        where.append(f"l.code IN ({','.join('?' * len(codes))})"); params += codes
+    if tag:
+        where.append('l.id IN (SELECT lt.link_id FROM link_tags lt '
+                     'JOIN tags t ON lt.tag_id=t.id WHERE t.name=?)')
+        params.append(tag)
+    with get_db() as conn:
+        rows = conn.execute(
+            f"SELECT l.code FROM links l WHERE {' AND '.join(where)} ORDER BY l.created_at DESC LIMIT ?",
+            params + [QR_BATCH_MAX]
+        ).fetchall()
+    found = {r['code'] for r in rows}
+    order = [c for c in codes if c in found] if codes else [r['code'] for r in rows]
+    if not order:
+        return ('No matching links', 404), None
+
+    if fmt != 'zip':
+        # Tiles are rendered at the sheet's cell size so nothing is resampled
+        size = (SHEET_PAGE[0] - 2 * SHEET_MARGIN) // columns
+    items = [(code, f"{BASE_URL}/{code}") for code in order]
+    rendered = render_qr_batch(items, size, fg, bg, style)
+    if progress:
+        rendered = _reporting(rendered, len(items), progress)
+
+    if fmt == 'zip':
+        body, mimetype, ext = iter_zip((f'{code}.png', png) for code, png in rendered), 'application/zip', 'zip'
+    else:
+        pages = iter_sheets(((f"{BASE_URL}/{code}", png) for code, png in rendered), columns)
+        if fmt == 'pdf':
+            body, mimetype, ext = iter_pdf(pages), 'application/pdf', 'pdf'
+        else:
+            body, mimetype, ext = iter_zip(iter_sheet_pngs(pages)), 'application/zip', 'zip'
+    return None, (body, mimetype, f'{_slug()}-qr-{fmt}.{ext}')
+
+
+def _reporting(items, total, progress):
+    for done, item in enumerate(items, start=1):
+        yield item
+        progress(done, total)
+
+
+@app.route('/api/qr/batch', methods=['POST'])
+@login_required
+def qr_batch():
+    """Render QR codes for many links as a ZIP of PNGs, a PDF contact sheet or a ZIP of sheet PNGs."""
+    error, output = qr_batch_output(request.get_json(silent=True) or {},
+                                    session.get('user_id'), session.get('is_admin'))
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    body, mimetype, filename = output
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
 
 
 # ─────────────────────────────────────────────
@@ -930,6 +4199,10 @@ def bulk_links():
                     f'UPDATE links SET is_active=0 WHERE code IN ({placeholders}) AND user_id=?',
                     list(codes) + [user_id]
                 )
+            link_cache.invalidate(conn, codes)
+            stats_cache.invalidate(conn)
+            for code in codes:
+                qr_cache.invalidate(f"{BASE_URL}/{code}")
             return jsonify({'deleted': len(codes)})
 
         elif action == 'tag':
@@ -953,6 +4226,7 @@ def bulk_links():
                     f'UPDATE links SET expires_at=? WHERE code IN ({placeholders}) AND user_id=?',
                     [expires_at] + list(codes) + [user_id]
                 )
+            link_cache.invalidate(conn, codes)
             return jsonify({'updated': len(codes)})
 
 
@@ -963,34 +4237,23 @@ def bulk_links():
 @app.route('/api/links/export')
 @login_required
 def export_links():
-    is_admin = session.get('is_admin', False)
-    user_id  = session.get('user_id')
-    with get_db() as conn:
-        if is_admin:
-            rows = conn.execute(
-                'SELECT l.*, GROUP_CONCAT(t.name) as tag_names '
-                'FROM links l '
-                'LEFT JOIN link_tags lt ON l.id=lt.link_id '
-                'LEFT JOIN tags t ON lt.tag_id=t.id '
-                'WHERE l.is_active=1 '
-                'GROUP BY l.id ORDER BY l.created_at DESC'
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                'SELECT l.*, GROUP_CONCAT(t.name) as tag_names '
-                'FROM links l '
-                'LEFT JOIN link_tags lt ON l.id=lt.link_id '
-                'LEFT JOIN tags t ON lt.tag_id=t.id '
-                'WHERE l.is_active=1 AND l.user_id=? '
-                'GROUP BY l.id ORDER BY l.created_at DESC',
-                (user_id,)
-            ).fetchall()
+    return csv_response(links_csv(session.get('user_id'), session.get('is_admin', False)),
+                        f'{_slug()}-export.csv')
 
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(['code', 'short_url', 'long_url', 'title', 'tags', 'created_at', 'expires_at', 'clicks'])
-    for row in rows:
-        writer.writerow([
+
+def _slug():
+    return re.sub(r'[^a-z0-9]+', '-', APP_NAME.lower()).strip('-')
+
+
+def links_csv(user_id, is_admin, progress=None):
+    """CSV chunks of every active link visible to the given user, newest first."""
+    where, params = 'l.is_active=1', []
+    if not is_admin:
+        where += ' AND l.user_id=?'
+        params.append(user_id)
+
+    def to_row(row):
+        return [
             row['code'],
             f"{BASE_URL}/{row['code']}",
             row['long_url'],
@@ -999,61 +4262,647 @@ def export_links():
             row['created_at'],
             row['expires_at'] or '',
             row['clicks'],
-        ])
-    return Response(
-        buf.getvalue().encode('utf-8'),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename="{re.sub(r"[^a-z0-9]+", "-", APP_NAME.lower()).strip("-")}-export.csv"'}
-    )
+        ]
+
+    return iter_csv(['code', 'short_url', 'long_url', 'title', 'tags', 'created_at', 'expires_at', 'clicks'],
+                    'SELECT l.code, l.long_url, l.title, l.created_at, l.expires_at, l.clicks, '
+                    '(SELECT GROUP_CONCAT(t.name) FROM link_tags lt JOIN tags t ON lt.tag_id=t.id '
+                    ' WHERE lt.link_id=l.id) AS tag_names '
+                    f'FROM links l WHERE {where} ORDER BY l.created_at DESC', params, to_row, progress)
+
+
+IMPORT_LOOKUP_CHUNK = 500
+
+def _existing(conn, sql, values):
+    """Run `sql` (with one IN (%s) slot) over `values` in chunks and return all rows."""
+    values, rows = list(values), []
+    for i in range(0, len(values), IMPORT_LOOKUP_CHUNK):
+        part = values[i:i + IMPORT_LOOKUP_CHUNK]
+        rows += conn.execute(sql % ','.join('?' * len(part)), part).fetchall()
+    return rows
+
+
+def import_links_csv(records, user_id, first_row=2, before_commit=None):
+    """Validate CSV records (csv.DictReader rows), then insert every good one in one short transaction.
+
+    Code collisions are resolved against a bulk lookup, links and link_tags
+    go in with executemany, and each distinct tag is upserted once.
+    `first_row` is the file line number of the first record, for error
+    messages; `before_commit(conn, result)` runs inside the transaction.
+    """
+    started = time.perf_counter()
+    errors  = []
+    rows    = []   # (row number, url, custom code, title, expires_at, tag names)
+    for i, row in enumerate(records, start=first_row):
+        url = (row.get('url') or row.get('long_url') or '').strip()
+        if not url:
+            errors.append((i, 'missing URL')); continue
+        if not validate_url(url):
+            errors.append((i, f'invalid URL "{url[:50]}"')); continue
+
+        custom_code = (row.get('custom_code') or row.get('code') or '').strip()
+        title       = (row.get('title') or '').strip()
+        expires_at  = (row.get('expires_at') or '').strip() or None
+        tags_str    = (row.get('tags') or '').strip()
+        tag_names   = {t.strip().lower() for t in tags_str.split(',') if t.strip()} if tags_str else set()
+
+        if custom_code and not re.match(r'^[a-zA-Z0-9]{1,20}$', custom_code):
+            errors.append((i, f'invalid code "{custom_code}"')); continue
+        rows.append((i, url, custom_code, title or None, expires_at, tag_names))
+    read = len(rows) + len(errors)
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    # Allocate before taking the write lock: reserving a new block of codes
+    # needs a write of its own. Generated codes are unique among themselves;
+    # the rare one that lands on a custom or legacy code is replaced by
+    # rolling back and trying again, so no spares are taken up front.
+    fresh = code_allocator.take(sum(1 for r in rows if not r[2]))
+    for attempt in itertools.count():
+        row_errors = list(errors)
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            taken = {r['code'] for r in _existing(
+                conn, 'SELECT code FROM links WHERE code IN (%s)', {r[2] for r in rows if r[2]})}
+            accepted = []
+            for i, url, custom_code, title, expires_at, tag_names in rows:
+                if custom_code:
+                    if custom_code in taken:
+                        row_errors.append((i, f'code "{custom_code}" already taken')); continue
+                    taken.add(custom_code)
+                accepted.append([custom_code, url, title, now, expires_at, user_id, tag_names, i])
+
+            generated = [r for r in accepted if not r[0]]
+            for r, code in zip(generated, fresh):
+                r[0] = code
+            clash   = {c['code'] for c in _existing(
+                conn, 'SELECT code FROM links WHERE code IN (%s)', [r[0] for r in generated])} | taken
+            clashes = [n for n, r in enumerate(generated) if r[0] in clash]
+            if not clashes:
+                conn.executemany(
+                    'INSERT INTO links (code, long_url, title, created_at, expires_at, user_id) VALUES (?,?,?,?,?,?)',
+                    [r[:6] for r in accepted]
+                )
+                codes = [r[0] for r in accepted]
+                ids   = {r['code']: r['id'] for r in _existing(conn, 'SELECT id, code FROM links WHERE code IN (%s)', codes)}
+
+                names = set().union(*(r[6] for r in accepted)) if accepted else set()
+                if names:
+                    conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(n,) for n in names])
+                    tag_ids = {t['name']: t['id'] for t in _existing(conn, 'SELECT id, name FROM tags WHERE name IN (%s)', names)}
+                    conn.executemany('INSERT OR IGNORE INTO link_tags (link_id, tag_id) VALUES (?,?)',
+                                     [(ids[r[0]], tag_ids[n]) for r in accepted for n in r[6]])
+                if codes:
+                    link_cache.invalidate(conn, codes)
+                    stats_cache.invalidate(conn)
+
+                elapsed = time.perf_counter() - started
+                result  = {
+                    'created':      len(codes),
+                    'errors':       [f'Row {i}: {msg}' for i, msg in sorted(row_errors)],
+                    'rows':         read,
+                    'seconds':      round(elapsed, 3),
+                    'rows_per_sec': round(read / elapsed) if elapsed else None,
+                }
+                if before_commit:
+                    before_commit(conn, result)
+                return result
+            conn.rollback()
+        code_allocator.collisions += len(clashes)
+        if attempt >= 8:
+            raise RuntimeError('Too many short code collisions; check CODE_LENGTH')
+        for n, code in zip(clashes, code_allocator.take(len(clashes))):
+            fresh[n] = code
 
 
 @app.route('/api/links/import', methods=['POST'])
 @login_required
 def import_links():
-    data     = request.get_json(silent=True) or {}
-    csv_text = (data.get('csv') or '').strip()
-    if not csv_text:
-        return jsonify({'error': 'No CSV data provided'}), 400
+    """Import links from CSV: a multipart `file` upload, a text/csv body, or JSON {"csv": "..."}."""
+    upload = request.files.get('file')
+    if upload:
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    elif request.mimetype == 'text/csv':
+        # Decode line by line: under gunicorn the raw input stream isn't an io object
+        lines = codecs.iterdecode(request.stream, 'utf-8-sig')
+    else:
+        data     = request.get_json(silent=True) or {}
+        csv_text = (data.get('csv') or '').strip()
+        if not csv_text:
+            return jsonify({'error': 'No CSV data provided'}), 400
+        lines = io.StringIO(csv_text)
+    try:
+        result = import_links_csv(csv.DictReader(lines), session.get('user_id'))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV must be UTF-8'}), 400
+    return jsonify(result)
 
-    reader  = csv.DictReader(io.StringIO(csv_text))
-    created = 0
-    errors  = []
 
-    with get_db() as conn:
-        for i, row in enumerate(reader, start=2):
-            url = (row.get('url') or row.get('long_url') or '').strip()
-            if not url:
-                errors.append(f'Row {i}: missing URL'); continue
-            if not validate_url(url):
-                errors.append(f'Row {i}: invalid URL "{url[:50]}"'); continue
-
-            custom_code = (row.get('custom_code') or row.get('code') or '').strip()
-            title       = (row.get('title') or '').strip()
-            expires_at  = (row.get('expires_at') or '').strip() or None
-            tags_str    = (row.get('tags') or '').strip()
-            tag_names   = [t.strip() for t in tags_str.split(',') if t.strip()] if tags_str else []
-
-            if custom_code and not re.match(r'^[a-zA-Z0-9]{1,20}$', custom_code):
-                errors.append(f'Row {i}: invalid code "{custom_code}"'); continue
-
-            code = custom_code or generate_code(url)
-            if conn.execute('SELECT 1 FROM links WHERE code=?', (code,)).fetchone():
-                if custom_code:
-                    errors.append(f'Row {i}: code "{custom_code}" already taken'); continue
-                code = generate_code(url + str(time.time()))
+# ─────────────────────────────────────────────
+# Background jobs
+# ─────────────────────────────────────────────
+# Long operations (imports, exports, batch QR, rollup backfills) run as rows
+# in `jobs`, picked up by JobRunner threads instead of inside a request.
+# Handlers report progress through JobContext, which also persists a
+# checkpoint so a retried or crashed job resumes where it stopped.
 
+JOB_HANDLERS = {}
+
+def job_handler(kind, admin=False):
+    def register(fn):
+        JOB_HANDLERS[kind] = (fn, admin)
+        return fn
+    return register
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """What a handler sees: its params, last checkpoint and a way to report progress."""
+
+    def __init__(self, job):
+        self.id         = job['id']
+        self.user_id    = job['user_id']
+        self.params     = json.loads(job['params'] or '{}')
+        self.checkpoint = json.loads(job['checkpoint']) if job['checkpoint'] else None
+
+    def progress(self, done, total=None, checkpoint=None, conn=None):
+        """Record progress (and optionally a checkpoint); raises JobCancelled if cancelled.
+
+        Pass `conn` to store the checkpoint in the same transaction as the work it covers.
+        """
+        args = (done, total, json.dumps(checkpoint) if checkpoint is not None else None, time.time(), self.id)
+        sql  = ('UPDATE jobs SET progress=?, total=COALESCE(?, total), checkpoint=COALESCE(?, checkpoint), '
+                'heartbeat_at=? WHERE id=? RETURNING cancel_requested')
+        if conn is not None:
+            row = conn.execute(sql, args).fetchall()
+        else:
+            with get_db() as conn:
+                row = conn.execute(sql, args).fetchall()
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        if row and row[0]['cancel_requested']:
+            raise JobCancelled()
+
+    def output_path(self, name, mimetype):
+        """Path the handler should write its downloadable result to."""
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, f'job-{self.id}-{secrets.token_hex(4)}')
+        with get_db() as conn:
+            old = conn.execute('SELECT result_file FROM jobs WHERE id=?', (self.id,)).fetchone()
+            if old and old['result_file'] and os.path.exists(old['result_file']):
+                os.remove(old['result_file'])   # left over from an earlier attempt
+            conn.execute('UPDATE jobs SET result_file=?, result_name=?, result_type=? WHERE id=?',
+                         (path, name, mimetype, self.id))
+        return path
+
+    def write_output(self, chunks, name, mimetype):
+        path = self.output_path(name, mimetype)
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+
+class JobRunner:
+    """Per-process pool of threads that claim queued jobs from SQLite and run them.
+
+    Claiming is a single UPDATE … RETURNING, so any number of gunicorn
+    workers (or a separate `flask run-jobs` process) can share the table.
+    A heartbeat thread refreshes `heartbeat_at` of every job this process is
+    running (as does JobContext.progress()), so a handler may go quiet for
+    as long as it needs; a job whose heartbeat is older than JOB_STALE_AFTER
+    is assumed orphaned by a dead process and is requeued, or failed once it
+    has used up its attempts.
+    """
+
+    def __init__(self, workers, poll_interval):
+        self.workers       = workers
+        self.poll_interval = max(0.05, poll_interval)
+        self.completed     = 0
+        self.failed        = 0
+        self._wake         = threading.Event()
+        self._lock         = threading.Lock()
+        self._threads      = []
+        self._pid          = None
+        self._cleaned_at   = 0.0
+        self.heartbeat     = max(1.0, JOB_STALE_AFTER / 3)   # seconds between heartbeat refreshes
+        self._running      = set()   # ids of jobs running in this process
+        self._beat_thread  = None
+        self._beat_pid     = None
+
+    def ensure_started(self):
+        if self.workers <= 0 or (self._threads and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid     = os.getpid()
+            self._threads = [threading.Thread(target=self._loop, name=f'job-runner-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for t in self._threads:
+                t.start()
+
+    def submit(self, kind, user_id, params, max_attempts=JOB_MAX_ATTEMPTS, wake=True):
+        """Queue a job; `wake=False` leaves it for the runner's next poll (no threads started here)."""
+        with get_db() as conn:
+            job_id = conn.execute(
+                'INSERT INTO jobs (kind, user_id, params, max_attempts, created_at) VALUES (?,?,?,?,?)',
+                (kind, user_id, json.dumps(params), max_attempts,
+                 datetime.now(timezone.utc).replace(tzinfo=None).isoformat())
+            ).lastrowid
+        if wake:
+            self.wake()
+        return job_id
+
+    def wake(self):
+        self.ensure_started()
+        self._wake.set()
+
+    def _claim(self):
+        now = time.time()
+        with get_db() as conn:
+            conn.execute(
+                "UPDATE jobs SET status=CASE WHEN attempts<max_attempts THEN 'queued' ELSE 'failed' END, "
+                "error=COALESCE(error, 'worker stopped responding') "
+                "WHERE status='running' AND heartbeat_at<?", (now - JOB_STALE_AFTER,))
+            rows = conn.execute(
+                "UPDATE jobs SET status='running', attempts=attempts+1, heartbeat_at=?, "
+                "started_at=COALESCE(started_at, ?) "
+                "WHERE id=(SELECT id FROM jobs WHERE status='queued' ORDER BY id LIMIT 1) RETURNING *",
+                (now, datetime.now(timezone.utc).replace(tzinfo=None).isoformat())
+            ).fetchall()
+        return rows[0] if rows else None
+
+    def _ensure_heartbeat(self):
+        if self._beat_thread is not None and self._beat_pid == os.getpid():
+            return
+        with self._lock:
+            if self._beat_thread is not None and self._beat_pid == os.getpid():
+                return
+            self._beat_pid    = os.getpid()
+            self._running     = set()   # inherited across fork; those jobs run in the parent
+            self._beat_thread = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+            self._beat_thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                with self._lock:
+                    ids = list(self._running)
+                if ids:
+                    with get_db() as conn:
+                        conn.execute(f"UPDATE jobs SET heartbeat_at=? WHERE status='running' "
+                                     f"AND id IN ({','.join('?' * len(ids))})", [time.time(), *ids])
+            except Exception:
+                app.logger.exception('Job heartbeat error')
+
+    def run_one(self, job):
+        ctx = JobContext(job)
+        status, result, error = 'done', None, None
+        handler, _ = JOB_HANDLERS.get(job['kind'], (None, None))
+        if handler is None:   # retrying will not help
+            app.logger.error('Job %s has unknown kind %r', job['id'], job['kind'])
+            status, error = 'failed', f"unknown job kind '{job['kind']}'"
+            self.failed += 1
+        else:
+            self._ensure_heartbeat()
+            with self._lock:
+                self._running.add(job['id'])
+            try:
+                result = handler(ctx)
+                self.completed += 1
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                app.logger.exception('Job %s (%s) failed', job['id'], job['kind'])
+                error  = f'{type(e).__name__}: {e}'
+                status = 'queued' if job['attempts'] < job['max_attempts'] else 'failed'
+                if status == 'failed':
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self._running.discard(job['id'])
+        with get_db() as conn:
             conn.execute(
-                'INSERT INTO links (code, long_url, title, created_at, expires_at, user_id) VALUES (?,?,?,?,?,?)',
-                (code, url, title or None,
-                 datetime.now(timezone.utc).replace(tzinfo=None).isoformat(), expires_at,
-                 session.get('user_id'))
+                'UPDATE jobs SET status=?, result=?, error=?, finished_at=?, heartbeat_at=? WHERE id=?',
+                (status, json.dumps(result) if result is not None else None, error,
+                 None if status == 'queued' else datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+                 time.time(), job['id'])
             )
-            link_id = conn.execute('SELECT id FROM links WHERE code=?', (code,)).fetchone()['id']
-            if tag_names:
-                set_link_tags(conn, link_id, tag_names)
-            created += 1
 
-    return jsonify({'created': created, 'errors': errors})
+    def run_pending(self):
+        """Run queued jobs on the calling thread until none are left (used by `flask run-jobs --once`)."""
+        n = 0
+        while (job := self._claim()) is not None:
+            self.run_one(job)
+            n += 1
+        return n
+
+    def _loop(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is not None:
+                    self.run_one(job)
+                    continue
+                if time.monotonic() - self._cleaned_at > 3600:
+                    self._cleaned_at = time.monotonic()
+                    self.cleanup()
+            except Exception:
+                app.logger.exception('Job runner error')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def cleanup(self):
+        """Delete finished jobs (and their result files) older than JOB_RESULT_TTL."""
+        cutoff = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=JOB_RESULT_TTL)).isoformat()
+        with get_db() as conn:
+            rows = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done','failed','cancelled') AND finished_at<? "
+                "RETURNING result_file, params", (cutoff,)
+            ).fetchall()
+        for r in rows:
+            for path in (r['result_file'], json.loads(r['params'] or '{}').get('upload')):
+                if path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return len(rows)
+
+    def stats(self):
+        with get_db() as conn:
+            counts = {r['status']: r['n'] for r in conn.execute(
+                'SELECT status, COUNT(*) AS n FROM jobs GROUP BY status')}
+        return {
+            'workers':   self.workers if self._pid == os.getpid() else 0,
+            'completed': self.completed,
+            'failed':    self.failed,
+            'by_status': counts,
+        }
+
+
+job_runner = JobRunner(JOB_WORKERS, JOB_POLL_INTERVAL)
+
+
+@app.before_request
+def _start_job_runner():
+    job_runner.ensure_started()
+
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run what is queued now, then exit.')
+def run_jobs_command(once):
+    """Run background jobs in this process (pair with JOB_WORKERS=0 on the web workers)."""
+    if once:
+        print(f'Ran {job_runner.run_pending()} jobs')
+        return
+    job_runner.workers = max(1, job_runner.workers)
+    job_runner.ensure_started()
+    while True:
+        time.sleep(3600)
+
+
+# ── Job handlers ───────────────────────────────
+
+def _job_user(ctx):
+    with get_db() as conn:
+        user = conn.execute('SELECT id, is_admin FROM users WHERE id=?', (ctx.user_id,)).fetchone()
+    if not user:
+        raise RuntimeError('job owner no longer exists')
+    return user['id'], bool(user['is_admin'])
+
+
+@job_handler('import')
+def _job_import(ctx):
+    """Import an uploaded CSV JOB_IMPORT_CHUNK rows per transaction, checkpointing after each."""
+    state = ctx.checkpoint or {'rows': 0, 'created': 0, 'errors': []}
+    with open(ctx.params['upload'], encoding='utf-8-sig', newline='') as f:
+        total = sum(1 for _ in csv.DictReader(f))
+        f.seek(0)
+        records = itertools.islice(csv.DictReader(f), state['rows'], None)
+        while True:
+            chunk = list(itertools.islice(records, JOB_IMPORT_CHUNK))
+            if not chunk:
+                break
+
+            def save(conn, result, start=state['rows'], n=len(chunk)):
+                state['rows']    = start + n
+                state['created'] += result['created']
+                state['errors']  = (state['errors'] + result['errors'])[:1000]
+                ctx.progress(state['rows'], total, state, conn=conn)
+
+            import_links_csv(chunk, ctx.user_id, first_row=state['rows'] + 2, before_commit=save)
+    return {'created': state['created'], 'errors': state['errors'], 'rows': state['rows']}
+
+
+@job_handler('export_links')
+def _job_export_links(ctx):
+    user_id, is_admin = _job_user(ctx)
+    size = ctx.write_output(links_csv(user_id, is_admin, progress=ctx.progress),
+                            f'{_slug()}-export.csv', 'text/csv')
+    return {'bytes': size}
+
+
+@job_handler('export_clicks')
+def _job_export_clicks(ctx):
+    user_id, is_admin = _job_user(ctx)
+    with get_db() as conn:
+        link = conn.execute('SELECT * FROM links WHERE code=?', (ctx.params.get('code'),)).fetchone()
+    if not link or not (is_admin or link['user_id'] == user_id):
+        raise LookupError('link not found')
+    start, end = _parse_day(ctx.params.get('from')), _parse_day(ctx.params.get('to'))
+    size = ctx.write_output(clicks_csv(link, start, end, progress=ctx.progress),
+                            f"clicks-{link['code']}.csv", 'text/csv')
+    return {'bytes': size}
+
+
+@job_handler('qr_batch')
+def _job_qr_batch(ctx):
+    user_id, is_admin = _job_user(ctx)
+    error, output = qr_batch_output(ctx.params, user_id, is_admin, progress=ctx.progress)
+    if error:
+        raise ValueError(error[0])
+    body, mimetype, filename = output
+    return {'bytes': ctx.write_output(body, filename, mimetype)}
+
+
+@job_handler('backfill_rollups', admin=True)
+def _job_backfill_rollups(ctx):
+    after = (ctx.checkpoint or {}).get('after', 0)
+    n = backfill_rollups(after=after, progress=lambda done, total, last: ctx.progress(done, total, {'after': last}))
+    return {'links': n}
+
+
+@job_handler('encode_clicks', admin=True)
+def _job_encode_clicks(ctx):
+    after = (ctx.checkpoint or {}).get('after', 0)
+    n = encode_clicks(after=after, progress=lambda last, max_id: ctx.progress(last, max_id, {'after': last}))
+    return {'clicks': n}
+
+
+def ensure_migration_job(kind, done_key):
+    """Queue a one-time `kind` job for a database whose app_meta lacks `done_key`.
+
+    Runs at import, so it only reads app_meta and peeks at one click; the
+    work itself happens on a job runner once a worker is serving. A database
+    without clicks has nothing to migrate and is marked done here.
+    """
+    with get_db() as conn:
+        if conn.execute('SELECT 1 FROM app_meta WHERE key=?', (done_key,)).fetchone():
+            return
+        if not conn.execute('SELECT 1 FROM clicks LIMIT 1').fetchone():
+            conn.execute('INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, 1)', (done_key,))
+            return
+        queued = conn.execute("SELECT 1 FROM jobs WHERE kind=? AND status IN ('queued','running')",
+                              (kind,)).fetchone()
+    if not queued:
+        job_runner.submit(kind, None, {}, wake=False)
+
+ensure_migration_job('backfill_rollups', 'rollups_ready')   # analytics read raw clicks until it is done
+ensure_migration_job('encode_clicks', 'clicks_encoded')
+
+
+# ── Job routes ─────────────────────────────────
+
+def format_job(row):
+    return {
+        'id':          row['id'],
+        'kind':        row['kind'],
+        'status':      row['status'],
+        'progress':    row['progress'],
+        'total':       row['total'],
+        'attempts':    row['attempts'],
+        'error':       row['error'],
+        'result':      json.loads(row['result']) if row['result'] else None,
+        'result_url':  f"{BASE_URL}/api/jobs/{row['id']}/result" if row['status'] == 'done' and row['result_file'] else None,
+        'created_at':  row['created_at'],
+        'started_at':  row['started_at'],
+        'finished_at': row['finished_at'],
+    }
+
+
+def _get_job(conn, job_id):
+    job = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+    if not job or not (session.get('is_admin') or job['user_id'] == session.get('user_id')):
+        return None
+    return job
+
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def submit_job():
+    """Queue a job: multipart `file` → import, or JSON {"kind": ..., "params": {...}}."""
+    upload = request.files.get('file')
+    if upload:
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, f'upload-{secrets.token_hex(8)}.csv')
+        upload.save(path)
+        kind, params = 'import', {'upload': path}
+    else:
+        data   = request.get_json(silent=True) or {}
+        kind   = data.get('kind')
+        params = data.get('params') or {}
+        if kind not in JOB_HANDLERS or kind == 'import':
+            return jsonify({'error': f"kind must be one of: {', '.join(k for k in JOB_HANDLERS if k != 'import')}, "
+                                     "or upload a file to import"}), 400
+        if JOB_HANDLERS[kind][1] and not session.get('is_admin'):
+            return jsonify({'error': 'Admin access required'}), 403
+        if kind == 'qr_batch':
+            error, _ = qr_batch_output(params, session.get('user_id'), session.get('is_admin'))
+            if error:
+                return jsonify({'error': error[0]}), error[1]
+        if kind == 'export_clicks':
+            try:
+                _parse_day(params.get('from')); _parse_day(params.get('to'))
+            except ValueError:
+                return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+            with get_db() as conn:
+                link = conn.execute('SELECT * FROM links WHERE code=?', (params.get('code'),)).fetchone()
+            if not link or not _can_access_link(link):
+                return jsonify({'error': 'Not found'}), 404
+    job_id = job_runner.submit(kind, session.get('user_id'), params)
+    with get_db() as conn:
+        job = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+    return jsonify(format_job(job)), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    limit = min(int(request.args.get('limit', 50)), 200)
+    with get_db() as conn:
+        if session.get('is_admin'):
+            rows = conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM jobs WHERE user_id=? ORDER BY id DESC LIMIT ?',
+                                (session.get('user_id'), limit)).fetchall()
+    return jsonify({'jobs': [format_job(r) for r in rows]})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    with get_db() as conn:
+        job = _get_job(conn, job_id)
+    if not job:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(format_job(job))
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """Queued jobs stop immediately; running ones at their next progress report."""
+    with get_db() as conn:
+        job = _get_job(conn, job_id)
+        if not job:
+            return jsonify({'error': 'Not found'}), 404
+        if job['status'] not in ('queued', 'running'):
+            return jsonify({'error': f"Job is already {job['status']}"}), 409
+        conn.execute(
+            "UPDATE jobs SET cancel_requested=1, "
+            "status=CASE WHEN status='queued' THEN 'cancelled' ELSE status END, "
+            "finished_at=CASE WHEN status='queued' THEN ? ELSE finished_at END WHERE id=?",
+            (datetime.now(timezone.utc).replace(tzinfo=None).isoformat(), job_id)
+        )
+        job = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+    return jsonify(format_job(job))
+
+
+@app.route('/api/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_job(job_id):
+    """Requeue a failed or cancelled job; it resumes from its last checkpoint."""
+    with get_db() as conn:
+        job = _get_job(conn, job_id)
+        if not job:
+            return jsonify({'error': 'Not found'}), 404
+        if job['status'] not in ('failed', 'cancelled'):
+            return jsonify({'error': f"Job is {job['status']}"}), 409
+        conn.execute("UPDATE jobs SET status='queued', attempts=0, cancel_requested=0, error=NULL, "
+                     "finished_at=NULL WHERE id=?", (job_id,))
+        job = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+    job_runner.wake()
+    return jsonify(format_job(job))
+
+
+@app.route('/api/jobs/<int:job_id>/result', methods=['GET'])
+@login_required
+def job_result(job_id):
+    with get_db() as conn:
+        job = _get_job(conn, job_id)
+    if not job:
+        return jsonify({'error': 'Not found'}), 404
+    if job['status'] != 'done' or not job['result_file'] or not os.path.exists(job['result_file']):
+        return jsonify({'error': 'No result available'}), 404
+    return send_file(job['result_file'], mimetype=job['result_type'],
+                     as_attachment=True, download_name=job['result_name'])
 
 
 # ─────────────────────────────────────────────
@@ -1182,38 +5031,176 @@ def admin_mark_message_read(msg_id):
 def redirect_link(code):
     if code in ('static', 'api', 'favicon.ico'):
         return 'Not found', 404
-    with get_db() as conn:
-        link = conn.execute('SELECT * FROM links WHERE code=? AND is_active=1', (code,)).fetchone()
-        if not link:
-            return redirect('/?error=not_found')
-        if link['expires_at'] and link['expires_at'] < datetime.now(timezone.utc).replace(tzinfo=None).isoformat():
-            return redirect('/?error=expired')
-        country    = get_country_for_request()
-        client_ip  = get_client_ip()
-        conn.execute(
-            'INSERT INTO clicks (link_id,clicked_at,referrer,user_agent,ip_address,country) VALUES (?,?,?,?,?,?)',
-            (link['id'], datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
-             request.referrer, request.headers.get('User-Agent','')[:500],
-             client_ip[:45], country)
-        )
-        conn.execute('UPDATE links SET clicks=clicks+1 WHERE id=?', (link['id'],))
-        return redirect(link['long_url'], code=301)
+    link = link_cache.get(code)
+    if not link or not link['is_active']:
+        metrics.inc('redirects_total', result='not_found')
+        return redirect('/?error=not_found')
+    now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    if link['expires_at'] and link['expires_at'] < now:
+        metrics.inc('redirects_total', result='expired')
+        return redirect('/?error=expired')
+    metrics.inc('redirects_total', result='ok')
+    # Country resolution and the INSERT/UPDATE happen on the click writer thread
+    click_writer.enqueue((
+        link['id'], now, request.referrer, request.headers.get('User-Agent', '')[:500],
+        get_client_ip()[:45], request.headers.get('CF-IPCountry', ''),
+    ))
+    return redirect(link['long_url'], code=301)
 
 
 # ─────────────────────────────────────────────
 # Frontend routes
 # ─────────────────────────────────────────────
 
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+_STATIC_REF_RE     = re.compile(r"""(?<=["'(])/static/([\w./-]+)""")
+
+
+def _brotli_compress(body):
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(body, quality=11)
+
+
+class Asset:
+    """One file's bytes with its precompressed variants, each with its own strong ETag."""
+
+    def __init__(self, body, mimetype, mtimes):
+        digest        = hashlib.sha256(body).hexdigest()[:20]
+        self.mimetype = mimetype
+        self.mtimes   = mtimes        # path → mtime for the file and anything baked into it
+        self.version  = digest[:10]   # the ?v= fingerprint
+        self.variants = {'identity': (body, digest)}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            z = zlib.compressobj(9, zlib.DEFLATED, 31)   # gzip container, as _gzip_chunks
+            for encoding, packed in (('br', _brotli_compress(body)), ('gzip', z.compress(body) + z.flush())):
+                if packed is not None and len(packed) < len(body) * 0.9:
+                    self.variants[encoding] = (packed, f'{digest}-{encoding}')
+
+    def negotiate(self):
+        """Pick the smallest variant the client accepts."""
+        accept = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept.quality(encoding) > 0:
+                return encoding
+        return 'identity'
+
+
+class AssetStore:
+    """A fixed set of files under `root`, kept in memory.
+
+    Only files passed to load() are held — at startup, the HTML shells and
+    the static files they reference — so requests for anything else cannot
+    grow the store; get() returns None for them. `transform(name, body)` may
+    rewrite a file as it is loaded and return the extra paths it depended
+    on. With `reload`, a file (or one of those dependencies) whose mtime
+    changed is loaded again on its next request.
+    """
+
+    def __init__(self, root, reload=False, transform=None, max_bytes=None):
+        self.root      = root
+        self.reload    = reload
+        self.transform = transform
+        self.max_bytes = max_bytes
+        self._assets   = {}
+        self._lock     = threading.Lock()
+
+    def get(self, name):
+        asset = self._assets.get(name)
+        if asset is not None and self.reload and self._changed(asset):
+            return self.load(name)
+        return asset
+
+    def load(self, name):
+        """Read `name` into the store; None if it is missing or larger than `max_bytes`."""
+        path = safe_join(self.root, name)
+        if path is None or not os.path.isfile(path) or (
+                self.max_bytes is not None and os.path.getsize(path) > self.max_bytes):
+            self._assets.pop(name, None)
+            return None
+        with self._lock:
+            mtimes = {path: os.stat(path).st_mtime_ns}
+            with open(path, 'rb') as f:
+                body = f.read()
+            if self.transform:
+                body, deps = self.transform(name, body)
+                mtimes.update({dep: os.stat(dep).st_mtime_ns for dep in deps})
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            asset = self._assets[name] = Asset(body, mimetype, mtimes)
+        return asset
+
+    @staticmethod
+    def _changed(asset):
+        try:
+            return any(os.stat(path).st_mtime_ns != mtime for path, mtime in asset.mtimes.items())
+        except OSError:
+            return True
+
+    def __len__(self):
+        return len(self._assets)
+
+
+APP_DIR       = os.path.dirname(os.path.abspath(__file__))
+static_assets = AssetStore(os.path.join(APP_DIR, 'static'), ASSET_RELOAD, max_bytes=ASSET_MAX_BYTES)
+
+
+def fingerprint_static(name, body):
+    """Append ?v=<content hash> to /static/… references so they can be cached for good."""
+    deps = []
+
+    def versioned(m):
+        asset = static_assets.get(m.group(1)) or static_assets.load(m.group(1))
+        if asset is None:   # missing, or too large to hold: left to static_file() to send from disk
+            return m.group(0)
+        deps.append(safe_join(static_assets.root, m.group(1)))
+        return f'{m.group(0)}?v={asset.version}'
+    return _STATIC_REF_RE.sub(versioned, body.decode('utf-8')).encode('utf-8'), deps
+
+
+html_shells = AssetStore(APP_DIR, ASSET_RELOAD, transform=fingerprint_static)
+for _shell in ('landing.html', 'index.html'):   # load and compress before gunicorn forks
+    html_shells.load(_shell)
+
+
+def asset_response(asset, cache_control):
+    """Serve `asset` in the best encoding the client accepts, answering If-None-Match with 304."""
+    encoding   = asset.negotiate()
+    body, etag = asset.variants[encoding]
+    headers    = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if len(asset.variants) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
+
 @app.route('/')
 def landing():
-    with open(os.path.join(os.path.dirname(__file__), 'landing.html')) as f:
-        return f.read()
+    return asset_response(html_shells.get('landing.html'), 'no-cache')
 
 @app.route('/app', defaults={'subpath': ''})
 @app.route('/app/<path:subpath>')
 def app_frontend(subpath):
-    with open(os.path.join(os.path.dirname(__file__), 'index.html')) as f:
-        return f.read()
+    return asset_response(html_shells.get('index.html'), 'no-cache')
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    asset = static_assets.get(filename)
+    if asset is None:
+        path = safe_join(static_assets.root, filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({'error': 'Not found'}), 404
+        resp = send_from_directory(static_assets.root, filename)   # not referenced by a shell, or too large
+        resp.cache_control.no_cache = True
+        return resp
+    # Only the URL carrying the current fingerprint may be cached for good
+    if request.args.get('v') == asset.version:
+        return asset_response(asset, f'public, max-age={STATIC_MAX_AGE}, immutable')
+    return asset_response(asset, 'no-cache')
 
 
 if __name__ == '__main__':
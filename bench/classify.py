@@ -0,0 +1,200 @@
+"""
+Benchmark: click classification (device / browser / source), legacy vs Classifier.
+
+    python3 bench/classify.py
+    python3 bench/classify.py --clicks 1000000 --distinct 5000 --json out.json
+
+Builds a click stream from real-world user agent and referrer shapes with
+version numbers, devices and referrer paths varied, so the corpus holds
+--distinct user agents and referrers drawn with a Zipf skew, as real traffic
+is. Each variant labels every click on all three dimensions:
+
+legacy     the previous parse_* functions: lowercase and chained `in` checks
+table      Classifier rule tables without the memo
+memo       Classifier as the app calls it, with a CLASSIFY_CACHE_SIZE LRU
+regex      one lookahead-alternation regex per dimension, for comparison
+
+Exits non-zero if any variant disagrees with legacy on any click.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import load_app   # noqa: E402
+
+UA_TEMPLATES = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS {a}_{b} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/{a}.{b} Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android {a}; {device}) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/{v}.0.{c}.{d} Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/{a}.{b} Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 '
+    'Safari/537.36 Edg/{v}.0.{c}.{d}',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 '
+    'Safari/537.36 OPR/{b}{a}.0.0.0',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0',
+    'Mozilla/5.0 (Android {a}; Mobile; rv:{v}.0) Gecko/{v}.0 Firefox/{v}.0',
+    'Mozilla/5.0 (iPad; CPU OS {a}_{b} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/{a}.{b} Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android {a}; SM-X{c} Build/UP1A) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/{v}.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS {a}_{b} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Mobile/15E148 Instagram {v}.0.0.{c}.{d}',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)',
+    'curl/{a}.{b}.{d}',
+    'python-requests/2.{v}.{d}',
+)
+DEVICES  = ('Pixel 8', 'Pixel 7a', 'SM-S918B', 'SM-A546B', 'moto g(60)', 'Redmi Note 12', 'CPH2451', 'K')
+REF_HOSTS = ('https://www.google.com/', 'https://www.google.co.uk/', 'https://www.bing.com/search?q={w}',
+             'https://t.co/{id}', 'https://x.com/{w}/status/{n}', 'https://m.facebook.com/',
+             'https://l.facebook.com/l.php?u={id}', 'https://www.linkedin.com/feed/',
+             'https://www.reddit.com/r/{w}/comments/{id}/', 'https://www.youtube.com/watch?v={id}',
+             'https://l.instagram.com/?u={id}', 'https://news.ycombinator.com/item?id={n}',
+             'https://duckduckgo.com/', 'android-app://com.slack/', 'https://mail.google.com/mail/u/0/')
+WORDS = ('selfhosted', 'homelab', 'python', 'docs', 'launch', 'news', 'deals', 'blog')
+
+
+def corpus(rng, distinct):
+    """`distinct` user agents and as many referrers, each list ordered by popularity."""
+    uas, refs = {''}, {''}
+    while len(uas) < distinct:
+        uas.add(rng.choice(UA_TEMPLATES).format(
+            a=rng.randrange(10, 18), b=rng.randrange(8), c=rng.randrange(1000, 7000),
+            d=rng.randrange(200), v=rng.randrange(100, 128), device=rng.choice(DEVICES)))
+    while len(refs) < distinct:
+        refs.add(rng.choice(REF_HOSTS).format(
+            w=rng.choice(WORDS), id=f'{rng.getrandbits(40):x}', n=rng.randrange(10 ** 7)))
+    uas, refs = sorted(uas), sorted(refs)
+    rng.shuffle(uas)
+    rng.shuffle(refs)
+    return uas, refs
+
+
+def zipf(rng, values, k, s=1.1):
+    weights = list(itertools.accumulate(1 / (i + 1) ** s for i in range(len(values))))
+    return rng.choices(values, cum_weights=weights, k=k)
+
+
+def legacy_device(ua):
+    if not ua: return 'Unknown'
+    u = ua.lower()
+    if any(x in u for x in ('mobile','android','iphone')): return 'Mobile'
+    if any(x in u for x in ('tablet','ipad')):             return 'Tablet'
+    return 'Desktop'
+
+def legacy_browser(ua):
+    if not ua: return 'Unknown'
+    u = ua.lower()
+    if 'edg/' in u:     return 'Edge'
+    if 'opr/' in u:     return 'Opera'
+    if 'chrome/' in u:  return 'Chrome'
+    if 'firefox/' in u: return 'Firefox'
+    if 'safari/' in u:  return 'Safari'
+    if 'curl' in u:     return 'curl'
+    if 'python' in u:   return 'Python'
+    return 'Other'
+
+def legacy_referrer(ref):
+    if not ref: return 'Direct'
+    r = ref.lower()
+    if 'google' in r:                                      return 'Google'
+    if 'bing' in r:                                        return 'Bing'
+    if 'facebook' in r or 'fb.com' in r:                  return 'Facebook'
+    if 'twitter' in r or 't.co' in r or 'x.com' in r:    return 'Twitter/X'
+    if 'linkedin' in r:                                    return 'LinkedIn'
+    if 'reddit' in r:                                      return 'Reddit'
+    if 'youtube' in r:                                     return 'YouTube'
+    if 'instagram' in r:                                   return 'Instagram'
+    return 'Other'
+
+
+def regex_classifier(rules, default, empty):
+    pattern = re.compile('|'.join(f"(?=.*?(?:{'|'.join(map(re.escape, needles))}))()" for _, needles in rules),
+                         re.IGNORECASE | re.DOTALL)
+    labels  = [label for label, _ in rules]
+
+    def classify(value):
+        if not value:
+            return empty
+        m = pattern.match(value)
+        return labels[m.lastindex - 1] if m else default
+    return classify
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--clicks', type=int, default=300_000)
+    ap.add_argument('--distinct', type=int, default=2000, help='distinct user agents (and referrers) in the corpus')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+    rng = random.Random(args.seed)
+    uas, refs = corpus(rng, args.distinct)
+    clicks = list(zip(zipf(rng, refs, args.clicks), zipf(rng, uas, args.clicks)))
+
+    def classifiers():
+        return (app.Classifier(app.DEVICE_RULES,  'Desktop', 'Unknown'),
+                app.Classifier(app.BROWSER_RULES, 'Other',   'Unknown'),
+                app.Classifier(app.SOURCE_RULES,  'Other',   'Direct'))
+
+    def unmemoised(c):
+        return lambda value: c._classify(value) if value else c.empty
+
+    device, browser, source = classifiers()
+    variants = {
+        'legacy': (legacy_device, legacy_browser, legacy_referrer),
+        'table':  tuple(unmemoised(c) for c in classifiers()),
+        'memo':   (device, browser, source),
+        'regex':  (regex_classifier(app.DEVICE_RULES,  'Desktop', 'Unknown'),
+                   regex_classifier(app.BROWSER_RULES, 'Other',   'Unknown'),
+                   regex_classifier(app.SOURCE_RULES,  'Other',   'Direct')),
+    }
+
+    results, labels, failures = [], {}, []
+    print(f'{len(clicks):,} clicks, {len(set(u for _, u in clicks)):,} distinct user agents, '
+          f'{len(set(r for r, _ in clicks)):,} distinct referrers')
+    print(f"{'variant':<10}{'seconds':>9}{'ns/click':>10}{'clicks/s':>13}{'speedup':>9}")
+    for name, (dev, brw, src) in variants.items():
+        start = time.perf_counter()
+        out = [(src(ref), dev(ua), brw(ua)) for ref, ua in clicks]
+        elapsed = time.perf_counter() - start
+        labels[name] = out
+        base = results[0]['seconds'] if results else elapsed
+        results.append({'variant': name, 'seconds': round(elapsed, 3),
+                        'ns_per_click': round(elapsed / len(clicks) * 1e9),
+                        'clicks_per_sec': round(len(clicks) / elapsed)})
+        print(f'{name:<10}{elapsed:>9.3f}{elapsed / len(clicks) * 1e9:>10.0f}'
+              f'{len(clicks) / elapsed:>13,.0f}{base / elapsed:>8.1f}x')
+        if out != labels['legacy']:
+            diff = sum(a != b for a, b in zip(out, labels['legacy']))
+            failures.append(name)
+            print(f'  FAIL: {diff} clicks labelled differently from legacy')
+
+    for name, c in (('device', device), ('browser', browser), ('source', source)):
+        s = c.stats()
+        print(f"memo {name:<8} {s['size']:>6} entries  hit rate {s['hits'] / max(1, s['hits'] + s['misses']):.1%}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'clicks': len(clicks), 'distinct': args.distinct, 'results': results,
+                       'memo': {n: c.stats() for n, c in (('device', device), ('browser', browser),
+                                                          ('source', source))},
+                       'failures': failures}, f, indent=2)
+    if failures:
+        sys.exit(f"FAIL: {', '.join(failures)} disagree with legacy")
+
+
+if __name__ == '__main__':
+    main()
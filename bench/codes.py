@@ -0,0 +1,93 @@
+"""
+Benchmark: short code allocation rate and collisions, legacy hash vs CodeAllocator.
+
+    python3 bench/codes.py
+    python3 bench/codes.py --count 2000000 --json out.json
+
+legacy     sha256(url + time.time())[:6] hex, as generate_code did; every
+           duplicate is a collision the old code had to catch with a SELECT
+feistel    CodeAllocator.permute + encode over sequence numbers (pure CPU)
+take/B     CodeAllocator.take() end to end against SQLite, reserving blocks
+           of B sequence numbers from app_meta
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import load_app   # noqa: E402
+
+BLOCKS = (1, 100, 1000)
+
+
+def legacy(count):
+    seen, collisions = set(), 0
+    start = time.perf_counter()
+    for i in range(count):
+        code = hashlib.sha256(f'https://example.com/{i}{time.time()}'.encode()).hexdigest()[:6]
+        if code in seen:
+            collisions += 1
+        seen.add(code)
+    return time.perf_counter() - start, collisions
+
+
+def feistel(app, count):
+    alloc = app.CodeAllocator(app.CODE_ALPHABET, app.CODE_LENGTH, 1)
+    alloc._key = (12345).to_bytes(8, 'big')
+    seen = set()
+    start = time.perf_counter()
+    for i in range(count):
+        seen.add(alloc.encode(alloc.permute(i)))
+    elapsed = time.perf_counter() - start
+    assert all(len(c) == alloc.length for c in seen)
+    return elapsed, count - len(seen)
+
+
+def take(app, count, block):
+    alloc = app.CodeAllocator(app.CODE_ALPHABET, app.CODE_LENGTH, block)
+    seen = set()
+    start = time.perf_counter()
+    for _ in range(count):
+        seen.add(alloc.next())
+    return time.perf_counter() - start, count - len(seen), alloc.blocks
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--count', type=int, default=1_000_000)
+    ap.add_argument('--take-count', type=int, default=100_000, help='codes per take/B run')
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+    results = []
+
+    def report(name, n, elapsed, collisions, extra=''):
+        rate = n / elapsed
+        results.append({'variant': name, 'codes': n, 'seconds': round(elapsed, 3),
+                        'codes_per_sec': round(rate), 'collisions': collisions})
+        print(f'{name:<12}{n:>10}{rate:>14,.0f}{collisions:>12}  {extra}')
+
+    print(f"{'variant':<12}{'codes':>10}{'codes/s':>14}{'collisions':>12}")
+    elapsed, collisions = legacy(args.count)
+    report('legacy', args.count, elapsed, collisions, f'space 16^6 = {16 ** 6:,}')
+    elapsed, collisions = feistel(app, args.count)
+    report('feistel', args.count, elapsed, collisions,
+           f'space {len(app.CODE_ALPHABET)}^{app.CODE_LENGTH} = {len(app.CODE_ALPHABET) ** app.CODE_LENGTH:,}')
+    for block in BLOCKS:
+        elapsed, collisions, blocks = take(app, args.take_count, block)
+        report(f'take/{block}', args.take_count, elapsed, collisions, f'{blocks} block reservations')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(r['collisions'] for r in results if r['variant'] != 'legacy'):
+        sys.exit('FAIL: CodeAllocator produced a duplicate code')
+
+
+if __name__ == '__main__':
+    main()
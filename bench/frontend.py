@@ -0,0 +1,92 @@
+"""
+Benchmark: bytes and server time per UI request, legacy file reads vs the asset store.
+
+    python3 bench/frontend.py
+    python3 bench/frontend.py --requests 2000 --json out.json
+
+Each page is requested through the Flask test client the way browsers do:
+
+first      no validator; Accept-Encoding as sent by current browsers
+revisit    If-None-Match with the ETag from the first response
+static     the icon as the landing page references it
+
+legacy routes re-read the file on every request and send it uncompressed
+without validators, as landing / app_frontend / Flask's static handler did.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import ROOT, load_app   # noqa: E402
+
+BROWSER_ENCODINGS = 'gzip, deflate, br, zstd'
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--requests', type=int, default=1000, help='requests per case')
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+
+    def legacy_file(name):
+        def view():
+            with open(os.path.join(ROOT, name)) as f:
+                return f.read()
+        return view
+    app.app.add_url_rule('/__legacy/landing', 'legacy_landing', legacy_file('landing.html'))
+    app.app.add_url_rule('/__legacy/app', 'legacy_app', legacy_file('index.html'))
+    app.app.add_url_rule('/__legacy/static/<path:filename>', 'legacy_static',
+                         lambda filename: app.send_file(os.path.join(ROOT, 'static', filename)))
+    client = app.app.test_client()
+
+    icon = re.search(r'/static/qk-ico\.png\?v=\w+', client.get('/').get_data(as_text=True)).group(0)
+    pages = (('landing', '/__legacy/landing', '/'),
+             ('app', '/__legacy/app', '/app'),
+             ('icon', '/__legacy/static/qk-ico.png', icon))
+
+    def run(path, headers):
+        times = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            resp = client.get(path, headers=headers)
+            body = resp.get_data()
+            times.append((time.perf_counter() - start) * 1e6)
+        return resp, len(body), statistics.median(times)
+
+    results = []
+    print(f"{'page':<9}{'case':<9}{'variant':<8}{'status':>7}{'bytes':>9}{'encoding':>10}{'median us':>11}")
+    for page, legacy_path, path in pages:
+        for case in ('first', 'revisit'):
+            for variant, url in (('legacy', legacy_path), ('assets', path)):
+                headers = {'Accept-Encoding': BROWSER_ENCODINGS}
+                if case == 'revisit':
+                    etag = client.get(url, headers=headers).headers.get('ETag')
+                    if etag:
+                        headers['If-None-Match'] = etag
+                resp, size, us = run(url, headers)
+                results.append({'page': page, 'case': case, 'variant': variant, 'status': resp.status_code,
+                                'bytes': size, 'encoding': resp.headers.get('Content-Encoding', 'identity'),
+                                'cache_control': resp.headers.get('Cache-Control'), 'median_us': round(us, 1)})
+                print(f"{page:<9}{case:<9}{variant:<8}{resp.status_code:>7}{size:>9}"
+                      f"{resp.headers.get('Content-Encoding', '-'):>10}{us:>11.1f}")
+
+    first = {(r['page'], r['variant']): r['bytes'] for r in results if r['case'] == 'first'}
+    for variant in ('legacy', 'assets'):
+        print(f"first paint (landing + icon), {variant}: {first[('landing', variant)] + first[('icon', variant)]:,} bytes")
+    print(f"icon Cache-Control (fingerprinted URL): {next(r['cache_control'] for r in results if r['page'] == 'icon' and r['variant'] == 'assets')}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: SQL statements and latency per /api/links page.
+
+    python3 bench/list_queries.py
+    python3 bench/list_queries.py --links 5000 --json out.json
+
+Seeds a throwaway database with tagged links spread over several owners,
+then requests /api/links at each page size through the Flask test client
+while counting the statements SQLite executes. The fixed statement count is
+asserted by tests/test_list_queries.py.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import load_app   # noqa: E402
+
+PAGE_SIZES = (10, 50, 100)
+
+
+def seed(app, n_links, n_users=5, n_tags=20):
+    from werkzeug.security import generate_password_hash
+    rng = random.Random(1)
+    now = '2025-01-01T00:00:00'
+    with app.get_db() as conn:
+        pw = generate_password_hash('bench')
+        for i in range(n_users):
+            conn.execute('INSERT INTO users (username, password_hash, is_admin, created_at) VALUES (?,?,0,?)',
+                         (f'user{i}', pw, now))
+        user_ids = [r[0] for r in conn.execute('SELECT id FROM users')]
+        conn.executemany('INSERT INTO tags (name) VALUES (?)', [(f'tag{i}',) for i in range(n_tags)])
+        tag_ids = [r[0] for r in conn.execute('SELECT id FROM tags')]
+        conn.executemany(
+            'INSERT INTO links (code, long_url, title, created_at, user_id) VALUES (?,?,?,?,?)',
+            [(f'b{i:06d}', f'https://example.com/{i}', f'Link {i}',
+              f'2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00', rng.choice(user_ids))
+             for i in range(n_links)]
+        )
+        link_ids = [r[0] for r in conn.execute('SELECT id FROM links')]
+        conn.executemany('INSERT INTO link_tags (link_id, tag_id) VALUES (?,?)',
+                         [(lid, tid) for lid in link_ids for tid in rng.sample(tag_ids, 3)])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--links', type=int, default=2000)
+    ap.add_argument('--iterations', type=int, default=20)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+    seed(app, args.links)
+    client = app.app.test_client()
+    r = client.post('/api/auth/login', json={'username': app.ADMIN_USERNAME, 'password': os.environ['ADMIN_PASSWORD']})
+    assert r.status_code == 200, r.data
+
+    statements = []
+    conn = app.get_db()   # the test client runs requests on this thread's connection
+    conn.set_trace_callback(statements.append)
+
+    results = []
+    print(f"{'per_page':>8}{'statements':>12}{'median ms':>11}")
+    for per_page in PAGE_SIZES:
+        url = f'/api/links?per_page={per_page}&count=none'
+        statements.clear()
+        r = client.get(url)
+        assert r.status_code == 200 and len(r.get_json()['links']) == per_page, r.status_code
+        count = len(statements)
+        times = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            client.get(url)
+            times.append((time.perf_counter() - start) * 1000)
+        results.append({'per_page': per_page, 'statements': count, 'median_ms': round(statistics.median(times), 3)})
+        print(f"{per_page:>8}{count:>12}{results[-1]['median_ms']:>11.2f}")
+    conn.set_trace_callback(None)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'links': args.links, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
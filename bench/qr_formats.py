@@ -0,0 +1,75 @@
+"""
+Benchmark: QR output size and latency per format.
+
+    python3 bench/qr_formats.py
+    python3 bench/qr_formats.py --styles square dots --sizes 300 --json out.json
+
+Variants:
+  rgb       24-bit RGB PNG at zlib level 6 (the previous output)
+  pal-N     palette PNG with QR_PNG_COMPRESS_LEVEL=N (1-bit square output always uses 9)
+  svg       path-merged SVG built from the module matrix
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import DATA, SIZES, STYLES, load_app   # noqa: E402
+
+LEVELS = (1, 6, 9)
+
+
+def measure(render, iterations):
+    payload = render()   # warm-up
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        payload = render()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), len(payload)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--styles', nargs='+', default=STYLES, choices=STYLES)
+    ap.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    ap.add_argument('--iterations', type=int, default=20)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+
+    def png(style, size, palette, level):
+        def render():
+            app.QR_PNG_COMPRESS_LEVEL = level
+            return app.generate_qr_png(DATA, size=size, style=style, palette=palette)
+        return render
+
+    results = []
+    variants = ['rgb'] + [f'pal-{lvl}' for lvl in LEVELS] + ['svg']
+    print(f"{'style':<11}{'size':>6}" + ''.join(f'{v:>18}' for v in variants))
+    for style in args.styles:
+        for size in args.sizes:
+            renders = {'rgb': png(style, size, False, 6)}
+            for lvl in LEVELS:
+                renders[f'pal-{lvl}'] = png(style, size, True, lvl)
+            renders['svg'] = lambda: app.generate_qr_svg(DATA, size=size, style=style)
+            row = f'{style:<11}{size:>6}'
+            for variant in variants:
+                ms, nbytes = measure(renders[variant], args.iterations)
+                results.append({'style': style, 'size': size, 'variant': variant,
+                                'p50_ms': round(ms, 3), 'bytes': nbytes})
+                row += f'{ms:>8.2f} ms{nbytes:>7} B'
+            print(row)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
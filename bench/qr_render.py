@@ -0,0 +1,171 @@
+"""
+Microbenchmark: QR rendering latency and peak memory, old vs new pipeline.
+
+    python3 bench/qr_render.py                      # all styles × default sizes
+    python3 bench/qr_render.py --sizes 300 1000 --iterations 50 --json out.json
+
+`legacy` is the pre-matrix generate_qr_png (qrcode image → PNG → decode →
+LANCZOS resize → PNG), kept here verbatim for comparison. `current` is
+app.generate_qr_png. Each case runs in a fresh interpreter, and the reported
+peak RSS is the growth over the warmed-up process while rendering.
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STYLES = ('square', 'rounded', 'dots', 'vertical', 'horizontal')
+SIZES  = (150, 300, 600, 1000)
+DATA   = 'https://example.com/abc123'
+
+
+def legacy_generate_qr_png(data, size=300, fg=(0,0,0), bg=(255,255,255), style='square'):
+    import qrcode as qrc
+    from PIL import Image
+
+    qr = qrc.QRCode(error_correction=qrc.constants.ERROR_CORRECT_M, border=2)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    pil_img = None
+    if style and style != 'square':
+        from qrcode.image.styledpil import StyledPilImage
+        from qrcode.image.styles.moduledrawers.pil import (
+            RoundedModuleDrawer, CircleModuleDrawer,
+            VerticalBarsDrawer, HorizontalBarsDrawer,
+        )
+        drawer_cls = {
+            'rounded':    RoundedModuleDrawer,
+            'dots':       CircleModuleDrawer,
+            'vertical':   VerticalBarsDrawer,
+            'horizontal': HorizontalBarsDrawer,
+        }.get(style)
+        if drawer_cls:
+            qr_obj = qr.make_image(image_factory=StyledPilImage, module_drawer=drawer_cls(),
+                                   fill_color=fg, back_color=bg)
+            tmp = io.BytesIO()
+            qr_obj.save(tmp, 'PNG')
+            tmp.seek(0)
+            pil_img = Image.open(tmp).convert('RGB')
+
+    if pil_img is None:
+        qr_obj = qr.make_image(fill_color=fg, back_color=bg)
+        tmp = io.BytesIO()
+        qr_obj.save(tmp, 'PNG')
+        tmp.seek(0)
+        pil_img = Image.open(tmp).convert('RGB')
+
+    pil_img = pil_img.resize((size, size), Image.LANCZOS)
+    buf = io.BytesIO()
+    pil_img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def load_app():
+    """Import app.py against a throwaway database."""
+    tmp = tempfile.mkdtemp(prefix='qrknit-bench-')
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+    os.environ['DB_PATH'] = os.path.join(tmp, 'bench.db')
+    sys.path.insert(0, ROOT)
+    import app
+    return app
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def reset_peak_rss():
+    """Reset VmHWM so the next peak_rss_growth() covers only what follows (Linux ≥ 4.0)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status_kb('VmRSS')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_growth(baseline_kb):
+    try:
+        return _status_kb('VmHWM') - baseline_kb
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb
+
+
+def run_case(impl, style, size, iterations):
+    """Time one implementation/style/size in this process; returns a result dict."""
+    import qrcode.image.styledpil   # noqa: F401 — keep imports out of the measurement
+    render = legacy_generate_qr_png if impl == 'legacy' else load_app().generate_qr_png
+    render(DATA, size=size, style=style)   # warm-up: lazy imports, sprite caches
+    baseline = reset_peak_rss()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        png = render(DATA, size=size, style=style)
+        times.append((time.perf_counter() - start) * 1000)
+    peak_rss = peak_rss_growth(baseline)
+    return {
+        'impl':        impl,
+        'style':       style,
+        'size':        size,
+        'iterations':  iterations,
+        'p50_ms':      round(statistics.median(times), 3),
+        'min_ms':      round(min(times), 3),
+        'peak_rss_kb': peak_rss,
+        'png_bytes':   len(png),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--styles', nargs='+', default=STYLES, choices=STYLES)
+    ap.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    ap.add_argument('--iterations', type=int, default=20)
+    ap.add_argument('--json', help='write results to this file')
+    ap.add_argument('--case', nargs=3, metavar=('IMPL', 'STYLE', 'SIZE'), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.case:
+        impl, style, size = args.case
+        print(json.dumps(run_case(impl, style, int(size), args.iterations)))
+        return
+
+    results = []
+    print(f"{'style':<11}{'size':>6}{'legacy ms':>12}{'current ms':>12}{'speedup':>9}"
+          f"{'legacy RSS':>13}{'current RSS':>13}")
+    for style in args.styles:
+        for size in args.sizes:
+            pair = {}
+            for impl in ('legacy', 'current'):
+                out = subprocess.run(
+                    [sys.executable, __file__, '--case', impl, style, str(size),
+                     '--iterations', str(args.iterations)],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                pair[impl] = json.loads(out.strip().splitlines()[-1])
+                results.append(pair[impl])
+            old, new = pair['legacy'], pair['current']
+            print(f"{style:<11}{size:>6}{old['p50_ms']:>12.2f}{new['p50_ms']:>12.2f}"
+                  f"{old['p50_ms'] / new['p50_ms']:>8.1f}x"
+                  f"{old['peak_rss_kb']:>10} KB{new['peak_rss_kb']:>10} KB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
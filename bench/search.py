@@ -0,0 +1,88 @@
+"""
+Benchmark: /api/links?q= latency, FTS5 index vs the LIKE '%q%' fallback.
+
+    python3 bench/search.py
+    python3 bench/search.py --sizes 10000 300000 --json out.json
+
+For each table size the same queries are run through the Flask test client
+with the FTS5 index enabled and then with app.LINK_FTS switched off, which
+is the path taken on SQLite builds without FTS5.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import load_app   # noqa: E402
+
+SIZES   = (10000, 100000, 300000)
+QUERIES = ('docs', 'exam', 'invoice 2024', 'zzzz')
+WORDS   = ('docs', 'blog', 'shop', 'invoice', 'report', 'launch', 'event', 'promo', 'news', 'guide')
+HOSTS   = ('example.com', 'docs.example.org', 'shop.acme.io', 'news.site.net', 'cdn.media.co')
+
+
+def grow(app, target):
+    rng = random.Random(target)
+    with app.get_db() as conn:
+        start = conn.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO links (code, long_url, title, created_at, user_id) VALUES (?,?,?,?,1)',
+            [(f's{i:07d}',
+              f'https://{rng.choice(HOSTS)}/{rng.choice(WORDS)}/{rng.randint(2019, 2025)}/{i}',
+              f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+              f'2025-01-{1 + i % 28:02d}T00:00:00')
+             for i in range(start, target)]
+        )
+
+
+def timed(client, query, iterations):
+    url = f'/api/links?q={query}&per_page=20'
+    client.get(url)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        r = client.get(url)
+        times.append((time.perf_counter() - start) * 1000)
+    assert r.status_code == 200, r.status_code
+    return round(statistics.median(times), 3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    ap.add_argument('--iterations', type=int, default=10)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+    if not app.LINK_FTS:
+        sys.exit('This SQLite build has no FTS5; nothing to compare.')
+    client = app.app.test_client()
+    r = client.post('/api/auth/login', json={'username': app.ADMIN_USERNAME, 'password': os.environ['ADMIN_PASSWORD']})
+    assert r.status_code == 200, r.data
+
+    results = []
+    print(f"{'links':>8}  {'query':<14}{'fts ms':>10}{'like ms':>10}")
+    for size in sorted(args.sizes):
+        grow(app, size)
+        for query in QUERIES:
+            app.LINK_FTS = True
+            fts = timed(client, query, args.iterations)
+            app.LINK_FTS = False
+            like = timed(client, query, args.iterations)
+            app.LINK_FTS = True
+            results.append({'links': size, 'query': query, 'fts_ms': fts, 'like_ms': like})
+            print(f'{size:>8}  {query:<14}{fts:>10.2f}{like:>10.2f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Load test: latency and throughput of the main endpoints on a synthetic dataset.
+
+    python3 bench/service.py                                  # test client, then gunicorn
+    python3 bench/service.py --links 50000 --clicks 1000000 --json run.json
+    python3 bench/service.py --mode gunicorn --workers 4 --concurrency 32 --gunicorn-args="--threads 4"
+    WEB_THREADS=1 python3 bench/service.py --mode gunicorn      # sync workers
+    python3 bench/service.py --compare before.json after.json
+
+Seeds a throwaway database with --links links and --clicks clicks. Link
+popularity is Zipf-distributed, and user agents, referrers and countries are
+drawn from weighted tables modelled on a typical public link mix (mostly
+mobile Safari and Chrome, a share of direct traffic, a few bots). Rollups are
+built with backfill_rollups, as on an upgraded install. Every scenario then
+runs in one or both modes:
+
+client     sequential requests through the Flask test client, in process;
+           no HTTP parsing or sockets, so this isolates the application code
+gunicorn   a real `gunicorn app:app` on a local port, driven by --concurrency
+           client threads over HTTP/1.1
+
+The client threads share this interpreter, so gunicorn throughput is a lower
+bound on what the server can do; compare runs made on the same machine.
+Results (p50/p90/p99 in ms, requests/s, errors) are printed and, with
+--json, saved with the dataset size, git revision and SQLite version so
+that --compare can line two runs up.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import ROOT, load_app   # noqa: E402
+
+SCENARIOS = ('redirect', 'qr', 'links', 'analytics', 'stats', 'import', 'export')
+HEAVY     = {'import': 20, 'export': 20}   # these run requests // N times
+
+USER_AGENTS = (
+    (30, 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1'),
+    (22, 'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36'),
+    (20, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'),
+    (8,  'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15'),
+    (6,  'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.2478.51'),
+    (5,  'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0'),
+    (4,  'Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1'),
+    (3,  'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'),
+    (1,  'curl/8.5.0'),
+    (1,  ''),
+)
+REFERRERS = (
+    (40, None),
+    (18, 'https://www.google.com/'),
+    (10, 'https://t.co/'),
+    (9,  'https://www.facebook.com/'),
+    (6,  'https://www.linkedin.com/'),
+    (5,  'https://www.reddit.com/r/selfhosted/'),
+    (4,  'https://www.instagram.com/'),
+    (4,  'https://mail.google.com/'),
+    (4,  'https://news.ycombinator.com/'),
+)
+COUNTRIES = ((30, 'US'), (10, 'DE'), (9, 'GB'), (8, 'IN'), (6, 'FR'), (5, 'BR'), (5, 'CA'),
+             (4, 'JP'), (4, 'NL'), (3, 'AU'), (6, 'XX'), (10, 'Unknown'))
+WORDS = ('docs', 'blog', 'shop', 'invoice', 'report', 'launch', 'event', 'promo', 'news', 'guide')
+HOSTS = ('example.com', 'docs.example.org', 'shop.acme.io', 'news.site.net', 'cdn.media.co')
+
+
+def weighted(table):
+    """(values, cumulative weights) for random.choices."""
+    weights, values = zip(*table)
+    return values, list(itertools.accumulate(weights))
+
+
+def zipf_weights(n, s=1.1):
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+# ── Dataset ─────────────────────────────────────
+
+def seed(app, n_links, n_clicks, rng, days=90):
+    """Fill the bench database; returns the link codes, most popular first."""
+    now = datetime.utcnow()
+    with app.get_db() as conn:
+        user_id = conn.execute('SELECT id FROM users WHERE username=?', (app.ADMIN_USERNAME,)).fetchone()[0]
+    codes = app.code_allocator.take(n_links)
+    with app.get_db() as conn:
+        conn.executemany(
+            'INSERT INTO links (code, long_url, title, created_at, user_id) VALUES (?,?,?,?,?)',
+            [(code,
+              f'https://{rng.choice(HOSTS)}/{rng.choice(WORDS)}/{i}?utm_source=bench',
+              f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+              (now - timedelta(seconds=rng.randrange(days * 86400))).isoformat(),
+              user_id)
+             for i, code in enumerate(codes)]
+        )
+        ids = dict(conn.execute('SELECT code, id FROM links'))
+
+    link_ids = [ids[c] for c in codes]
+    popularity = zipf_weights(n_links)
+    uas, ua_cum   = weighted(USER_AGENTS)
+    refs, ref_cum = weighted(REFERRERS)
+    ccs, cc_cum   = weighted(COUNTRIES)
+    counts = {}
+    batch  = 20000
+    for start in range(0, n_clicks, batch):
+        k    = min(batch, n_clicks - start)
+        who  = rng.choices(link_ids, cum_weights=popularity, k=k)
+        for link_id in who:
+            counts[link_id] = counts.get(link_id, 0) + 1
+        with app.get_db() as conn:
+            ua_ids  = app.ua_interner.ids(conn, uas)
+            ref_ids = app.referrer_interner.ids(conn, refs)
+            rows = [(link_id,
+                     (now - timedelta(seconds=rng.randrange(days * 86400))).isoformat(),
+                     ref_ids.get(ref), ua_ids.get(ua),
+                     f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}', cc)
+                    for link_id, ref, ua, cc in zip(who,
+                                                    rng.choices(refs, cum_weights=ref_cum, k=k),
+                                                    rng.choices(uas, cum_weights=ua_cum, k=k),
+                                                    rng.choices(ccs, cum_weights=cc_cum, k=k))]
+            conn.executemany('INSERT INTO clicks (link_id, clicked_at, referrer_id, ua_id, ip_address, country) '
+                             'VALUES (?,?,?,?,?,?)', rows)
+    with app.get_db() as conn:
+        conn.executemany('UPDATE links SET clicks=? WHERE id=?', [(n, i) for i, n in counts.items()])
+    app.backfill_rollups()
+    return codes
+
+
+# ── Scenarios ───────────────────────────────────
+
+class Workload:
+    """Builds (method, path, body, content type, expected status) for each scenario."""
+
+    def __init__(self, codes, rng, import_rows):
+        self.codes       = codes
+        self.popularity  = zipf_weights(len(codes))
+        self.rng         = rng
+        self.import_rows = import_rows
+        self._lock       = threading.Lock()
+        self._imported   = 0
+
+    def _code(self):
+        return self.rng.choices(self.codes, cum_weights=self.popularity)[0]
+
+    def request(self, scenario):
+        if scenario == 'redirect':
+            return 'GET', f'/{self._code()}', None, None, 301
+        if scenario == 'qr':
+            return 'GET', f'/api/qr/{self._code()}?size={self.rng.choice((200, 300, 600))}', None, None, 200
+        if scenario == 'links':
+            return 'GET', '/api/links?per_page=20', None, None, 200
+        if scenario == 'analytics':
+            return 'GET', f'/api/links/{self._code()}/analytics?days=30', None, None, 200
+        if scenario == 'stats':
+            return 'GET', '/api/stats', None, None, 200
+        if scenario == 'import':
+            with self._lock:
+                first, self._imported = self._imported, self._imported + self.import_rows
+            body = 'url,title,tags\n' + ''.join(
+                f'https://{HOSTS[i % len(HOSTS)]}/import/{i},Imported {i},bench\n'
+                for i in range(first, first + self.import_rows))
+            return 'POST', '/api/links/import', body.encode(), 'text/csv', 200
+        if scenario == 'export':
+            return 'GET', '/api/links/export', None, None, 200
+        raise ValueError(scenario)
+
+
+def summarize(mode, scenario, latencies, errors, elapsed):
+    latencies.sort()
+    pct = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3) if latencies else None
+    return {
+        'mode': mode, 'scenario': scenario, 'requests': len(latencies), 'errors': errors,
+        'p50_ms': pct(0.50), 'p90_ms': pct(0.90), 'p99_ms': pct(0.99),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+
+def run_client(app, work, scenarios, requests):
+    client = app.app.test_client()
+    r = client.post('/api/auth/login', json={'username': app.ADMIN_USERNAME, 'password': os.environ['ADMIN_PASSWORD']})
+    assert r.status_code == 200, r.data
+    results = []
+    for scenario in scenarios:
+        n = max(1, requests // HEAVY.get(scenario, 1))
+        latencies, errors = [], 0
+        for i in range(n + 1):   # the first request is a warm-up
+            method, path, body, ctype, expect = work.request(scenario)
+            if i == 1:
+                started = time.perf_counter()
+            t = time.perf_counter()
+            resp = client.open(path, method=method, data=body, content_type=ctype)
+            resp.get_data()
+            if i:
+                latencies.append(time.perf_counter() - t)
+                errors += resp.status_code != expect
+        results.append(summarize('client', scenario, latencies, errors, time.perf_counter() - started))
+        report(results[-1])
+    app.click_writer.flush()
+    return results
+
+
+# ── gunicorn ────────────────────────────────────
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port, workers, extra):
+    # The repo's gunicorn.conf.py, so WEB_THREADS picks the worker class as in production
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+           '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--chdir', ROOT,
+           '--access-logfile', os.devnull, '--log-level', 'warning'] + extra + ['app:app']
+    proc = subprocess.Popen(cmd, env=dict(os.environ))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    sys.exit('gunicorn did not come up within 30s')
+
+
+def login_cookie(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = json.dumps({'username': os.environ.get('ADMIN_USERNAME', 'admin'), 'password': os.environ['ADMIN_PASSWORD']})
+    conn.request('POST', '/api/auth/login', body, {'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    resp.read()
+    assert resp.status == 200, resp.status
+    return resp.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def run_gunicorn(work, scenarios, requests, port, concurrency, cookie):
+    results = []
+    for scenario in scenarios:
+        n = max(1, requests // HEAVY.get(scenario, 1))
+        remaining = iter(range(n))
+        lock = threading.Lock()
+        latencies, errors = [], [0]
+
+        def client():
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            mine, bad = [], 0
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                method, path, body, ctype, expect = work.request(scenario)
+                headers = {'Cookie': cookie}
+                if ctype:
+                    headers['Content-Type'] = ctype
+                t = time.perf_counter()
+                try:
+                    conn.request(method, path, body, headers)
+                    resp = conn.getresponse()
+                    resp.read()
+                    bad += resp.status != expect
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    bad += 1
+                mine.append(time.perf_counter() - t)
+            with lock:
+                latencies.extend(mine)
+                errors[0] += bad
+
+        threads = [threading.Thread(target=client) for _ in range(min(concurrency, n))]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        results.append(summarize('gunicorn', scenario, latencies, errors[0], time.perf_counter() - started))
+        report(results[-1])
+    return results
+
+
+# ── Reporting ───────────────────────────────────
+
+def report(r):
+    print(f"{r['mode']:<9}{r['scenario']:<11}{r['requests']:>8}{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}"
+          f"{r['p99_ms']:>10.2f}{r['rps']:>10.1f}{r['errors']:>8}", flush=True)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = {(r['mode'], r['scenario']): r for r in json.load(f)['results']}
+    with open(after_path) as f:
+        after = json.load(f)['results']
+    delta = lambda a, b: f'{(b - a) / a * 100:+.0f}%' if a and b is not None else 'n/a'
+    print(f"{'mode':<9}{'scenario':<11}{'p50':>16}{'p99':>16}{'req/s':>16}")
+    for r in after:
+        b = before.get((r['mode'], r['scenario']))
+        if b:
+            print(f"{r['mode']:<9}{r['scenario']:<11}"
+                  f"{delta(b['p50_ms'], r['p50_ms']):>16}{delta(b['p99_ms'], r['p99_ms']):>16}{delta(b['rps'], r['rps']):>16}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--links', type=int, default=10000)
+    ap.add_argument('--clicks', type=int, default=200000)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='both')
+    ap.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    ap.add_argument('--requests', type=int, default=500, help='requests per scenario (import/export run 1/20 of this)')
+    ap.add_argument('--import-rows', type=int, default=100, help='CSV rows per import request')
+    ap.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    ap.add_argument('--concurrency', type=int, default=16, help='client threads against gunicorn')
+    ap.add_argument('--gunicorn-args', default='', help='extra gunicorn flags, e.g. "--threads 4"')
+    ap.add_argument('--json', help='write results to this file')
+    ap.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two --json results and exit')
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    app = load_app()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    codes = seed(app, args.links, args.clicks, rng)
+    print(f'seeded {args.links} links and {args.clicks} clicks in {time.perf_counter() - started:.1f}s '
+          f'({os.environ["DB_PATH"]})')
+    work = Workload(codes, rng, args.import_rows)
+
+    print(f"{'mode':<9}{'scenario':<11}{'requests':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    results = []
+    if args.mode in ('client', 'both'):
+        results += run_client(app, work, args.scenarios, args.requests)
+    if args.mode in ('gunicorn', 'both'):
+        port = free_port()
+        proc = start_gunicorn(port, args.workers, args.gunicorn_args.split())
+        try:
+            results += run_gunicorn(work, args.scenarios, args.requests, port, args.concurrency, login_cookie(port))
+        finally:
+            proc.terminate()
+            proc.wait(10)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'meta': {
+                    'when': datetime.utcnow().isoformat(timespec='seconds'), 'revision': git_revision(),
+                    'python': sys.version.split()[0], 'sqlite': sqlite3.sqlite_version,
+                    'cpus': os.cpu_count(), 'workers': args.workers, 'concurrency': args.concurrency,
+                    'gunicorn_args': args.gunicorn_args,
+                },
+                'dataset': {'links': args.links, 'clicks': args.clicks, 'seed': args.seed},
+                'results': results,
+            }, f, indent=2)
+    if any(r['errors'] for r in results):
+        sys.exit('FAIL: some requests returned an unexpected status')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark: TitleFetcher against a local stub HTTP server.
+
+    python3 bench/title_fetch.py
+    python3 bench/title_fetch.py --callers 50 --json out.json
+
+Starts a keep-alive HTTP/1.1 stub on 127.0.0.1 and times repeated lookups of
+a slow page with the fetcher and with the previous urllib-per-call code, and
+many concurrent callers asking for one uncached page. Behaviour is covered
+by tests/test_title_fetch.py.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qr_render import load_app   # noqa: E402
+
+SLOW = 0.3   # seconds the /slow pages take
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:   # the fetcher hangs up once it has a title
+            pass
+
+    def _send(self, status, body, ctype='text/html; charset=utf-8', headers=()):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        with Stub.lock:
+            Stub.hits[self.path] = Stub.hits.get(self.path, 0) + 1
+        if path == '/slow':
+            time.sleep(SLOW)
+        self._send(200, f'<title>Page {self.path}</title>')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    ap.add_argument('--callers', type=int, default=20, help='concurrent callers asking for one page')
+    ap.add_argument('--iterations', type=int, default=10)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    app = load_app()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    fetcher = lambda **kw: app.TitleFetcher(**{
+        'workers': 8, 'per_host': 2, 'timeout': 5.0, 'max_bytes': 65536,
+        'cache_size': 1000, 'ttl': 3600, 'negative_ttl': 300, **kw})
+
+    f = fetcher()
+    callers = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=lambda: callers.append(f.title(f'{base}/slow?coalesce')))
+               for _ in range(args.callers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    coalesced_ms = round((time.perf_counter() - start) * 1000, 3)
+    print(f"{args.callers} concurrent callers, one uncached {SLOW * 1000:.0f} ms page: {coalesced_ms:.1f} ms, "
+          f"{Stub.hits.get('/slow?coalesce', 0)} fetch(es)")
+
+    def legacy(url):
+        req = urllib.request.Request(url, headers={'Accept': 'text/html'})
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            resp.read(65536)
+
+    def timed(call):
+        times = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            call(f'{base}/slow?repeat')
+            times.append((time.perf_counter() - start) * 1000)
+        return round(statistics.median(times), 3)
+
+    f = fetcher()
+    results = {'legacy_ms': timed(legacy), 'fetcher_ms': timed(f.title), 'coalesced_ms': coalesced_ms,
+               'stats': f.stats()}
+    print(f"repeated lookups of a {SLOW * 1000:.0f} ms page: legacy {results['legacy_ms']:.2f} ms, "
+          f"fetcher {results['fetcher_ms']:.3f} ms (median of {args.iterations})")
+
+    server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# ─────────────────────────────────────────────
+# QRknit — gunicorn.conf.py
+# Loaded by the Dockerfile CMD (gunicorn -c gunicorn.conf.py app:app)
+# ─────────────────────────────────────────────
+#
+# WEB_THREADS > 1 selects the threaded (gthread) worker: each worker process
+# serves that many requests at once, so a slow outbound call (title fetch,
+# geo lookup) ties up one thread instead of the whole worker. app.py keeps
+# one SQLite connection per thread and locks its shared caches, so threads
+# are safe; QR rendering runs in a process pool so it does not hold the GIL
+# against redirects. WEB_THREADS=1 falls back to classic sync workers.
+
+import os
+
+bind         = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers      = int(os.environ.get('WEB_WORKERS', 1))
+threads      = int(os.environ.get('WEB_THREADS', 8))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Schema setup and the admin upsert run once in the master, not per worker
+preload_app  = True
+timeout      = 60
+keepalive    = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+accesslog    = '-'
+errorlog     = '-'
+
+
+def post_fork(server, worker):
+    # Fork the QR render pool now, while the worker is still single-threaded
+    import app
+    app.start_qr_pool()
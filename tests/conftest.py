@@ -0,0 +1,42 @@
+"""
+Shared fixtures. app.py reads its configuration at import, so it is imported
+once per test session against a throwaway database.
+"""
+
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.environ['DB_PATH'] = str(tmp_path_factory.mktemp('db') / 'test.db')
+    os.environ.setdefault('SECRET_KEY', 'test')
+    os.environ.setdefault('ADMIN_PASSWORD', 'test')
+    os.environ.setdefault('GEO_PROVIDER', 'none')
+    sys.path.insert(0, ROOT)
+    import app as qrknit
+    return qrknit
+
+
+@pytest.fixture
+def stub_server():
+    """Start a threaded HTTP/1.1 server on 127.0.0.1 for a handler class; yields its base URL."""
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
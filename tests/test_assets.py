@@ -0,0 +1,42 @@
+"""Only the static files the HTML shells reference are held in memory; the rest come from disk."""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def unreferenced(app):
+    path = os.path.join(app.static_assets.root, 'test-unreferenced.txt')
+    with open(path, 'w') as f:
+        f.write('from disk\n')
+    yield 'test-unreferenced.txt'
+    os.remove(path)
+
+
+def test_referenced_file_is_served_from_memory(app):
+    asset  = app.static_assets.get('qk-ico.png')
+    client = app.app.test_client()
+    assert asset is not None and f'/static/qk-ico.png?v={asset.version}' in client.get('/').get_data(as_text=True)
+    resp = client.get(f'/static/qk-ico.png?v={asset.version}')
+    assert resp.status_code == 200 and resp.headers['ETag'] == f'"{asset.variants["identity"][1]}"'
+    assert 'immutable' in resp.headers['Cache-Control']
+
+
+def test_other_files_are_sent_from_disk_without_growing_the_store(app, unreferenced):
+    client = app.app.test_client()
+    before = len(app.static_assets)
+    for _ in range(3):
+        resp = client.get(f'/static/{unreferenced}')
+        assert resp.status_code == 200 and resp.get_data() == b'from disk\n'
+        assert 'no-cache' in resp.headers['Cache-Control']
+    assert len(app.static_assets) == before and app.static_assets.get(unreferenced) is None
+    assert client.get('/static/missing.png').status_code == 404
+
+
+def test_files_over_max_bytes_are_not_loaded(app, tmp_path):
+    (tmp_path / 'big.js').write_bytes(b'x' * 2048)
+    (tmp_path / 'small.js').write_bytes(b'x' * 16)
+    store = app.AssetStore(str(tmp_path), max_bytes=1024)
+    assert store.load('big.js') is None and store.load('small.js') is not None
+    assert len(store) == 1
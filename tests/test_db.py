@@ -0,0 +1,53 @@
+"""Nested `with get_db()` blocks: only the outermost commits; inner ones roll back on their own."""
+
+import pytest
+
+
+def meta(conn, key):
+    row = conn.execute('SELECT value FROM app_meta WHERE key=?', (key,)).fetchone()
+    return row and row[0]
+
+
+@pytest.fixture
+def other(app):
+    conn = app._connect()
+    yield conn
+    conn.close()
+
+
+def test_inner_block_does_not_commit_the_outer_transaction(app, other):
+    with app.get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_outer', 1)")
+        with app.get_db() as inner:
+            inner.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_inner', 1)")
+        assert meta(other, 'nest_outer') is None and meta(other, 'nest_inner') is None
+    assert meta(other, 'nest_outer') == 1 and meta(other, 'nest_inner') == 1
+
+
+def test_failed_inner_block_only_undoes_its_own_writes(app, other):
+    with app.get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_kept', 1)")
+        with pytest.raises(ZeroDivisionError):
+            with app.get_db() as inner:
+                inner.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_undone', 1)")
+                1 / 0
+    assert meta(other, 'nest_kept') == 1 and meta(other, 'nest_undone') is None
+
+
+def test_inner_block_can_begin_immediate(app, other):
+    with app.get_db() as conn:
+        conn.execute("SELECT 1 FROM app_meta").fetchall()
+        with app.get_db() as inner:
+            inner.execute('BEGIN IMMEDIATE')
+            inner.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_immediate', 1)")
+        assert meta(other, 'nest_immediate') is None
+    assert meta(other, 'nest_immediate') == 1
+
+
+def test_explicit_rollback_inside_an_inner_block(app, other):
+    with app.get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_rolled_back', 1)")
+        with app.get_db() as inner:
+            inner.rollback()
+            inner.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES ('nest_retried', 1)")
+    assert meta(other, 'nest_rolled_back') is None and meta(other, 'nest_retried') == 1
@@ -0,0 +1,49 @@
+"""A quiet job keeps its claim, and a job of an unknown kind fails on its first attempt."""
+
+import threading
+import time
+
+
+def start_job(app, kind):
+    """Insert a job already claimed by the caller, as JobRunner._claim() returns it."""
+    with app.get_db() as conn:
+        return conn.execute(
+            "INSERT INTO jobs (kind, status, attempts, heartbeat_at, created_at) "
+            "VALUES (?, 'running', 1, ?, '2026-01-01T00:00:00') RETURNING *", (kind, time.time())).fetchone()
+
+
+def job_row(app, job_id):
+    with app.get_db() as conn:
+        return conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+
+
+def test_job_without_progress_reports_is_not_requeued(app, monkeypatch):
+    monkeypatch.setattr(app, 'JOB_STALE_AFTER', 1.5)
+    runner = app.JobRunner(0, 0.05)
+    calls  = []
+    monkeypatch.setitem(app.JOB_HANDLERS, 'test_quiet', (lambda ctx: calls.append(time.sleep(4)), False))
+    job = start_job(app, 'test_quiet')
+
+    stop = threading.Event()
+    def sweep():   # what every other runner's _claim() does meanwhile
+        while not stop.wait(0.2):
+            runner._claim()
+    sweeper = threading.Thread(target=sweep)
+    sweeper.start()
+    try:
+        runner.run_one(job)
+    finally:
+        stop.set()
+        sweeper.join()
+
+    row = job_row(app, job['id'])
+    assert (row['status'], row['attempts'], len(calls)) == ('done', 1, 1)
+
+
+def test_unknown_kind_fails_without_retrying(app):
+    runner = app.JobRunner(0, 0.05)
+    job = start_job(app, 'no_such_kind')
+    runner.run_one(job)
+    row = job_row(app, job['id'])
+    assert row['status'] == 'failed' and row['error'] == "unknown job kind 'no_such_kind'"
+    assert runner.failed == 1
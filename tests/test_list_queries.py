@@ -0,0 +1,66 @@
+"""The links listing costs a fixed number of SQL statements whatever the page size."""
+
+import random
+
+import pytest
+
+PAGE_SIZES = (1, 10, 50, 100)
+
+
+@pytest.fixture(scope='module')
+def lister(app):
+    """A user owning 150 tagged links, and a test client logged in as them."""
+    rng = random.Random(1)
+    with app.get_db() as conn:
+        user_id = conn.execute(
+            "INSERT INTO users (username, password_hash, is_admin, created_at) VALUES ('lister', ?, 0, '2025-01-01')",
+            (app.generate_password_hash('lister'),)).lastrowid
+        conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(f'list{i}',) for i in range(20)])
+        tag_ids = [r[0] for r in conn.execute("SELECT id FROM tags WHERE name LIKE 'list%'")]
+        conn.executemany(
+            'INSERT INTO links (code, long_url, title, created_at, user_id) VALUES (?,?,?,?,?)',
+            [(f'ls{i:05d}', f'https://example.com/{i}', f'Link {i}', f'2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00',
+              user_id) for i in range(150)])
+        link_ids = [r[0] for r in conn.execute('SELECT id FROM links WHERE user_id=?', (user_id,))]
+        conn.executemany('INSERT INTO link_tags (link_id, tag_id) VALUES (?,?)',
+                         [(lid, tid) for lid in link_ids for tid in rng.sample(tag_ids, 3)])
+    client = app.app.test_client()
+    assert client.post('/api/auth/login', json={'username': 'lister', 'password': 'lister'}).status_code == 200
+    return user_id, client
+
+
+@pytest.fixture
+def statements(app):
+    """SQL statements run on this thread's connection (the test client's requests run here too)."""
+    seen = []
+    conn = app.get_db()
+    conn.set_trace_callback(seen.append)
+    yield seen
+    conn.set_trace_callback(None)
+
+
+@pytest.mark.parametrize('per_page', PAGE_SIZES)
+def test_format_links_runs_two_statements(app, lister, statements, per_page):
+    user_id, _ = lister
+    conn = app.get_db()
+    rows = conn.execute('SELECT * FROM links WHERE user_id=? LIMIT ?', (user_id, per_page)).fetchall()
+    statements.clear()
+    links = app.format_links(rows, conn)
+    assert len(links) == per_page and all(len(link['tags']) == 3 for link in links)
+    assert len(statements) == 2   # owners, then tags
+
+
+@pytest.mark.parametrize('count, expected', [
+    ('none', 3),    # the page, its owners, its tags
+    ('exact', 4),   # plus COUNT(*), with the count cache cold
+])
+def test_list_links_statement_count_is_fixed(app, lister, statements, count, expected):
+    _, client = lister
+    counts = {}
+    for per_page in PAGE_SIZES:
+        app.link_counts._entries.clear()
+        statements.clear()
+        resp = client.get(f'/api/links?per_page={per_page}&count={count}')
+        assert resp.status_code == 200 and len(resp.get_json()['links']) == per_page
+        counts[per_page] = len(statements)
+    assert counts == dict.fromkeys(PAGE_SIZES, expected), statements
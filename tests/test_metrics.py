@@ -0,0 +1,40 @@
+"""/metrics is private by default, scrapes only read, and dead workers' counters are kept."""
+
+import json
+import time
+
+
+def test_metrics_needs_admin_or_token(app, monkeypatch):
+    client = app.app.test_client()
+    assert client.get('/metrics').status_code == 401
+    monkeypatch.setattr(app, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).status_code == 200
+    monkeypatch.setattr(app, 'METRICS_TOKEN', '')
+    assert client.post('/api/auth/login', json={'username': 'admin', 'password': 'test'}).status_code == 200
+    assert client.get('/metrics').status_code == 200
+
+
+def test_scrape_is_read_only_and_stale_workers_are_retired(app):
+    metrics = app.metrics
+    stale = json.dumps({'c': [['test_retired_total', [], 7]], 'h': [], 'g': [['test_gauge', [], 1]]})
+    with app.get_db() as conn:
+        conn.execute('INSERT OR REPLACE INTO metrics_snapshots (worker, data, updated_at) VALUES (?,?,?)',
+                     ('gone:1:1', stale, time.time() - 3600))
+
+    seen = []
+    conn = app.get_db()
+    conn.set_trace_callback(seen.append)
+    try:
+        total = metrics.collect()
+    finally:
+        conn.set_trace_callback(None)
+    assert all(sql.lstrip().upper().startswith('SELECT') for sql in seen)
+    assert total['c'][('test_retired_total', ())] == 7
+    assert ('test_gauge', ()) not in total['g']
+
+    metrics.retire_stale()
+    with app.get_db() as conn:
+        workers = {r[0] for r in conn.execute('SELECT worker FROM metrics_snapshots')}
+    assert 'gone:1:1' not in workers and 'retired' in workers
+    assert metrics.collect()['c'][('test_retired_total', ())] == 7
@@ -0,0 +1,40 @@
+"""Click retention never deletes a click its archive file doesn't hold."""
+
+import csv
+import gzip
+import json
+from datetime import date
+
+import pytest
+
+
+def archived_ids(path, archive):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        if archive == 'csv':
+            rows = list(csv.reader(f))
+            assert rows[0][0] == 'id' and all(r[0] != 'id' for r in rows[1:])
+            return [int(r[0]) for r in rows[1:]]
+        return [json.loads(line)['id'] for line in f]
+
+
+@pytest.mark.parametrize('archive, day', [('csv', date(2020, 1, 1)), ('jsonl', date(2020, 1, 2))])
+def test_clicks_added_after_the_archive_are_appended_before_deletion(app, tmp_path, archive, day):
+    retention = app.ClickRetention(1, archive, str(tmp_path), 3600, 2, 0)
+
+    def add_clicks(n):
+        with app.get_db() as conn:
+            link_id = conn.execute('SELECT id FROM links LIMIT 1').fetchone()[0]
+            return [conn.execute('INSERT INTO clicks (link_id, clicked_at, referrer) VALUES (?,?,?)',
+                                 (link_id, f'{day}T{h:02d}:00:00', f'https://example.com/{h}')).lastrowid
+                    for h in range(n)]
+
+    ids = add_clicks(5)
+    # A pass that wrote the archive and stopped before deleting anything
+    path, through = retention._archive_day(day, date.fromordinal(day.toordinal() + 1))
+    assert through == max(ids)
+    ids += add_clicks(3)   # stored after the archive was written
+
+    assert retention.run(days=365) == 8
+    assert sorted(archived_ids(path, archive)) == sorted(ids)
+    with app.get_db() as conn:
+        assert not conn.execute('SELECT 1 FROM clicks WHERE clicked_at LIKE ?', (f'{day}%',)).fetchone()
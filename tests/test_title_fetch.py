@@ -0,0 +1,176 @@
+"""TitleFetcher against a local stub HTTP server."""
+
+import threading
+import time
+
+import pytest
+
+from stubs import StubHandler
+
+SLOW = 0.3   # seconds the /slow pages take
+
+
+class Site(StubHandler):
+    hits       = {}
+    ports      = set()
+    active     = 0
+    max_active = 0
+    lock       = threading.Lock()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        with Site.lock:
+            Site.hits[self.path] = Site.hits.get(self.path, 0) + 1
+            Site.ports.add(self.client_address[1])
+            Site.active += 1
+            Site.max_active = max(Site.max_active, Site.active)
+        try:
+            if path == '/og':
+                self.send(200, '<html><head><title>Plain</title>'
+                               '<meta property="og:title" content="Open Graph"></head><body>x</body></html>')
+            elif path == '/og-reversed':
+                self.send(200, '<head><meta content="Reversed" property="og:title"></head>')
+            elif path == '/title':
+                self.send(200, '<html><head><title> Fish &amp; Chips </title></head><body>'
+                               + 'x' * 2_000_000 + '</body></html>')
+            elif path == '/late-title':
+                self.send(200, '<html><head>' + ' ' * 200_000 + '<title>Too late</title></head></html>')
+            elif path == '/redirect':
+                self.send(302, '', headers=[('Location', '/og')])
+            elif path == '/loop':
+                self.send(302, '', headers=[('Location', '/loop')])
+            elif path == '/text':
+                self.send(200, '<title>not html</title>', ctype='text/plain')
+            elif path == '/missing':
+                self.send(404, '<title>Not Found</title>')
+            elif path == '/latin1':
+                self.send(200, '<title>Caf\xe9</title>'.encode('latin-1'), ctype='text/html; charset=iso-8859-1')
+            elif path == '/bad-charset':
+                self.send(200, '<title>Plain ASCII</title>', ctype='text/html; charset=no-such-codec')
+            elif path == '/slow':
+                time.sleep(SLOW)
+                self.send(200, f'<title>Slow {self.path}</title>')
+            else:
+                self.send(200, f'<title>Page {self.path}</title>')
+        finally:
+            with Site.lock:
+                Site.active -= 1
+
+
+@pytest.fixture
+def base(stub_server):
+    Site.hits.clear()
+    Site.ports.clear()
+    Site.max_active = 0
+    return stub_server(Site)
+
+
+@pytest.fixture
+def fetcher(app):
+    def make(**kw):
+        return app.TitleFetcher(**{'workers': 8, 'per_host': 2, 'timeout': 5.0, 'max_bytes': 65536,
+                                   'cache_size': 1000, 'ttl': 3600, 'negative_ttl': 300, **kw})
+    return make
+
+
+def test_og_title_wins_over_title(base, fetcher):
+    f = fetcher()
+    assert f.title(f'{base}/og') == 'Open Graph'
+    assert f.title(f'{base}/og-reversed') == 'Reversed'
+
+
+def test_entities_and_whitespace(base, fetcher):
+    assert fetcher().title(f'{base}/title') == 'Fish & Chips'
+
+
+def test_large_page_stops_after_head(base, fetcher):
+    start = time.perf_counter()
+    assert fetcher().title(f'{base}/title') == 'Fish & Chips'
+    assert time.perf_counter() - start < 0.5
+
+
+def test_size_cap(base, fetcher):
+    assert fetcher(max_bytes=65536).title(f'{base}/late-title') == ''
+    assert fetcher(max_bytes=400_000).title(f'{base}/late-title') == 'Too late'
+
+
+def test_timeout(base, fetcher):
+    f = fetcher(timeout=SLOW / 3)
+    start = time.perf_counter()
+    assert f.title(f'{base}/slow?timeout') == ''
+    assert time.perf_counter() - start < SLOW
+    time.sleep(SLOW)   # the fetch finishes (timing out) in the background
+    assert f.title(f'{base}/slow?timeout') == ''
+    assert Site.hits['/slow?timeout'] == 1   # and its failure is cached
+    assert f.stats()['failures'] == 1
+
+
+def test_redirects(base, fetcher):
+    f = fetcher()
+    assert f.title(f'{base}/redirect') == 'Open Graph'
+    assert f.title(f'{base}/loop') == ''
+    assert Site.hits['/loop'] == f.MAX_REDIRECTS + 1
+
+
+def test_charset(base, fetcher):
+    f = fetcher()
+    assert f.title(f'{base}/latin1') == 'Café'
+    assert f.title(f'{base}/bad-charset') == 'Plain ASCII'
+
+
+def test_non_html_and_errors(base, fetcher):
+    f = fetcher()
+    assert f.title(f'{base}/text') == ''
+    assert f.title(f'{base}/missing') == ''
+    assert f.title('http://127.0.0.1:9/') == ''
+    assert f.title('ftp://example.com/') == ''
+
+
+def test_positive_and_negative_results_cached(base, fetcher):
+    f = fetcher()
+    for path in ('/og', '/missing', '/text'):
+        f.title(base + path)
+    before = dict(Site.hits)
+    for path in ('/og', '/missing', '/text'):
+        f.title(base + path)
+    assert Site.hits == before
+    assert f.stats()['hits'] == 3
+
+
+def test_negative_cache_expires(base, fetcher):
+    f = fetcher(negative_ttl=0.1)
+    f.title(f'{base}/missing')
+    time.sleep(0.15)
+    f.title(f'{base}/missing')
+    assert Site.hits['/missing'] == 2
+
+
+def test_concurrent_callers_share_one_fetch(base, fetcher):
+    f = fetcher()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(f.title(f'{base}/slow?coalesce')))
+               for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert Site.hits['/slow?coalesce'] == 1
+    assert results == ['Slow /slow?coalesce'] * 20
+
+
+def test_per_host_limit(base, fetcher):
+    f = fetcher()
+    threads = [threading.Thread(target=f.title, args=(f'{base}/slow?host={i}',)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert Site.max_active <= 2
+
+
+def test_keep_alive_connections_reused(base, fetcher):
+    f = fetcher()
+    for i in range(20):
+        f.title(f'{base}/page{i}')
+    assert len(Site.ports) <= 2
+    assert f.reused >= 18